@@ -0,0 +1,171 @@
+"""
+Load-adaptive scaling of the resolved rate limits.
+
+With ADAPTIVE_LIMITS on, a controller samples every ADAPTIVE_INTERVAL_S:
+
+    loop      event-loop lag (how late the controller's own sleep woke up)
+    redis     PING round trip
+    db        SELECT 1, including the wait for a pooled connection
+    egress    download bytes per second leaving this worker
+
+Each signal is smoothed (EWMA) and divided by its target (ADAPTIVE_*_MS,
+ADAPTIVE_EGRESS_BPS; a target of 0 ignores the signal); pressure is the
+worst ratio. Above 1.0 the level drops by ADAPTIVE_DOWN_STEP * pressure,
+below ADAPTIVE_IDLE it creeps up by ADAPTIVE_UP_STEP (AIMD), so a spike is
+answered within a tick or two and capacity is handed back slowly.
+
+The level runs from -1 (full pressure) through 0 (policy as configured) to
++1 (idle) and maps to a per-priority multiplier between that tier's floor
+and ceiling:
+
+    floor(p)   = min(1, ADAPTIVE_FLOOR + p * ADAPTIVE_PRIORITY_STEP)
+    ceiling(p) = ADAPTIVE_CEILING + p * ADAPTIVE_PRIORITY_STEP
+
+Both grow with priority, so at any level a higher tier is scaled at least
+as much as a lower one and the order of effective limits never inverts.
+Only msg_rate_rps/upload_bps/download_bps are scaled; burst and priority
+stay. The level is per worker: every worker reacts to what it sees itself.
+"""
+import asyncio
+import logging
+import time
+from sqlalchemy import text
+from .config import settings
+from .db import engine
+from .policy_table import Limits, policies
+from .redis_client import get_redis
+
+log = logging.getLogger(__name__)
+
+_ALPHA = 0.5  # вага нового семплу в EWMA
+
+
+class AdaptiveLimits:
+    def __init__(self):
+        self.level = 0.0
+        self.signals: dict[str, float] = {}   # згладжені значення: мс або байт/с
+        self.egress_bytes = 0                  # росте в стрімері завантажень
+        self._egress_mark = (0, time.monotonic())
+        self._mult: dict[int, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.ADAPTIVE_LIMITS
+
+    # ---------- множники ----------
+    @staticmethod
+    def bounds(priority: int) -> tuple[float, float]:
+        step = max(0, priority) * settings.ADAPTIVE_PRIORITY_STEP
+        return min(1.0, settings.ADAPTIVE_FLOOR + step), settings.ADAPTIVE_CEILING + step
+
+    def multiplier(self, priority: int) -> float:
+        m = self._mult.get(priority)
+        if m is None:
+            floor, ceiling = self.bounds(priority)
+            lvl = self.level
+            m = 1.0 + (ceiling - 1.0) * lvl if lvl >= 0 else 1.0 + (1.0 - floor) * lvl
+            self._mult[priority] = m
+        return m
+
+    def apply(self, lim: Limits) -> Limits:
+        if not self.enabled or self.level == 0.0:
+            return lim
+        m = self.multiplier(lim.priority)
+
+        def scaled(v: int) -> int:
+            return max(1, round(v * m)) if v > 0 else v
+
+        return lim._replace(
+            msg_rate_rps=scaled(lim.msg_rate_rps),
+            upload_bps=scaled(lim.upload_bps),
+            download_bps=scaled(lim.download_bps),
+        )
+
+    # ---------- сигнали ----------
+    async def _timed(self, coro) -> float:
+        # недоступний або завислий бекенд рахується як таймаут — це теж тиск
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(coro, settings.ADAPTIVE_PROBE_TIMEOUT_S)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.debug("adaptive: probe failed (%r)", e)
+            return settings.ADAPTIVE_PROBE_TIMEOUT_S * 1000
+        return (time.perf_counter() - t0) * 1000
+
+    @staticmethod
+    async def _ping_redis():
+        r = await get_redis()
+        await r.ping()
+
+    @staticmethod
+    async def _ping_db():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    def _egress_bps(self, now: float) -> float:
+        mark_bytes, mark_t = self._egress_mark
+        self._egress_mark = (self.egress_bytes, now)
+        return (self.egress_bytes - mark_bytes) / max(1e-6, now - mark_t)
+
+    def _observe(self, name: str, value: float):
+        prev = self.signals.get(name)
+        self.signals[name] = value if prev is None else prev + _ALPHA * (value - prev)
+
+    def pressure(self) -> float:
+        targets = {
+            "loop": settings.ADAPTIVE_LOOP_LAG_MS,
+            "redis": settings.ADAPTIVE_REDIS_MS,
+            "db": settings.ADAPTIVE_DB_MS,
+            "egress": settings.ADAPTIVE_EGRESS_BPS,
+        }
+        return max((self.signals.get(k, 0.0) / t for k, t in targets.items() if t > 0), default=0.0)
+
+    def step(self, samples: dict[str, float]) -> float:
+        """Feed one round of samples, move the level; returns the pressure."""
+        for name, value in samples.items():
+            self._observe(name, value)
+        p = self.pressure()
+        if p > 1.0:
+            self.level = max(-1.0, self.level - settings.ADAPTIVE_DOWN_STEP * min(p, 4.0))
+        elif p < settings.ADAPTIVE_IDLE:
+            self.level = min(1.0, self.level + settings.ADAPTIVE_UP_STEP)
+        self._mult = {}
+        return p
+
+    async def sample(self, lag_ms: float) -> dict[str, float]:
+        redis_ms, db_ms = await asyncio.gather(self._timed(self._ping_redis()), self._timed(self._ping_db()))
+        return {"loop": lag_ms, "redis": redis_ms, "db": db_ms, "egress": self._egress_bps(time.monotonic())}
+
+    async def run(self):
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(settings.ADAPTIVE_INTERVAL_S)
+            lag_ms = max(0.0, time.monotonic() - t0 - settings.ADAPTIVE_INTERVAL_S) * 1000
+            try:
+                before = self.level
+                p = self.step(await self.sample(lag_ms))
+                if (before < 0) != (self.level < 0) or (before > 0) != (self.level > 0):
+                    log.info("adaptive: level %.2f -> %.2f (pressure %.2f, %s)", before, self.level, p,
+                             {k: round(v, 1) for k, v in self.signals.items()})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("adaptive: tick failed")
+
+    def snapshot(self) -> dict:
+        priorities = sorted({0, policies.default.priority, *(t.priority for t in policies.tiers.values())})
+        return {
+            "enabled": self.enabled,
+            "level": round(self.level, 3),
+            "pressure": round(self.pressure(), 3),
+            "signals": {k: round(v, 2) for k, v in self.signals.items()},
+            "multipliers": {
+                p: {"floor": f, "ceiling": c, "now": round(self.multiplier(p), 3)}
+                for p in priorities for f, c in (self.bounds(p),)
+            },
+        }
+
+
+adaptive = AdaptiveLimits()
@@ -0,0 +1,174 @@
+"""
+Admission control for WebSockets and file transfers.
+
+Each worker caps open sockets and running transfers, both in total and per
+user (ADMIT_MAX_* settings; 0 disables a cap). Capacity is shared by
+priority: a request whose tier priority is p may use at most
+ADMIT_LOW_SHARE + p * ADMIT_PRIORITY_STEP of the worker total (capped at
+1.0), so as a worker fills up the lowest tiers are turned away first and
+the top of the range is kept for higher ones.
+
+Rejections carry a Retry-After that grows with the rejection rate over the
+last second (a reconnect storm is spread wider, up to 10x the base), with
+jitter so a rejected crowd doesn't come back in step:
+HTTP 503 + Retry-After for transfers, close code 1013 (try again later)
+with {"reason", "retry_after_ms"} as the close reason for sockets.
+
+A socket's priority is the best tier among the user's streams. It is only
+looked up once the worker is past the ADMIT_LOW_SHARE band, so in normal
+operation admission costs two dict lookups.
+
+While the worker drains (app.drain sets `closed`) everything is rejected
+with reason "draining" and a Retry-After spread over the DRAIN_RECONNECT_*
+window.
+"""
+import json
+import math
+import random
+import time
+from fastapi import HTTPException
+from .config import settings
+from .db import async_session
+from .policy_table import policies
+from . import dal
+
+WS_TRY_AGAIN_LATER = 1013
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def http(self) -> HTTPException:
+        return HTTPException(
+            503, detail={"error": "overloaded", "reason": self.reason},
+            headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))},
+        )
+
+    def ws_reason(self) -> str:
+        # reason у close-фреймі — до 123 байт
+        return json.dumps({"reason": self.reason, "retry_after_ms": int(self.retry_after * 1000)})
+
+
+class Slot:
+    """One admitted socket/transfer; release() is idempotent."""
+
+    __slots__ = ("gate", "user_id")
+
+    def __init__(self, gate: "Gate", user_id: int):
+        self.gate = gate
+        self.user_id = user_id
+
+    def release(self):
+        if self.gate is not None:
+            self.gate._release(self.user_id)
+            self.gate = None
+
+
+class Gate:
+    def __init__(self, name: str, total_setting: str, per_user_setting: str):
+        self.name = name
+        self._total_setting = total_setting
+        self._per_user_setting = per_user_setting
+        self.in_use = 0
+        self.per_user: dict[int, int] = {}
+        self.rejected: dict[str, int] = {}
+        # відмови за поточну секунду — міра шторму
+        self._win_t = 0.0
+        self._win_n = 0
+
+    @property
+    def limit(self) -> int:
+        return getattr(settings, self._total_setting)
+
+    @property
+    def per_user_limit(self) -> int:
+        return getattr(settings, self._per_user_setting)
+
+    def share(self, priority: int) -> float:
+        return min(1.0, settings.ADMIT_LOW_SHARE + max(0, priority) * settings.ADMIT_PRIORITY_STEP)
+
+    def uncontested(self) -> bool:
+        """Below the band every priority gets; no need to know the caller's tier."""
+        return not self.limit or self.in_use < self.limit * settings.ADMIT_LOW_SHARE
+
+    def _reject(self, reason: str) -> Rejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        now = time.monotonic()
+        if now - self._win_t >= 1.0:
+            self._win_t, self._win_n = now, 0
+        self._win_n += 1
+        storm = self._win_n / max(1, self.limit or self.per_user_limit)
+        base = settings.ADMIT_RETRY_AFTER_S * min(10.0, 1.0 + storm)
+        return Rejected(reason, base * random.uniform(1.0, 1.5))
+
+    def acquire(self, user_id: int, priority: int = 0) -> Slot:
+        per_user = self.per_user_limit
+        if per_user and self.per_user.get(user_id, 0) >= per_user:
+            raise self._reject(f"{self.name}_per_user")
+        limit = self.limit
+        if limit:
+            if self.in_use >= limit:
+                raise self._reject(f"{self.name}_full")
+            if self.in_use >= limit * self.share(priority):
+                raise self._reject(f"{self.name}_shed")
+        self.in_use += 1
+        self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+        return Slot(self, user_id)
+
+    def _release(self, user_id: int):
+        self.in_use -= 1
+        n = self.per_user.get(user_id, 0) - 1
+        if n > 0:
+            self.per_user[user_id] = n
+        else:
+            self.per_user.pop(user_id, None)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_use": self.in_use,
+            "limit": self.limit,
+            "per_user_limit": self.per_user_limit,
+            "users": len(self.per_user),
+            "rejected": dict(self.rejected),
+        }
+
+
+def reconnect_delay() -> float:
+    """Jittered delay before a client should come back to another worker."""
+    return random.uniform(settings.DRAIN_RECONNECT_MIN_S, settings.DRAIN_RECONNECT_MAX_S)
+
+
+class Admission:
+    def __init__(self):
+        self.sockets = Gate("sockets", "ADMIT_MAX_SOCKETS", "ADMIT_MAX_SOCKETS_PER_USER")
+        self.transfers = Gate("transfers", "ADMIT_MAX_TRANSFERS", "ADMIT_MAX_TRANSFERS_PER_USER")
+        self.closed = False
+
+    def _check_open(self, gate: Gate):
+        if self.closed:
+            gate.rejected["draining"] = gate.rejected.get("draining", 0) + 1
+            raise Rejected("draining", reconnect_delay())
+
+    async def user_priority(self, user_id: int) -> int:
+        await policies.refresh()
+        async with async_session() as db:
+            streams = await dal.user_streams(db, user_id)
+        return max((policies.resolve(c, s).priority for c, s in streams), default=policies.default.priority)
+
+    async def admit_socket(self, user_id: int) -> Slot:
+        self._check_open(self.sockets)
+        priority = 0 if self.sockets.uncontested() else await self.user_priority(user_id)
+        return self.sockets.acquire(user_id, priority)
+
+    def admit_transfer(self, user_id: int, priority: int) -> Slot:
+        self._check_open(self.transfers)
+        return self.transfers.acquire(user_id, priority)
+
+    def snapshot(self) -> dict:
+        return {"closed": self.closed, "sockets": self.sockets.snapshot(), "transfers": self.transfers.snapshot()}
+
+
+admission = Admission()
@@ -0,0 +1,106 @@
+"""
+At-rest gzip for attachments.
+
+GzipSampler sits between an upload and its file: it holds back the first
+ATTACHMENT_COMPRESS_SAMPLE bytes, test-compresses them at level 1 and, if
+they shrink below ATTACHMENT_COMPRESS_MAX_RATIO, writes the whole upload as
+one gzip member. Types that are compressed already are never sampled.
+Whatever is decided lands in attachments.encoding / stored_size.
+
+On download a gzip file goes out as is with Content-Encoding: gzip when the
+client accepts it (the limiter counts the smaller wire bytes); otherwise
+GunzipReader inflates it on the fly, a bounded chunk at a time.
+"""
+import re
+import zlib
+from .config import settings
+
+# уже стиснене: семпл лише марно палить CPU
+_PRECOMPRESSED = re.compile(
+    r"^(image/(?!svg)|video/|audio/|font/woff2"
+    r"|application/(zip|gzip|x-gzip|x-bzip2|x-xz|zstd|x-7z-compressed|x-rar-compressed|vnd\.rar|pdf))"
+)
+_GZIP_WBITS = 31
+_READ_CHUNK = 64 * 1024
+
+
+def worth_sampling(content_type: str | None) -> bool:
+    return settings.ATTACHMENT_COMPRESSION and not _PRECOMPRESSED.match((content_type or "").lower())
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() in ("gzip", "*"):
+            q = params.strip()
+            try:
+                return not q.startswith("q=") or float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+class GzipSampler:
+    """Async write()/close() over an aiofiles handle; gzips only if the sample pays off."""
+
+    def __init__(self, out, content_type: str | None):
+        self.out = out
+        self.decided = not worth_sampling(content_type)
+        self._sample = bytearray()
+        self._comp = None
+        self.stored = 0
+
+    @property
+    def encoding(self) -> str | None:
+        return "gzip" if self._comp is not None else None
+
+    async def write(self, data) -> None:
+        if self.decided:
+            await self._emit(data)
+            return
+        self._sample += data
+        if len(self._sample) >= settings.ATTACHMENT_COMPRESS_SAMPLE:
+            await self._decide()
+
+    async def _decide(self):
+        sample, self._sample = bytes(self._sample), bytearray()
+        self.decided = True
+        if len(sample) >= settings.ATTACHMENT_COMPRESS_MIN_BYTES:
+            probe = zlib.compress(sample[:settings.ATTACHMENT_COMPRESS_SAMPLE], 1)
+            if len(probe) <= len(sample) * settings.ATTACHMENT_COMPRESS_MAX_RATIO:
+                self._comp = zlib.compressobj(settings.ATTACHMENT_COMPRESS_LEVEL, zlib.DEFLATED, _GZIP_WBITS)
+        await self._emit(sample)
+
+    async def _emit(self, data):
+        if self._comp is not None:
+            data = self._comp.compress(data)
+        if data:
+            await self.out.write(data)
+            self.stored += len(data)
+
+    async def close(self) -> None:
+        if not self.decided:
+            await self._decide()
+        if self._comp is not None:
+            tail = self._comp.flush()
+            await self.out.write(tail)
+            self.stored += len(tail)
+
+
+class GunzipReader:
+    """read(n) over a gzip aiofiles handle; never inflates more than n bytes at once."""
+
+    def __init__(self, f):
+        self.f = f
+        self._d = zlib.decompressobj(_GZIP_WBITS)
+
+    async def read(self, n: int) -> bytes:
+        out = bytearray()
+        while len(out) < n and not self._d.eof:
+            data = self._d.unconsumed_tail
+            if not data:
+                data = await self.f.read(_READ_CHUNK)
+                if not data:
+                    break
+            out += self._d.decompress(data, n - len(out))
+        return bytes(out)
@@ -2,13 +2,129 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "postgresql+asyncpg://postgres:postgres@db:5432/chat"
+    # пул async-engine: сокети тримають конект лише на час однієї дії
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_S: float = 10.0
+    DB_POOL_RECYCLE_S: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100   # prepared statements asyncpg на конект
+    DB_PGBOUNCER: bool = False           # PgBouncer transaction mode: без кешу prepared statements
     REDIS_URL: str = "redis://redis:6379/0"
+    # single | cluster (REDIS_URL — будь-який вузол) | sharded (клієнтське шардування по REDIS_SHARD_URLS)
+    REDIS_MODE: str = "single"
+    REDIS_SHARD_URLS: str = ""
     UPLOAD_DIR: str = "/data/uploads"
+    # прибирання недописаних аплоадів і файлів-сиріт (app.storage_gc)
+    UPLOAD_STALE_S: int = 3600          # pending-аплоад без запису стільки часу вважається мертвим
+    STORAGE_GC_ENABLED: bool = True
+    STORAGE_GC_INTERVAL_S: float = 600.0
+    STORAGE_GC_BATCH: int = 500         # рядків / файлів каталогу за крок
+    STORAGE_GC_PAUSE_S: float = 0.2     # пауза між кроками — диск і БД лишаються живому трафіку
+    # gzip вкладень на диску (app.compression): рішення — за пробним стисненням початку файлу
+    ATTACHMENT_COMPRESSION: bool = True
+    ATTACHMENT_COMPRESS_LEVEL: int = 6
+    ATTACHMENT_COMPRESS_SAMPLE: int = 65_536
+    ATTACHMENT_COMPRESS_MAX_RATIO: float = 0.8   # стискаємо, якщо семпл вийшов не більшим за 80%
+    ATTACHMENT_COMPRESS_MIN_BYTES: int = 1024
+
+    # місячні партиції messages (app.partitions)
+    MESSAGES_PARTITIONS_AHEAD: int = 3         # скільки місяців наперед тримати створеними
+    MESSAGES_RETENTION_DAYS: int = 0           # 0 — зберігати все
+    MESSAGES_RETENTION_MODE: str = "drop"      # drop | detach (лишити окремою архівною таблицею)
+    MESSAGES_PARTITION_CHECK_S: float = 3600.0
+    MESSAGES_PARTITION_LOCK_TIMEOUT_S: float = 2.0
 
     DEFAULT_MSG_RATE_RPS: int = 5
     DEFAULT_UPLOAD_BPS: int = 262_144   # 256KB/s
     DEFAULT_DOWNLOAD_BPS: int = 524_288 # 512KB/s
     DEFAULT_BURST: int = 10
+    # квоти за замовчуванням (app.usage); 0 — без квоти
+    DEFAULT_QUOTA_MSGS_DAY: int = 0
+    DEFAULT_QUOTA_BYTES_DAY: int = 0     # up + down
+    DEFAULT_QUOTA_BYTES_MONTH: int = 0
+    # як часто воркер звіряє cfg:policy_version і перечитує таблицю політик
+    POLICY_REFRESH_S: float = 1.0
+
+    # де живуть токен-бакети: redis | local (один воркер) | hybrid (redis, а при збої — local)
+    LIMITER_BACKEND: str = "redis"
+    LIMITER_REDIS_TIMEOUT_S: float = 0.05
+    LIMITER_FALLBACK_COOLDOWN_S: float = 5.0
+
+    # курсори прочитання (app.read_state)
+    READ_FLUSH_S: float = 5.0       # як часто курсори й seq каналів пишуться в Postgres
+    READ_RECEIPTS_S: float = 1.0    # період розсилки зведених read.receipts
+
+    # журнал недоставлених подій на користувача (app.offline_queue)
+    OFFLINE_QUEUE_ENABLED: bool = False
+    OFFLINE_QUEUE_MAXLEN: int = 1000          # подій на користувача (MAXLEN ~)
+    OFFLINE_QUEUE_TTL_S: float = 7 * 86400    # старші події обрізаються
+    OFFLINE_QUEUE_BUFFER: int = 10_000        # подій у буфері воркера до запису в Redis
+    OFFLINE_MEMBERS_CACHE_S: float = 30.0     # кеш складу каналів
+    OFFLINE_REPLAY_BATCH: int = 200           # подій в одному replay-фреймі
+
+    # облік використання стрімів (app.usage)
+    USAGE_FLUSH_S: float = 5.0                # буфер воркера -> лічильники в Redis
+    USAGE_ROLLUP_S: float = 60.0              # хвилинні лічильники Redis -> stream_usage
+    USAGE_ROLLUP_BATCH: int = 1000            # пар (стрім, хвилина) за крок
+    USAGE_MINUTE_TTL_S: int = 86_400          # хвилинні хеші в Redis
+    USAGE_MINUTE_RETENTION_DAYS: int = 7      # хвилинні / годинні рядки в Postgres; денні — назавжди
+    USAGE_HOUR_RETENTION_DAYS: int = 90
+
+    # живий стан лімітера для адмінки (app.limiter_view)
+    LIMITER_VIEW_CACHE_S: float = 0.5     # знімок каналу спільний для всіх, хто дивиться
+    LIMITER_VIEW_STREAMS_S: float = 10.0  # кеш списку стрімів каналу
+    LIMITER_VIEW_PUSH_S: float = 1.0      # період push-фіду
+
+    # допуск сокетів і трансферів на воркер (app.admission); 0 — без ліміту
+    ADMIT_MAX_SOCKETS: int = 10_000
+    ADMIT_MAX_SOCKETS_PER_USER: int = 10
+    ADMIT_MAX_TRANSFERS: int = 200
+    ADMIT_MAX_TRANSFERS_PER_USER: int = 4
+    ADMIT_LOW_SHARE: float = 0.8        # частка ліміту, доступна пріоритету 0
+    ADMIT_PRIORITY_STEP: float = 0.1    # +частка за кожен рівень пріоритету тиру
+    ADMIT_RETRY_AFTER_S: float = 2.0    # базова підказка клієнту; росте з перевантаженням
+
+    # адаптивні ліміти (app.adaptive): множник до політики за тиском на воркер
+    ADAPTIVE_LIMITS: bool = False
+    ADAPTIVE_INTERVAL_S: float = 1.0
+    ADAPTIVE_LOOP_LAG_MS: float = 50.0     # цілі сигналів; 0 — сигнал не враховується
+    ADAPTIVE_REDIS_MS: float = 10.0
+    ADAPTIVE_DB_MS: float = 50.0
+    ADAPTIVE_EGRESS_BPS: int = 0           # байт/с завантажень з воркера
+    ADAPTIVE_PROBE_TIMEOUT_S: float = 1.0
+    ADAPTIVE_IDLE: float = 0.5             # тиск нижче — ліміти потроху ростуть
+    ADAPTIVE_UP_STEP: float = 0.05
+    ADAPTIVE_DOWN_STEP: float = 0.25
+    ADAPTIVE_FLOOR: float = 0.25           # множник пріоритету 0 під повним тиском
+    ADAPTIVE_CEILING: float = 2.0          # і в простої
+    ADAPTIVE_PRIORITY_STEP: float = 0.15   # +до floor і ceiling за рівень пріоритету
+
+    # як часто app.transfers шле зведений transfer.progress кожному користувачу
+    TRANSFER_PROGRESS_S: float = 0.5
+
+    # присутність і «друкує…» (app.presence)
+    PRESENCE_TICK_S: float = 1.0              # запис змін статусу і розсилка presence / typing
+    PRESENCE_AWAY_S: float = 120.0            # без активності довше — away
+    PRESENCE_TTL_S: float = 30.0              # хеш воркера живе без оновлень
+    PRESENCE_WORKERS_CACHE_S: float = 5.0     # кеш списку воркерів для читання статусів
+    PRESENCE_TYPING_THROTTLE_S: float = 2.0   # не частіше від одного користувача в канал
+    PRESENCE_TYPING_TTL_S: float = 5.0        # «друкує» гасне без нових натискань
+    PRESENCE_TYPING_MAX: int = 5              # id у фреймі typing; решта — лише лічильником
+
+    # прогрів до першого запиту і /ready (app.warmup)
+    WARMUP_ENABLED: bool = True
+    WARMUP_TIMEOUT_S: float = 30.0     # на кожен крок
+    WARMUP_RETRY_S: float = 5.0        # повтор у фоні, якщо залежність ще недоступна
+    WARMUP_REDIS_CONNS: int = 10
+    READY_TIMEOUT_S: float = 1.0
+    READY_CACHE_S: float = 1.0
+
+    # drain перед зупинкою воркера (app.drain, POST /admin/drain)
+    DRAIN_READY_GRACE_S: float = 2.0       # /ready уже 503, сокети ще живі — балансувальник знімає воркер
+    DRAIN_TRANSFER_DEADLINE_S: float = 30.0
+    DRAIN_RECONNECT_MIN_S: float = 0.5     # клієнти повертаються в цьому вікні, кожен у свій момент
+    DRAIN_RECONNECT_MAX_S: float = 15.0
 
     DEV_MODE: bool = True
     SECRET_KEY: str = "change-me"
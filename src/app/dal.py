@@ -0,0 +1,120 @@
+"""
+Hot-path queries (membership, stream id, message insert, thread counters,
+a user's streams for admission, a channel's members for presence).
+
+Statements are built once at import with bind parameters and run on the
+Core connection, so per call there's no construct building, the compiled
+form and cache key come from SQLAlchemy's caches, and asyncpg reuses its
+per-connection server-side prepared statement (DB_STATEMENT_CACHE_SIZE).
+Results are plain tuples / scalars, never ORM instances. warm() runs the
+read statements once on a fresh connection so its first real request
+doesn't pay for the prepare.
+"""
+from sqlalchemy import bindparam, exists, func, insert, select, update
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from .models import ChannelParticipant, Stream, Message
+
+_cp = ChannelParticipant.__table__
+_st = Stream.__table__
+_msg = Message.__table__
+
+IS_MEMBER = select(
+    exists().where(_cp.c.channel_id == bindparam("channel_id"), _cp.c.user_id == bindparam("user_id"))
+)
+
+STREAM_ID = select(_st.c.id).where(
+    _st.c.channel_id == bindparam("channel_id"), _st.c.owner_user_id == bindparam("user_id")
+)
+
+STREAM_CREATE = (
+    pg_insert(_st)
+    .values(channel_id=bindparam("channel_id"), owner_user_id=bindparam("user_id"))
+    .on_conflict_do_nothing(index_elements=["channel_id", "owner_user_id"])
+    .returning(_st.c.id)
+)
+
+INSERT_MESSAGE = insert(_msg).values(
+    channel_id=bindparam("channel_id"),
+    stream_id=bindparam("stream_id"),
+    sender_id=bindparam("sender_id"),
+    parent_message_id=bindparam("parent_message_id"),
+    content=bindparam("content"),
+    meta=bindparam("meta", type_=JSONB),
+).returning(_msg.c.id)
+
+USER_STREAMS = select(_st.c.channel_id, _st.c.id).where(_st.c.owner_user_id == bindparam("user_id"))
+
+MEMBERS = select(_cp.c.user_id).where(_cp.c.channel_id == bindparam("channel_id")).order_by(_cp.c.user_id)
+
+# лічильники треду; channel_id у умові — відповідь лише в межах того ж каналу
+BUMP_PARENT = (
+    update(_msg)
+    .where(_msg.c.id == bindparam("parent_id"), _msg.c.channel_id == bindparam("channel_id"))
+    .values(reply_count=_msg.c.reply_count + 1, last_reply_at=func.timezone("utc", func.now()))
+    .returning(_msg.c.reply_count, _msg.c.last_reply_at)
+)
+
+
+async def is_member(db: AsyncSession, channel_id: int, user_id: int) -> bool:
+    conn = await db.connection()
+    return bool((await conn.execute(IS_MEMBER, {"channel_id": channel_id, "user_id": user_id})).scalar())
+
+
+async def stream_id(db: AsyncSession, channel_id: int, user_id: int) -> tuple[int, bool]:
+    """(stream_id, created). On create the caller owns the commit."""
+    # без кешу в процесі: стрім зникає разом з каналом, а prepared STREAM_ID і так дешевий
+    conn = await db.connection()
+    params = {"channel_id": channel_id, "user_id": user_id}
+    sid = (await conn.execute(STREAM_ID, params)).scalar()
+    created = False
+    if sid is None:
+        sid = (await conn.execute(STREAM_CREATE, params)).scalar()
+        created = sid is not None
+        if sid is None:
+            # конкурентний запит встиг створити
+            sid = (await conn.execute(STREAM_ID, params)).scalar_one()
+    return sid, created
+
+
+async def insert_message(db: AsyncSession, channel_id: int, stream_id: int, sender_id: int,
+                         content: str | None, meta: dict, parent_message_id: int | None = None) -> int:
+    conn = await db.connection()
+    res = await conn.execute(INSERT_MESSAGE, {
+        "channel_id": channel_id,
+        "stream_id": stream_id,
+        "sender_id": sender_id,
+        "parent_message_id": parent_message_id,
+        "content": content,
+        "meta": meta,
+    })
+    return res.scalar_one()
+
+
+async def bump_parent(db: AsyncSession, channel_id: int, parent_id: int) -> tuple[int, object] | None:
+    """(reply_count, last_reply_at) after the bump, None if no such parent in the channel."""
+    conn = await db.connection()
+    row = (await conn.execute(BUMP_PARENT, {"parent_id": parent_id, "channel_id": channel_id})).first()
+    return tuple(row) if row else None
+
+
+async def user_streams(db: AsyncSession, user_id: int) -> list[tuple[int, int]]:
+    """(channel_id, stream_id) of every stream the user owns."""
+    conn = await db.connection()
+    return [tuple(r) for r in (await conn.execute(USER_STREAMS, {"user_id": user_id})).all()]
+
+
+async def members(db: AsyncSession, channel_id: int) -> list[int]:
+    conn = await db.connection()
+    return list((await conn.execute(MEMBERS, {"channel_id": channel_id})).scalars())
+
+
+async def warm(conn: AsyncConnection):
+    """Prepare the hot read statements on `conn`; the ids match nothing."""
+    for stmt, params in (
+        (IS_MEMBER, {"channel_id": 0, "user_id": 0}),
+        (STREAM_ID, {"channel_id": 0, "user_id": 0}),
+        (USER_STREAMS, {"user_id": 0}),
+        (MEMBERS, {"channel_id": 0}),
+    ):
+        (await conn.execute(stmt, params)).all()
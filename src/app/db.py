@@ -1,20 +1,123 @@
 import json
+import time
+import uuid
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
 from sqlalchemy.ext.asyncio import AsyncAttrs, create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False, future=True)
-sync_engine = create_engine(
-    settings.DATABASE_URL.replace("asyncpg://", "psycopg2://"),
+
+class PoolStats:
+    """Checkout wait accounting for the async engine's pool."""
+
+    BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.histogram = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def record(self, wait_s: float, timed_out: bool = False):
+        self.checkouts += 1
+        self.timeouts += timed_out
+        self.total_wait_s += wait_s
+        self.max_wait_s = max(self.max_wait_s, wait_s)
+        ms = wait_s * 1000.0
+        i = 0
+        while i < len(self.BUCKETS_MS) and ms > self.BUCKETS_MS[i]:
+            i += 1
+        self.histogram[i] += 1
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b}ms" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.total_wait_s / self.checkouts * 1000.0 if self.checkouts else 0.0,
+            "max_wait_ms": self.max_wait_s * 1000.0,
+            "wait_histogram": dict(zip(labels, self.histogram)),
+        }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super().connect()
+        except exc.TimeoutError:
+            pool_stats.record(time.perf_counter() - t0, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - t0)
+        return conn
+
+
+def _connect_args() -> dict:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer (transaction mode): prepared statements не переживають
+        # повернення сервер-конекту в пул — вимикаємо кеші, імена унікальні
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+
+
+engine = create_async_engine(
+    settings.DATABASE_URL,
     echo=False,
-    pool_pre_ping=True,
     future=True,
-    json_serializer=lambda obj: json.dumps(obj, ensure_ascii=False),
-    json_deserializer=json.loads,
+    poolclass=InstrumentedPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_S,
+    pool_recycle=settings.DB_POOL_RECYCLE_S,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args=_connect_args(),
 )
 async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+
+_sync_engine = None
+
+
+def get_sync_engine():
+    """psycopg2 engine for Alembic and scripts; created (and psycopg2 imported) on first use only."""
+    global _sync_engine
+    if _sync_engine is None:
+        _sync_engine = create_engine(
+            settings.DATABASE_URL.replace("asyncpg://", "psycopg2://"),
+            echo=False,
+            pool_pre_ping=True,
+            future=True,
+            json_serializer=lambda obj: json.dumps(obj, ensure_ascii=False),
+            json_deserializer=json.loads,
+        )
+    return _sync_engine
+
+
+def pool_status() -> dict:
+    p = engine.pool
+    return {
+        "size": p.size(),
+        "checked_out": p.checkedout(),
+        "overflow": p.overflow(),
+        "checked_in": p.checkedin(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "timeout_s": settings.DB_POOL_TIMEOUT_S,
+        "pgbouncer": settings.DB_PGBOUNCER,
+        **pool_stats.snapshot(),
+    }
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
@@ -0,0 +1,98 @@
+"""
+Graceful drain of a worker before it stops.
+
+Triggered by POST /admin/drain (a preStop hook) and, as a last resort, by
+on_shutdown:
+
+    1. admission is closed: new sockets and transfers are refused with
+       reason "draining", and /ready answers 503 so the balancer stops
+       routing here; DRAIN_READY_GRACE_S gives it time to notice
+    2. every open socket is closed with 1012 (service restart) and
+       {"reason": "draining", "retry_after_ms"} as the close reason; the
+       delay is drawn per socket from DRAIN_RECONNECT_MIN_S..MAX_S, so the
+       clients come back to the other workers spread over that window
+       instead of all at once (they resume from the offline journal)
+    3. running transfers (uploads, downloads) get up to
+       DRAIN_TRANSFER_DEADLINE_S to finish
+    4. buffered writes are flushed: offline journal, read positions, usage
+
+Running it again returns the report of the first run.
+"""
+import asyncio
+import json
+import logging
+import time
+from .admission import admission, reconnect_delay
+from .config import settings
+from .offline_queue import offline
+from .read_state import reads
+from .usage import usage
+from .ws import manager
+
+log = logging.getLogger(__name__)
+
+WS_SERVICE_RESTART = 1012
+
+
+class Drain:
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    async def run(self, grace: bool = True) -> dict:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(grace))
+        # shield: обірваний запит адміна не повинен обривати сам drain
+        return await asyncio.shield(self._task)
+
+    async def _close_sockets(self) -> int:
+        async def close(ws):
+            reason = json.dumps({"reason": "draining", "retry_after_ms": int(reconnect_delay() * 1000)})
+            try:
+                await ws.close(code=WS_SERVICE_RESTART, reason=reason)
+            except Exception:
+                pass  # уже мертвий — прибере finally в websocket_endpoint
+        sockets = list(manager.ws_to_user)
+        await asyncio.gather(*(close(ws) for ws in sockets))
+        return len(sockets)
+
+    async def _wait_transfers(self) -> int:
+        deadline = time.monotonic() + settings.DRAIN_TRANSFER_DEADLINE_S
+        while admission.transfers.in_use and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return admission.transfers.in_use
+
+    async def _flush(self) -> dict:
+        out = {}
+        for name, flush in (("offline", offline.flush), ("reads", reads.flush), ("usage", usage.flush)):
+            try:
+                await flush()
+                out[name] = True
+            except Exception:
+                log.exception("drain: %s flush failed", name)
+                out[name] = False
+        return out
+
+    async def _run(self, grace: bool) -> dict:
+        t0 = time.monotonic()
+        admission.closed = True
+        log.info("drain: admission closed, %d sockets, %d transfers",
+                 len(manager.ws_to_user), admission.transfers.in_use)
+        if grace:
+            await asyncio.sleep(settings.DRAIN_READY_GRACE_S)
+        report = {"sockets_closed": await self._close_sockets()}
+        left = await self._wait_transfers()
+        report["transfers_finished"] = left == 0
+        report["transfers_left"] = left
+        report["flushed"] = await self._flush()
+        report["elapsed_s"] = round(time.monotonic() - t0, 2)
+        if left:
+            log.warning("drain: deadline hit with %d transfers still running", left)
+        log.info("drain done: %s", report)
+        return report
+
+
+drain = Drain()
@@ -0,0 +1,62 @@
+"""
+Redis key schema.
+
+Every key carries a Redis Cluster hash tag ({...}) naming the entity it
+belongs to, so all keys of one stream / channel / user land in the same
+slot (and on the same shard with client-side sharding). Multi-key scripts
+and pipelines may only combine keys with the same tag.
+
+    rl:{s<stream_id>}:<kind>      token bucket (kind: msgs | up | down | ...)
+    ch:{c<channel_id>}:<suffix>   per-channel state
+    u:{u<user_id>}:<suffix>       per-user state
+    us:{s<stream_id>}:<suffix>    per-stream usage counters (app.usage)
+    pr:{w<worker>}                users connected to one worker and their status (app.presence)
+    cfg:<name>                    global keys shared by all workers (cfg:policy_version)
+"""
+
+
+def stream_tag(stream_id: int) -> str:
+    return f"{{s{stream_id}}}"
+
+
+def channel_tag(channel_id: int) -> str:
+    return f"{{c{channel_id}}}"
+
+
+def user_tag(user_id: int) -> str:
+    return f"{{u{user_id}}}"
+
+
+def limiter(stream_id: int, kind: str) -> str:
+    return f"rl:{stream_tag(stream_id)}:{kind}"
+
+
+def usage(stream_id: int, suffix: str) -> str:
+    return f"us:{stream_tag(stream_id)}:{suffix}"
+
+
+def channel(channel_id: int, suffix: str) -> str:
+    return f"ch:{channel_tag(channel_id)}:{suffix}"
+
+
+def user(user_id: int, suffix: str) -> str:
+    return f"u:{user_tag(user_id)}:{suffix}"
+
+
+def presence(worker: str) -> str:
+    return f"pr:{{w{worker}}}"
+
+
+def config(name: str) -> str:
+    return f"cfg:{name}"
+
+
+def hash_tag(key: str | bytes) -> bytes:
+    """The part of the key Redis Cluster hashes (same rules as CLUSTER KEYSLOT)."""
+    k = key.encode() if isinstance(key, str) else bytes(key)
+    start = k.find(b"{")
+    if start != -1:
+        end = k.find(b"}", start + 1)
+        if end > start + 1:
+            return k[start + 1:end]
+    return k
@@ -0,0 +1,132 @@
+"""
+Live limiter state of every stream in a channel, for the admin dashboard.
+
+One pipeline per snapshot, whatever the number of streams: per stream the
+three token buckets (HMGET tokens ts) and the usage hashes of the current
+and previous minute (app.usage). Buckets are refilled to `now` in Python
+with the stream's effective limits (policy table + app.adaptive), the same
+way the limiter would see them on its next call. With LIMITER_BACKEND=local
+the buckets are read from this worker's memory instead.
+
+    tokens / capacity    what a request could take right now
+    rate                 effective refill rate (rps or B/s)
+    used_per_s           what was actually granted over the last 1-2 minutes
+    throttled            refusals (msgs) / stalls (up, down) in that window
+
+Usage numbers lag by up to USAGE_FLUSH_S. Snapshots are cached per channel
+for LIMITER_VIEW_CACHE_S, so any number of dashboards watching one channel
+cost one pipeline per interval.
+"""
+import time
+from sqlalchemy import select
+from .adaptive import adaptive
+from .config import settings
+from .db import async_session
+from .models import Stream
+from .policy_table import policies
+from .rate_limiter import RedisBackend, _local_backend, _refill
+from .redis_client import get_redis
+from .usage import KINDS
+from . import keys
+
+# вид бакета -> (rate, capacity) так, як їх передають виклики лімітера (ws.py, routes/files.py);
+# порядок — як у usage.KINDS
+_BUCKETS = (
+    ("msgs", lambda lim: (lim.msg_rate_rps, lim.burst)),
+    ("up", lambda lim: (lim.upload_bps, lim.upload_bps * 2)),
+    ("down", lambda lim: (lim.download_bps, lim.download_bps * 2)),
+)
+
+
+class LimiterView:
+    def __init__(self):
+        # channel_id -> (expires_at, snapshot)
+        self._cache: dict[int, tuple[float, dict]] = {}
+        # channel_id -> (expires_at, [(stream_id, owner_user_id), ...])
+        self._streams: dict[int, tuple[float, list[tuple[int, int]]]] = {}
+
+    async def _channel_streams(self, channel_id: int) -> list[tuple[int, int]]:
+        hit = self._streams.get(channel_id)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        async with async_session() as db:
+            rows = (await db.execute(
+                select(Stream.id, Stream.owner_user_id).where(Stream.channel_id == channel_id).order_by(Stream.id)
+            )).all()
+        streams = [(r.id, r.owner_user_id) for r in rows]
+        self._streams[channel_id] = (time.monotonic() + settings.LIMITER_VIEW_STREAMS_S, streams)
+        return streams
+
+    async def _read(self, sids: list[int], minute: int) -> tuple[list, list]:
+        """Bucket [tokens, ts] per stream and kind, usage hashes per stream (this + previous minute)."""
+        local = settings.LIMITER_BACKEND == "local"
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        for sid in sids:
+            if not local:
+                for kind in KINDS:
+                    pipe.hmget(keys.limiter(sid, kind), "tokens", "ts")
+            pipe.hgetall(keys.usage(sid, f"m{minute}"))
+            pipe.hgetall(keys.usage(sid, f"m{minute - 1}"))
+        res = await pipe.execute()
+        per = 2 if local else 2 + len(_BUCKETS)
+        buckets, usage = [], []
+        now = time.time()
+        for i, sid in enumerate(sids):
+            chunk = res[i * per:(i + 1) * per]
+            if local:
+                lb = _local_backend.buckets
+                state = [lb.get(keys.limiter(sid, kind)) for kind in KINDS]
+                # протухлий бакет лімітер і так вважає повним (ts = 0)
+                buckets.append([(b[0], b[1]) if b and b[2] > now else (0.0, 0.0) for b in state])
+            else:
+                f = RedisBackend._to_float
+                buckets.append([(f(t), f(ts)) for t, ts in chunk[:len(_BUCKETS)]])
+            usage.append(chunk[-2:])
+        return buckets, usage
+
+    async def snapshot(self, channel_id: int) -> dict:
+        now_m = time.monotonic()
+        hit = self._cache.get(channel_id)
+        if hit and hit[0] > now_m:
+            return hit[1]
+        streams = await self._channel_streams(channel_id)
+        await policies.refresh()
+        now = time.time()
+        minute = int(now // 60)
+        # вікно: попередня хвилина повністю + поточна до now
+        window = 60.0 + (now - minute * 60)
+        buckets, usage = await self._read([sid for sid, _ in streams], minute)
+        out = []
+        for (sid, owner), bk, (cur, prev) in zip(streams, buckets, usage):
+            lim = adaptive.apply(policies.resolve(channel_id, sid))
+            row = {"stream_id": sid, "owner_user_id": owner, "priority": lim.priority}
+            cur, prev = cur or {}, prev or {}
+            for (kind, limits), (tokens, ts) in zip(_BUCKETS, bk):
+                rate, cap = limits(lim)
+                level = _refill(tokens, ts, now, float(rate), float(cap))
+                used = int(cur.get(kind.encode(), 0)) + int(prev.get(kind.encode(), 0))
+                thr = f"thr_{kind}".encode()
+                row[kind] = {
+                    "tokens": round(level, 1),
+                    "capacity": cap,
+                    "rate": rate,
+                    "used_per_s": round(used / window, 2),
+                    "throttled": int(cur.get(thr, 0)) + int(prev.get(thr, 0)),
+                }
+            out.append(row)
+        snap = {
+            "channel_id": channel_id,
+            "ts": now,
+            "window_s": round(window, 1),
+            "adaptive_level": round(adaptive.level, 3) if adaptive.enabled else None,
+            "streams": out,
+        }
+        self._cache[channel_id] = (now_m + settings.LIMITER_VIEW_CACHE_S, snap)
+        # протухлі знімки інших каналів не накопичуємо
+        for cid in [c for c, (exp, _) in self._cache.items() if exp <= now_m]:
+            del self._cache[cid]
+        return snap
+
+
+limiter_view = LimiterView()
@@ -1,13 +1,28 @@
+import asyncio
+import logging
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from .db import engine, Base, async_session
-from .routes import admin, files
-from .ws import websocket_endpoint
+from .drain import drain
+from .routes import admin, bulk, files, history, messages
+from .ws import manager, websocket_endpoint
 from .config import settings
+from .redis_client import close_redis
+from . import partitions
+from .offline_queue import offline
+from .presence import presence
+from .read_state import reads
+from .storage_gc import collector
+from .adaptive import adaptive
+from .transfers import transfers
+from .usage import usage
+from .warmup import readiness
 from . import models  # noqa
-from sqlalchemy import select, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+log = logging.getLogger(__name__)
 
 app = FastAPI(title="Priority Streams Chat")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True)
@@ -24,30 +39,70 @@ async def admin_index():
 
 @app.get("/health")
 async def health():
+    # liveness: процес живий; чи можна слати трафік — /ready
     return {"ok": True}
 
+@app.get("/ready")
+async def ready():
+    res = await readiness.check()
+    return JSONResponse(res, status_code=200 if res["ready"] else 503)
+
 @app.on_event("startup")
 async def on_startup():
     # async with engine.begin() as conn:
     #     await conn.run_sync(Base.metadata.create_all)
     if settings.DEV_MODE:
+        # три idempotent-вставки в одній транзакції замість select-перед-insert на кожен рядок
         async with async_session() as s:
             from .models import User, Channel, ChannelParticipant
-            for uid, name in ((1, "Alice"), (2, "Bob")):
-                q = await s.execute(select(User).where(User.id == uid))
-                if not q.scalar_one_or_none():
-                    await s.execute(insert(User).values(id=uid, display_name=name, email=f"{name.lower()}@demo.local"))
-            q = await s.execute(select(Channel).where(Channel.id == 1))
-            if not q.scalar_one_or_none():
-                await s.execute(insert(Channel).values(id=1, name="General", is_group=True))
-            for uid in (1, 2):
-                q = await s.execute(select(ChannelParticipant).where(ChannelParticipant.channel_id == 1, ChannelParticipant.user_id == uid))
-                if not q.scalar_one_or_none():
-                    await s.execute(insert(ChannelParticipant).values(channel_id=1, user_id=uid, role="member"))
+            await s.execute(pg_insert(User).values([
+                {"id": uid, "display_name": name, "email": f"{name.lower()}@demo.local"}
+                for uid, name in ((1, "Alice"), (2, "Bob"))
+            ]).on_conflict_do_nothing(index_elements=["id"]))
+            await s.execute(pg_insert(Channel).values(id=1, name="General", is_group=True)
+                            .on_conflict_do_nothing(index_elements=["id"]))
+            await s.execute(pg_insert(ChannelParticipant).values([
+                {"channel_id": 1, "user_id": uid, "role": "member"} for uid in (1, 2)
+            ]).on_conflict_do_nothing(index_elements=["channel_id", "user_id"]))
             await s.commit()
+    # пули, скрипти й політики — до першого запиту; якщо залежність лежить, добиваємо у фоні
+    if not await readiness.warm_up():
+        app.state.warmup_task = asyncio.create_task(readiness.retry())
+    app.state.partition_task = asyncio.create_task(partitions.run_maintenance())
+    app.state.read_task = asyncio.create_task(reads.run(manager.broadcast_channel))
+    app.state.transfer_task = asyncio.create_task(transfers.run(manager.send_user))
+    app.state.usage_task = asyncio.create_task(usage.run())
+    app.state.presence_task = asyncio.create_task(
+        presence.run(manager.broadcast_channel, lambda uid: manager.user_channels.get(uid, ()))
+    )
+    if offline.enabled:
+        app.state.offline_task = asyncio.create_task(offline.run())
+    if settings.STORAGE_GC_ENABLED:
+        app.state.storage_gc_task = asyncio.create_task(collector.run())
+    if adaptive.enabled:
+        app.state.adaptive_task = asyncio.create_task(adaptive.run())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for name in ("partition_task", "read_task", "transfer_task", "offline_task", "storage_gc_task",
+                 "adaptive_task", "usage_task", "warmup_task", "presence_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    # без preStop-хука (POST /admin/drain) — хоча б дочекатися передач і скинути буфери;
+    # якщо drain уже був, повертає його звіт
+    await drain.run(grace=False)
+    try:
+        await presence.close()
+    except Exception:
+        log.exception("presence: cleanup failed")
+    await close_redis()
 
 app.include_router(admin.router)
+app.include_router(bulk.router)
 app.include_router(files.router)
+app.include_router(history.router)
+app.include_router(messages.router)
 
 @app.websocket("/ws")
 async def ws_route(ws: WebSocket):
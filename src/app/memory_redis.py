@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import time
+from collections import Counter
+from redis.exceptions import NoScriptError, ResponseError
+
+
+def _b(val) -> bytes:
+    if isinstance(val, bytes):
+        return val
+    if isinstance(val, bytearray):
+        return bytes(val)
+    if isinstance(val, float):
+        return repr(val).encode()
+    return str(val).encode()
+
+
+class MemoryRedis:
+    """
+    In-process stand-in for redis.asyncio.Redis (the subset the app uses).
+    Values come back as bytes like the real client; TTLs follow `clock`.
+    `latency` is awaited on every command (0 still yields to the loop, so
+    concurrent callers interleave the way they do over a real socket).
+    `calls` counts commands by name. Lua scripts are not interpreted: each
+    script the app uses registers a Python twin under its SHA1.
+    """
+
+    scripts: dict = {}
+
+    def __init__(self, clock=time.time, latency: float = 0.0):
+        self.clock = clock
+        self.latency = latency
+        self.data: dict[bytes, object] = {}
+        self.expires: dict[bytes, float] = {}
+        self.calls: Counter = Counter()
+
+    async def _cmd(self, name: str):
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency)
+
+    def _alive(self, key: bytes) -> bool:
+        exp = self.expires.get(key)
+        if exp is not None and exp <= self.clock():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _hash(self, key: bytes, create: bool = False) -> dict | None:
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = {}
+        h = self.data[key]
+        if not isinstance(h, dict):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return h
+
+    # ---------- keys ----------
+    async def ping(self) -> bool:
+        await self._cmd("ping")
+        return True
+
+    async def get(self, key):
+        await self._cmd("get")
+        k = _b(key)
+        return self.data[k] if self._alive(k) else None
+
+    async def set(self, key, value, ex: int | None = None):
+        await self._cmd("set")
+        k = _b(key)
+        self.data[k] = _b(value)
+        self.expires.pop(k, None)
+        if ex:
+            self.expires[k] = self.clock() + ex
+        return True
+
+    async def delete(self, *keys) -> int:
+        await self._cmd("delete")
+        n = 0
+        for key in keys:
+            k = _b(key)
+            if self._alive(k):
+                n += 1
+            self.data.pop(k, None)
+            self.expires.pop(k, None)
+        return n
+
+    async def exists(self, *keys) -> int:
+        await self._cmd("exists")
+        return sum(self._alive(_b(k)) for k in keys)
+
+    async def incr(self, key, amount: int = 1) -> int:
+        await self._cmd("incr")
+        k = _b(key)
+        try:
+            n = int(self.data[k]) + amount if self._alive(k) else amount
+        except ValueError:
+            raise ResponseError("value is not an integer or out of range")
+        self.data[k] = _b(n)
+        return n
+
+    incrby = incr
+
+    async def expire(self, key, seconds: int) -> bool:
+        await self._cmd("expire")
+        k = _b(key)
+        if not self._alive(k):
+            return False
+        self.expires[k] = self.clock() + seconds
+        return True
+
+    # ---------- hashes ----------
+    async def hgetall(self, key) -> dict:
+        await self._cmd("hgetall")
+        h = self._hash(_b(key))
+        return dict(h) if h else {}
+
+    async def hset(self, key, field=None, value=None, mapping: dict | None = None) -> int:
+        await self._cmd("hset")
+        h = self._hash(_b(key), create=True)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = 0
+        for f, v in items.items():
+            fk = _b(f)
+            added += fk not in h
+            h[fk] = _b(v)
+        return added
+
+    async def hdel(self, key, *fields) -> int:
+        await self._cmd("hdel")
+        k = _b(key)
+        h = self._hash(k)
+        if not h:
+            return 0
+        n = sum(h.pop(_b(f), None) is not None for f in fields)
+        if not h:
+            self.data.pop(k, None)
+            self.expires.pop(k, None)
+        return n
+
+    async def hmget(self, key, *fields) -> list:
+        await self._cmd("hmget")
+        h = self._hash(_b(key)) or {}
+        return [h.get(_b(f)) for f in fields]
+
+    async def hincrby(self, key, field, amount: int = 1) -> int:
+        await self._cmd("hincrby")
+        h = self._hash(_b(key), create=True)
+        fk = _b(field)
+        try:
+            n = int(h.get(fk, 0)) + int(amount)
+        except ValueError:
+            raise ResponseError("hash value is not an integer")
+        h[fk] = _b(n)
+        return n
+
+    # ---------- sets ----------
+    def _set(self, key: bytes, create: bool = False) -> "set[bytes] | None":
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = set()
+        s = self.data[key]
+        if not isinstance(s, set):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return s
+
+    async def sadd(self, key, *members) -> int:
+        await self._cmd("sadd")
+        s = self._set(_b(key), create=True)
+        before = len(s)
+        s.update(_b(m) for m in members)
+        return len(s) - before
+
+    async def spop(self, key, count: int | None = None):
+        await self._cmd("spop")
+        k = _b(key)
+        s = self._set(k)
+        if not s:
+            return [] if count is not None else None
+        out = [s.pop() for _ in range(min(len(s), count or 1))]
+        if not s:
+            self.data.pop(k, None)
+            self.expires.pop(k, None)
+        return out if count is not None else out[0]
+
+    async def srem(self, key, *members) -> int:
+        await self._cmd("srem")
+        k = _b(key)
+        s = self._set(k)
+        if not s:
+            return 0
+        n = sum(_b(m) in s for m in members)
+        s.difference_update(_b(m) for m in members)
+        if not s:
+            self.data.pop(k, None)
+            self.expires.pop(k, None)
+        return n
+
+    async def smembers(self, key) -> set:
+        await self._cmd("smembers")
+        return set(self._set(_b(key)) or ())
+
+    async def scard(self, key) -> int:
+        await self._cmd("scard")
+        return len(self._set(_b(key)) or ())
+
+    # ---------- streams ----------
+    def _stream(self, key: bytes, create: bool = False) -> list | None:
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = []
+        st = self.data[key]
+        if not isinstance(st, list):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return st
+
+    @staticmethod
+    def _sid(val) -> tuple[int, int]:
+        ms, _, seq = _b(val).partition(b"-")
+        return int(ms), int(seq or 0)
+
+    @staticmethod
+    def _trim(st: list, maxlen: int | None, minid) -> int:
+        n = len(st)
+        if minid is not None:
+            lo = MemoryRedis._sid(minid)
+            st[:] = [e for e in st if MemoryRedis._sid(e[0]) >= lo]
+        if maxlen is not None and len(st) > maxlen:
+            del st[:len(st) - maxlen]
+        return n - len(st)
+
+    async def xadd(self, name, fields: dict, id="*", maxlen: int | None = None, approximate: bool = True,
+                   nomkstream: bool = False, minid=None, limit=None):
+        await self._cmd("xadd")
+        st = self._stream(_b(name), create=True)
+        last = self._sid(st[-1][0]) if st else (0, 0)
+        ms = int(self.clock() * 1000)
+        sid = (ms, 0) if ms > last[0] else (last[0], last[1] + 1)
+        eid = b"%d-%d" % sid
+        st.append((eid, {_b(k): _b(v) for k, v in fields.items()}))
+        self._trim(st, maxlen, minid)
+        return eid
+
+    async def xrange(self, name, min="-", max="+", count: int | None = None) -> list:
+        await self._cmd("xrange")
+        st = self._stream(_b(name)) or []
+
+        def bound(v, edge):
+            v = _b(v)
+            if v in (b"-", b"+"):
+                return None, False
+            excl = v.startswith(b"(")
+            return self._sid(v[1:] if excl else v), excl
+
+        lo, lo_x = bound(min, 0)
+        hi, hi_x = bound(max, 1)
+        out = []
+        for eid, fields in st:
+            i = self._sid(eid)
+            if lo is not None and (i < lo or (lo_x and i == lo)):
+                continue
+            if hi is not None and (i > hi or (hi_x and i == hi)):
+                break
+            out.append((eid, dict(fields)))
+            if count is not None and len(out) >= count:
+                break
+        return out
+
+    async def xtrim(self, name, maxlen: int | None = None, approximate: bool = True, minid=None, limit=None) -> int:
+        await self._cmd("xtrim")
+        st = self._stream(_b(name))
+        return self._trim(st, maxlen, minid) if st is not None else 0
+
+    async def xlen(self, name) -> int:
+        await self._cmd("xlen")
+        return len(self._stream(_b(name)) or [])
+
+    # ---------- scripts ----------
+    @classmethod
+    def register_script(cls, sha: str, fn):
+        """fn(mem: MemoryRedis, keys: list[bytes], args: list[bytes]) — runs atomically (no awaits)."""
+        cls.scripts[sha] = fn
+
+    async def script_load(self, script: str) -> str:
+        await self._cmd("script_load")
+        sha = hashlib.sha1(script.encode()).hexdigest()
+        if sha not in self.scripts:
+            raise ResponseError("MemoryRedis: no Python implementation registered for this script")
+        return sha
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        await self._cmd("evalsha")
+        fn = self.scripts.get(sha)
+        if fn is None:
+            raise NoScriptError("NOSCRIPT No matching script.")
+        return fn(self, [_b(k) for k in keys_and_args[:numkeys]], [_b(a) for a in keys_and_args[numkeys:]])
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args):
+        sha = hashlib.sha1(script.encode()).hexdigest()
+        if sha not in self.scripts:
+            raise ResponseError("MemoryRedis: no Python implementation registered for this script")
+        return await self.evalsha(sha, numkeys, *keys_and_args)
+
+    def pipeline(self, transaction: bool = False) -> "_Pipeline":
+        return _Pipeline(self)
+
+    async def close(self):
+        return None
+
+    aclose = close
+
+    def flushall(self):
+        self.data.clear()
+        self.expires.clear()
+
+
+class _Pipeline:
+    """Buffers calls and runs them back to back on execute() (one 'round trip')."""
+
+    def __init__(self, mem: MemoryRedis):
+        self.mem = mem
+        self.calls: list = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        mem, calls, self.calls = self.mem, self.calls, []
+        mem.calls["pipeline"] += 1
+        latency, mem.latency = mem.latency, 0.0
+        try:
+            await asyncio.sleep(latency)
+            return [await getattr(mem, name)(*args, **kwargs) for name, args, kwargs in calls]
+        finally:
+            mem.latency = latency
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.calls = []
+
+
+_shared: MemoryRedis | None = None
+
+
+def shared() -> MemoryRedis:
+    """Process-wide instance behind REDIS_URL=memory:// (single worker only)."""
+    global _shared
+    if _shared is None:
+        _shared = MemoryRedis()
+    return _shared
@@ -31,7 +31,7 @@ if SRC_DIR.is_dir() and str(SRC_DIR) not in sys.path:
 
 # ---------- тепер імпорти з твого проєкту ----------
 # приклад з твого коду:
-from app.db import sync_engine, Base  # має існувати пакет app та __init__.py
+from app.db import get_sync_engine, Base  # має існувати пакет app та __init__.py
 # якщо моделі розкидані, цей імпорт ініціалізує їх у Base.metadata
 from app import models as _models  # noqa: F401
 
@@ -63,7 +63,7 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 def run_migrations_online() -> None:
-    connectable = sync_engine
+    connectable = get_sync_engine()
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
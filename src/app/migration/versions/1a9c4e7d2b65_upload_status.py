@@ -0,0 +1,35 @@
+"""upload status and placeholder index
+
+Revision ID: 1a9c4e7d2b65
+Revises: f2b6d93c7e40
+Create Date: 2026-10-19 19:47:12.508316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1a9c4e7d2b65'
+down_revision: Union[str, Sequence[str], None] = 'f2b6d93c7e40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # наявні вкладення вже дописані — complete
+    op.add_column('attachments', sa.Column('status', sa.String(length=16), server_default='complete', nullable=False))
+    op.create_index('ix_attachments_status_open', 'attachments', ['status'], unique=False,
+                    postgresql_where=sa.text("status <> 'complete'"))
+    op.create_index('ix_msg_file_placeholder', 'messages', ['created_at'], unique=False,
+                    postgresql_where=sa.text("meta->>'kind' = 'file' AND meta->>'attachment_id' IS NULL"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_msg_file_placeholder', table_name='messages')
+    op.drop_index('ix_attachments_status_open', table_name='attachments')
+    op.drop_column('attachments', 'status')
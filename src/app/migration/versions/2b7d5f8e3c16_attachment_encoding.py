@@ -0,0 +1,33 @@
+"""attachment at-rest encoding
+
+Revision ID: 2b7d5f8e3c16
+Revises: 1a9c4e7d2b65
+Create Date: 2026-10-19 20:32:41.907215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2b7d5f8e3c16'
+down_revision: Union[str, Sequence[str], None] = '1a9c4e7d2b65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attachments', sa.Column('encoding', sa.String(length=16), nullable=True))
+    op.add_column('attachments', sa.Column('stored_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # стиснені файли без колонки encoding стануть нечитабельними
+    op.execute("DO $$ BEGIN IF EXISTS (SELECT 1 FROM attachments WHERE encoding IS NOT NULL) THEN "
+               "RAISE EXCEPTION 'gzip-stored attachments exist'; END IF; END $$")
+    op.drop_column('attachments', 'stored_size')
+    op.drop_column('attachments', 'encoding')
@@ -0,0 +1,45 @@
+"""stream usage rollups and tier quotas
+
+Revision ID: 3c8e1f4a9d27
+Revises: 2b7d5f8e3c16
+Create Date: 2026-10-19 21:47:12.318604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c8e1f4a9d27'
+down_revision: Union[str, Sequence[str], None] = '2b7d5f8e3c16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('policy_tiers', sa.Column('quota_msgs_day', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('policy_tiers', sa.Column('quota_bytes_day', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('policy_tiers', sa.Column('quota_bytes_month', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_table('stream_usage',
+    sa.Column('stream_id', sa.BigInteger(), nullable=False),
+    sa.Column('grain', sa.String(length=8), nullable=False),
+    sa.Column('ts', sa.DateTime(), nullable=False),
+    sa.Column('msgs', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_up', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_down', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['stream_id'], ['streams.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('stream_id', 'grain', 'ts')
+    )
+    op.create_index('ix_usage_grain_ts', 'stream_usage', ['grain', 'ts'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_grain_ts', table_name='stream_usage')
+    op.drop_table('stream_usage')
+    op.drop_column('policy_tiers', 'quota_bytes_month')
+    op.drop_column('policy_tiers', 'quota_bytes_day')
+    op.drop_column('policy_tiers', 'quota_msgs_day')
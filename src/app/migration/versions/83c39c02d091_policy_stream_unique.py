@@ -0,0 +1,39 @@
+"""policy stream unique
+
+Revision ID: 83c39c02d091
+Revises: 4a61cfadc298
+Create Date: 2026-10-19 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '83c39c02d091'
+down_revision: Union[str, Sequence[str], None] = '4a61cfadc298'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # одна політика на стрім: лишаємо найсвіжішу, решту прибираємо
+    op.execute(
+        """
+        DELETE FROM priority_policies p
+        USING priority_policies newer
+        WHERE newer.stream_id = p.stream_id
+          AND (newer.updated_at, newer.id) > (p.updated_at, p.id)
+        """
+    )
+    op.drop_index(op.f('ix_priority_policies_stream_id'), table_name='priority_policies')
+    op.create_index(op.f('ix_priority_policies_stream_id'), 'priority_policies', ['stream_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_priority_policies_stream_id'), table_name='priority_policies')
+    op.create_index(op.f('ix_priority_policies_stream_id'), 'priority_policies', ['stream_id'], unique=False)
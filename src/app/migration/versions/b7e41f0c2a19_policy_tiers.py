@@ -0,0 +1,51 @@
+"""policy tiers
+
+Revision ID: b7e41f0c2a19
+Revises: 83c39c02d091
+Create Date: 2026-10-19 11:02:17.540931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41f0c2a19'
+down_revision: Union[str, Sequence[str], None] = '83c39c02d091'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('policy_tiers',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('msg_rate_rps', sa.Integer(), nullable=False),
+    sa.Column('upload_bps', sa.BigInteger(), nullable=False),
+    sa.Column('download_bps', sa.BigInteger(), nullable=False),
+    sa.Column('burst', sa.Integer(), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.add_column('channels', sa.Column('tier_id', sa.BigInteger(), nullable=True))
+    op.create_index(op.f('ix_channels_tier_id'), 'channels', ['tier_id'], unique=False)
+    op.create_foreign_key(None, 'channels', 'policy_tiers', ['tier_id'], ['id'], ondelete='SET NULL')
+    op.add_column('streams', sa.Column('tier_id', sa.BigInteger(), nullable=True))
+    op.create_index(op.f('ix_streams_tier_id'), 'streams', ['tier_id'], unique=False)
+    op.create_foreign_key(None, 'streams', 'policy_tiers', ['tier_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('streams_tier_id_fkey', 'streams', type_='foreignkey')
+    op.drop_index(op.f('ix_streams_tier_id'), table_name='streams')
+    op.drop_column('streams', 'tier_id')
+    op.drop_constraint('channels_tier_id_fkey', 'channels', type_='foreignkey')
+    op.drop_index(op.f('ix_channels_tier_id'), table_name='channels')
+    op.drop_column('channels', 'tier_id')
+    op.drop_table('policy_tiers')
@@ -0,0 +1,104 @@
+"""partition messages by created_at
+
+Revision ID: c91d5e7a4b02
+Revises: b7e41f0c2a19
+Create Date: 2026-10-19 13:40:05.112874
+
+Existing rows are not copied: the old table is attached as one partition
+(messages_legacy, MINVALUE .. start of next month) and monthly partitions
+follow it. The new primary key (id, created_at) is built on the legacy
+partition during the attach; everything else is catalog-only. FKs pointing
+at messages.id (attachments.message_id, messages.parent_message_id) can't
+exist on a partitioned table and are dropped.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c91d5e7a4b02'
+down_revision: Union[str, Sequence[str], None] = 'b7e41f0c2a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+AHEAD_MONTHS = 3
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_constraint('attachments_message_id_fkey', 'attachments', type_='foreignkey')
+    op.create_index(op.f('ix_attachments_message_id'), 'attachments', ['message_id'], unique=False)
+    op.drop_constraint('messages_parent_message_id_fkey', 'messages', type_='foreignkey')
+
+    op.rename_table('messages', 'messages_legacy')
+    op.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+    op.execute("ALTER INDEX ix_msg_channel_created RENAME TO messages_legacy_channel_id_created_at_idx")
+
+    op.execute(
+        """
+        CREATE TABLE messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+            channel_id BIGINT NOT NULL,
+            stream_id BIGINT NOT NULL,
+            sender_id BIGINT NOT NULL,
+            parent_message_id BIGINT,
+            content TEXT,
+            meta JSONB NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created_at),
+            CONSTRAINT messages_channel_id_fkey FOREIGN KEY (channel_id) REFERENCES channels (id) ON DELETE CASCADE,
+            CONSTRAINT messages_stream_id_fkey FOREIGN KEY (stream_id) REFERENCES streams (id) ON DELETE SET NULL,
+            CONSTRAINT messages_sender_id_fkey FOREIGN KEY (sender_id) REFERENCES users (id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    # до attach: наявний індекс легасі-таблиці підхоплюється, а не будується заново
+    op.create_index('ix_msg_channel_created', 'messages', ['channel_id', 'created_at'], unique=False)
+
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            bound timestamp;
+            m timestamp;
+        BEGIN
+            SELECT greatest(
+                       date_trunc('month', timezone('utc', now())),
+                       coalesce(date_trunc('month', max(created_at)), '-infinity'::timestamp)
+                   ) + interval '1 month'
+              INTO bound FROM messages_legacy;
+            EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)', bound);
+            FOR i IN 0..{AHEAD_MONTHS - 1} LOOP
+                m := bound + make_interval(months => i);
+                EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                               'messages_p' || to_char(m, 'YYYYMM'), m, m + interval '1 month');
+            END LOOP;
+        END $$;
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("CREATE TABLE messages_plain (LIKE messages INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO messages_plain SELECT * FROM messages")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages_plain.id")
+    op.drop_table('messages')  # разом з усіма партиціями, включно з messages_legacy
+    op.rename_table('messages_plain', 'messages')
+    op.create_primary_key('messages_pkey', 'messages', ['id'])
+    op.create_foreign_key('messages_channel_id_fkey', 'messages', 'channels', ['channel_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('messages_stream_id_fkey', 'messages', 'streams', ['stream_id'], ['id'], ondelete='SET NULL')
+    op.create_foreign_key('messages_sender_id_fkey', 'messages', 'users', ['sender_id'], ['id'], ondelete='CASCADE')
+    op.execute(
+        "UPDATE messages SET parent_message_id = NULL WHERE parent_message_id IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM messages p WHERE p.id = messages.parent_message_id)"
+    )
+    op.create_foreign_key('messages_parent_message_id_fkey', 'messages', 'messages', ['parent_message_id'], ['id'], ondelete='SET NULL')
+    op.create_index('ix_msg_channel_created', 'messages', ['channel_id', 'created_at'], unique=False)
+
+    op.execute("DELETE FROM attachments a WHERE NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = a.message_id)")
+    op.drop_index(op.f('ix_attachments_message_id'), table_name='attachments')
+    op.create_foreign_key('attachments_message_id_fkey', 'attachments', 'messages', ['message_id'], ['id'], ondelete='CASCADE')
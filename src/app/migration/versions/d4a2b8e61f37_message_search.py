@@ -0,0 +1,62 @@
+"""message full-text search
+
+Revision ID: d4a2b8e61f37
+Revises: c91d5e7a4b02
+Create Date: 2026-10-19 15:18:44.902113
+
+content_tsv is a stored generated column, so Postgres fills it on insert and
+the app never sends it. Adding it rewrites every partition once. GIN indexes
+keep fastupdate (the default): new entries go to the pending list and are
+merged in bulk by autovacuum, keeping send_message inserts cheap.
+The trigram index backs mode=substring search and is only created when the
+pg_trgm extension is available.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a2b8e61f37'
+down_revision: Union[str, Sequence[str], None] = 'c91d5e7a4b02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column(
+        'content_tsv', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', coalesce(content, ''))", persisted=True),
+        nullable=True,
+    ))
+    op.create_index('ix_msg_content_tsv', 'messages', ['content_tsv'], unique=False, postgresql_using='gin')
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'pg_trgm is not available: substring search will scan';
+        END $$;
+        """
+    )
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX ix_msg_content_trgm ON messages USING gin (content gin_trgm_ops);
+            END IF;
+        END $$;
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_msg_content_trgm")
+    op.drop_index('ix_msg_content_tsv', table_name='messages')
+    op.drop_column('messages', 'content_tsv')
@@ -0,0 +1,44 @@
+"""thread counters and parent index
+
+Revision ID: e58c0f9d3a71
+Revises: d4a2b8e61f37
+Create Date: 2026-10-19 16:55:30.274618
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e58c0f9d3a71'
+down_revision: Union[str, Sequence[str], None] = 'd4a2b8e61f37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # константний default — лише зміна каталогу, без переписування партицій
+    op.add_column('messages', sa.Column('reply_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('messages', sa.Column('last_reply_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_msg_parent', 'messages', ['parent_message_id'], unique=False,
+                    postgresql_where=sa.text('parent_message_id IS NOT NULL'))
+    op.execute(
+        """
+        UPDATE messages p
+           SET reply_count = c.n, last_reply_at = c.last
+          FROM (SELECT parent_message_id, count(*) AS n, max(created_at) AS last
+                  FROM messages WHERE parent_message_id IS NOT NULL
+                 GROUP BY parent_message_id) c
+         WHERE p.id = c.parent_message_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_msg_parent', table_name='messages')
+    op.drop_column('messages', 'last_reply_at')
+    op.drop_column('messages', 'reply_count')
@@ -0,0 +1,38 @@
+"""read cursors and channel message seq
+
+Revision ID: f2b6d93c7e40
+Revises: e58c0f9d3a71
+Create Date: 2026-10-19 18:21:09.643350
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b6d93c7e40'
+down_revision: Union[str, Sequence[str], None] = 'e58c0f9d3a71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('channels', sa.Column('message_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_table('read_cursors',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('channel_id', sa.BigInteger(), nullable=False),
+    sa.Column('last_read_seq', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'channel_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('read_cursors')
+    op.drop_column('channels', 'message_seq')
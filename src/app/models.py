@@ -1,9 +1,24 @@
 from datetime import datetime
-from sqlalchemy import BigInteger, Index, ForeignKey, Boolean, Integer, String, Text
+from sqlalchemy import BigInteger, Computed, Index, ForeignKey, Boolean, Integer, String, Text, text
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from .db import Base
 
+class PolicyTier(Base):
+    __tablename__ = "policy_tiers"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(64), unique=True)
+    msg_rate_rps: Mapped[int] = mapped_column(Integer)
+    upload_bps: Mapped[int] = mapped_column(BigInteger)
+    download_bps: Mapped[int] = mapped_column(BigInteger)
+    burst: Mapped[int] = mapped_column(Integer, default=10)
+    priority: Mapped[int] = mapped_column(Integer, default=0)   # більше — важливіший
+    # квоти стріму (app.usage); 0 — без квоти
+    quota_msgs_day: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    quota_bytes_day: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    quota_bytes_month: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
 class User(Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
@@ -16,6 +31,9 @@ class Channel(Base):
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     name: Mapped[str | None] = mapped_column(String(255))
     is_group: Mapped[bool] = mapped_column(Boolean, default=True)
+    tier_id: Mapped[int | None] = mapped_column(ForeignKey("policy_tiers.id", ondelete="SET NULL"), index=True)
+    # копія ch:{c}:seq з Redis (app.read_state), пишеться пачками
+    message_seq: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
 class ChannelParticipant(Base):
@@ -27,40 +45,75 @@ class ChannelParticipant(Base):
     joined_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     __table_args__ = (Index("ix_participant_channel_user", "channel_id", "user_id", unique=True),)
 
+class ReadCursor(Base):
+    __tablename__ = "read_cursors"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    channel_id: Mapped[int] = mapped_column(ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    last_read_seq: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
 class Stream(Base):
     __tablename__ = "streams"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     channel_id: Mapped[int] = mapped_column(ForeignKey("channels.id", ondelete="CASCADE"))
     owner_user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    tier_id: Mapped[int | None] = mapped_column(ForeignKey("policy_tiers.id", ondelete="SET NULL"), index=True)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     __table_args__ = (Index("ux_stream_channel_owner", "channel_id", "owner_user_id", unique=True),)
 
 class Message(Base):
+    # RANGE-партиції по created_at (місячні, див. app.partitions). PK партиціонованої
+    # таблиці мусить містити ключ партиціювання, тож на messages.id немає FK —
+    # parent_message_id і attachments.message_id лише індексовані посилання.
     __tablename__ = "messages"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     channel_id: Mapped[int] = mapped_column(ForeignKey("channels.id", ondelete="CASCADE"))
     stream_id: Mapped[int] = mapped_column(ForeignKey("streams.id", ondelete="SET NULL"))
     sender_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    parent_message_id: Mapped[int | None] = mapped_column(ForeignKey("messages.id", ondelete="SET NULL"))
+    parent_message_id: Mapped[int | None] = mapped_column(BigInteger)
+    # лічильники треду на батьківському повідомленні, ведуться при відправці відповіді
+    reply_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    last_reply_at: Mapped[datetime | None] = mapped_column()
     content: Mapped[str | None] = mapped_column(Text())
     meta: Mapped[dict] = mapped_column(JSONB, default=dict)
-    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
-    __table_args__ = (Index("ix_msg_channel_created", "channel_id", "created_at"),)
+    created_at: Mapped[datetime] = mapped_column(primary_key=True, default=datetime.utcnow)
+    # повнотекстовий пошук (routes/messages.py); рахує сам Postgres при вставці
+    content_tsv: Mapped[str | None] = mapped_column(
+        TSVECTOR, Computed("to_tsvector('simple', coalesce(content, ''))", persisted=True), deferred=True
+    )
+    __table_args__ = (
+        Index("ix_msg_channel_created", "channel_id", "created_at"),
+        Index("ix_msg_content_tsv", "content_tsv", postgresql_using="gin"),
+        Index("ix_msg_parent", "parent_message_id", postgresql_where=text("parent_message_id IS NOT NULL")),
+        # плейсхолдери файлових повідомлень, яким так і не дописали attachment_id (app.storage_gc)
+        Index("ix_msg_file_placeholder", "created_at",
+              postgresql_where=text("meta->>'kind' = 'file' AND meta->>'attachment_id' IS NULL")),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
 class Attachment(Base):
     __tablename__ = "attachments"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
-    message_id: Mapped[int] = mapped_column(ForeignKey("messages.id", ondelete="CASCADE"))
+    message_id: Mapped[int] = mapped_column(BigInteger, index=True)
     file_name: Mapped[str] = mapped_column(String(512))
     content_type: Mapped[str | None] = mapped_column(String(128))
     size: Mapped[int] = mapped_column(BigInteger)
     storage_path: Mapped[str] = mapped_column(String(1024))
+    # pending — файл ще пишеться, complete — готовий, aborted — чекає на прибирання (app.storage_gc)
+    status: Mapped[str] = mapped_column(String(16), default="complete", server_default="complete")
+    # як файл лежить на диску: None — байт-у-байт, "gzip" — стиснений (app.compression);
+    # size — завжди оригінальний розмір, stored_size — на диску
+    encoding: Mapped[str | None] = mapped_column(String(16))
+    stored_size: Mapped[int | None] = mapped_column(BigInteger)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_attachments_status_open", "status", postgresql_where=text("status <> 'complete'")),
+    )
 
 class PriorityPolicy(Base):
     __tablename__ = "priority_policies"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
-    stream_id: Mapped[int] = mapped_column(ForeignKey("streams.id", ondelete="CASCADE"), index=True)
+    stream_id: Mapped[int] = mapped_column(ForeignKey("streams.id", ondelete="CASCADE"), index=True, unique=True)
     msg_rate_rps: Mapped[int] = mapped_column(Integer)
     upload_bps: Mapped[int] = mapped_column(BigInteger)
     download_bps: Mapped[int] = mapped_column(BigInteger)
@@ -68,3 +121,14 @@ class PriorityPolicy(Base):
     enabled: Mapped[bool] = mapped_column(Boolean, default=True)
     updated_by: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
     updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+class StreamUsage(Base):
+    # зведення app.usage: grain — minute | hour | day, ts — початок інтервалу (UTC)
+    __tablename__ = "stream_usage"
+    stream_id: Mapped[int] = mapped_column(ForeignKey("streams.id", ondelete="CASCADE"), primary_key=True)
+    grain: Mapped[str] = mapped_column(String(8), primary_key=True)
+    ts: Mapped[datetime] = mapped_column(primary_key=True)
+    msgs: Mapped[int] = mapped_column(BigInteger, default=0)
+    bytes_up: Mapped[int] = mapped_column(BigInteger, default=0)
+    bytes_down: Mapped[int] = mapped_column(BigInteger, default=0)
+    __table_args__ = (Index("ix_usage_grain_ts", "grain", "ts"),)
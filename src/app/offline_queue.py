@@ -0,0 +1,162 @@
+"""
+Per-user offline delivery log.
+
+Channel events a member did not get live (no socket subscribed to the
+channel, or the send failed) are appended to a capped Redis stream u:{u}:q.
+On connect the client passes the last id it acked (?since=...) and gets
+everything after it in `replay` frames; the `ack` action trims the stream up
+to that id. The log is capped by length (XADD MAXLEN ~ OFFLINE_QUEUE_MAXLEN)
+and by age: entries older than OFFLINE_QUEUE_TTL_S are trimmed on replay and
+the whole key expires after TTL without new events.
+
+Appends go through an in-process buffer drained by run(): the sender never
+waits on the member lookup or on Redis, and one pipeline carries the whole
+batch. Delivery is best effort — a batch lost to a Redis outage is logged
+and dropped. Off unless OFFLINE_QUEUE_ENABLED.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from .config import settings
+from .db import async_session
+from .models import ChannelParticipant
+from .redis_client import get_redis
+from . import keys
+
+log = logging.getLogger(__name__)
+
+# події, які варто доставити пізніше; прогрес, квитанції тощо — ефемерні
+EVENTS = frozenset({"message.new", "thread.updated"})
+_ID_RE = re.compile(r"^(\d+)-(\d+)$")
+
+
+def _key(user_id: int) -> str:
+    return keys.user(user_id, "q")
+
+
+def parse_id(value: str) -> tuple[int, int] | None:
+    m = _ID_RE.match(value or "")
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+class OfflineQueue:
+    def __init__(self):
+        self._buf: list[tuple[int, str, frozenset[int]]] = []
+        self._wake = asyncio.Event()
+        # channel_id -> (expires_at, {user_id, ...})
+        self._members: dict[int, tuple[float, frozenset[int]]] = {}
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.OFFLINE_QUEUE_ENABLED
+
+    def record(self, channel_id: int, payload: dict, delivered: set[int], data: str | None = None):
+        """Queue `payload` for every member of the channel not in `delivered`."""
+        if not self.enabled or payload.get("type") not in EVENTS:
+            return
+        if len(self._buf) >= settings.OFFLINE_QUEUE_BUFFER:
+            self.dropped += 1
+            return
+        self._buf.append((channel_id, data or json.dumps(payload), frozenset(delivered)))
+        self._wake.set()
+
+    async def _channel_members(self, cids: set[int]) -> dict[int, frozenset[int]]:
+        now = time.monotonic()
+        out, missing = {}, []
+        for c in cids:
+            hit = self._members.get(c)
+            if hit and hit[0] > now:
+                out[c] = hit[1]
+            else:
+                missing.append(c)
+        if missing:
+            async with async_session() as db:
+                q = await db.execute(
+                    select(ChannelParticipant.channel_id, ChannelParticipant.user_id)
+                    .where(ChannelParticipant.channel_id.in_(missing))
+                )
+                found: dict[int, set[int]] = {c: set() for c in missing}
+                for c, u in q.all():
+                    found[c].add(u)
+            expires = now + settings.OFFLINE_MEMBERS_CACHE_S
+            for c, users in found.items():
+                out[c] = frozenset(users)
+                self._members[c] = (expires, out[c])
+        return out
+
+    async def _write(self, batch: list[tuple[int, str, frozenset[int]]]):
+        members = await self._channel_members({c for c, _, _ in batch})
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        touched = set()
+        for cid, data, delivered in batch:
+            for uid in members[cid] - delivered:
+                pipe.xadd(_key(uid), {"e": data}, maxlen=settings.OFFLINE_QUEUE_MAXLEN, approximate=True)
+                touched.add(uid)
+        if not touched:
+            return
+        for uid in touched:
+            pipe.expire(_key(uid), int(settings.OFFLINE_QUEUE_TTL_S))
+        await pipe.execute()
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            batch, self._buf = self._buf, []
+            if not batch:
+                continue
+            try:
+                await self._write(batch)
+            except (RedisError, OSError) as e:
+                log.warning("offline queue: %d events lost (%r)", len(batch), e)
+            except Exception:
+                log.exception("offline queue: write failed")
+            if self.dropped:
+                log.warning("offline queue: buffer full, %d events dropped", self.dropped)
+                self.dropped = 0
+
+    async def flush(self):
+        """Write whatever is buffered now (drain / shutdown)."""
+        batch, self._buf = self._buf, []
+        if batch:
+            await self._write(batch)
+
+    async def replay(self, user_id: int, since: str | None = None):
+        """Yield batches of (id, event) queued after `since`, oldest first."""
+        r = await get_redis()
+        key = _key(user_id)
+        min_ms = int((time.time() - settings.OFFLINE_QUEUE_TTL_S) * 1000)
+        await r.xtrim(key, minid=f"{max(0, min_ms)}-0", approximate=True)
+        start = f"({since}" if since and parse_id(since) else "-"
+        while True:
+            rows = await r.xrange(key, min=start, max="+", count=settings.OFFLINE_REPLAY_BATCH)
+            if not rows:
+                return
+            batch = []
+            for eid, fields in rows:
+                eid = eid.decode() if isinstance(eid, bytes) else eid
+                raw = fields.get(b"e", fields.get("e"))
+                batch.append((eid, json.loads(raw)))
+            yield batch
+            if len(rows) < settings.OFFLINE_REPLAY_BATCH:
+                return
+            start = f"({batch[-1][0]}"
+
+    async def ack(self, user_id: int, event_id: str) -> bool:
+        """Drop everything up to and including `event_id`."""
+        sid = parse_id(event_id)
+        if sid is None:
+            return False
+        r = await get_redis()
+        # MINID лишає записи >= межі, тож межа — наступний можливий id
+        await r.xtrim(_key(user_id), minid=f"{sid[0]}-{sid[1] + 1}", approximate=False)
+        return True
+
+
+offline = OfflineQueue()
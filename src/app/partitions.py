@@ -0,0 +1,156 @@
+"""
+Maintenance of the monthly range partitions of `messages` (by created_at).
+
+ensure_future() keeps MESSAGES_PARTITIONS_AHEAD months of empty partitions
+ready, so inserts never hit a missing range; on a partitioned table with no
+partitions yet (fresh create_all) it starts from the current month. New
+partitions are created as standalone tables (LIKE messages INCLUDING
+DEFAULTS INCLUDING GENERATED: ATTACH needs content_tsv to stay a generated
+column) and attached with ATTACH PARTITION, which takes a SHARE UPDATE
+EXCLUSIVE lock on `messages` instead of the ACCESS EXCLUSIVE that CREATE
+TABLE ... PARTITION OF needs; live inserts keep going.
+
+apply_retention() handles partitions whose range ended more than
+MESSAGES_RETENTION_DAYS ago: DETACH ... CONCURRENTLY, then either drop them
+(with their attachment rows) or keep them as standalone archive tables
+(MESSAGES_RETENTION_MODE = drop | detach). Removing a month of history costs
+the same as dropping a table, whatever its size.
+
+One worker at a time runs it (advisory lock); run_maintenance() is the loop
+started from main.on_startup.
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .config import settings
+from .db import engine
+
+log = logging.getLogger(__name__)
+
+_LOCK_ID = 0x6D736770  # 'msgp'
+_TO_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+def _month(d: datetime) -> datetime:
+    return datetime(d.year, d.month, 1)
+
+
+def _next_month(d: datetime) -> datetime:
+    return datetime(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+async def _is_partitioned(conn: AsyncConnection) -> bool:
+    q = await conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages')"))
+    return q.scalar() == "p"
+
+
+async def partitions(conn: AsyncConnection) -> list[tuple[str, datetime | None, bool]]:
+    """(name, upper bound, detach pending) of every partition, oldest first."""
+    q = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), i.inhdetachpending FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass"
+    ))
+    out = []
+    for name, bound, pending in q.all():
+        m = _TO_RE.search(bound or "")
+        out.append((name, datetime.fromisoformat(m.group(1)) if m else None, pending))
+    out.sort(key=lambda p: p[1] or datetime.max)
+    return out
+
+
+def _lock_timeout_ms() -> int:
+    return int(settings.MESSAGES_PARTITION_LOCK_TIMEOUT_S * 1000)
+
+
+async def ensure_future(now: datetime | None = None) -> list[str]:
+    now = now or datetime.utcnow()
+    async with engine.connect() as conn:
+        existing = await partitions(conn)
+    # нові місяці починаються там, де закінчилась остання партиція
+    start = max([b for _, b, _ in existing if b is not None], default=_month(now))
+    until = _month(now)
+    for _ in range(settings.MESSAGES_PARTITIONS_AHEAD + 1):
+        until = _next_month(until)
+    created = []
+    m = start
+    while m < until:
+        name, nxt = partition_name(m), _next_month(m)
+        lo, hi = f"{m:%Y-%m-%d}", f"{nxt:%Y-%m-%d}"
+        # один місяць — одна транзакція: невдалий attach не лишає сиротою таблицю
+        async with engine.begin() as conn:
+            # не стаємо в чергу за довгою транзакцією, блокуючи інсерти за собою
+            await conn.execute(text(f"SET LOCAL lock_timeout = '{_lock_timeout_ms()}ms'"))
+            # GENERATED — content_tsv має лишитися згенерованою, інакше ATTACH її відкине
+            await conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)"))
+            # CHECK з тим самим діапазоном — attach не сканує таблицю
+            await conn.execute(text(
+                f"ALTER TABLE {name} ADD CONSTRAINT {name}_range "
+                f"CHECK (created_at >= '{lo}' AND created_at < '{hi}')"
+            ))
+            await conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+            await conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+        created.append(name)
+        m = nxt
+    return created
+
+
+async def apply_retention(conn: AsyncConnection, now: datetime | None = None) -> list[str]:
+    if settings.MESSAGES_RETENTION_DAYS <= 0:
+        return []
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.MESSAGES_RETENTION_DAYS)
+    done = []
+    for name, upper, pending in await partitions(conn):
+        if upper is None or upper > cutoff:
+            continue
+        if pending:
+            # попередній DETACH CONCURRENTLY перервався посередині
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name} FINALIZE"))
+        else:
+            # CONCURRENTLY — без ACCESS EXCLUSIVE на messages; лише поза транзакцією
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name} CONCURRENTLY"))
+        if settings.MESSAGES_RETENTION_MODE == "drop":
+            await conn.execute(text(f"DELETE FROM attachments a USING {name} m WHERE a.message_id = m.id"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+            log.info("partitions: dropped %s (ended %s)", name, upper)
+        else:
+            log.info("partitions: detached %s (ended %s), kept as archive", name, upper)
+        done.append(name)
+    return done
+
+
+async def maintain() -> dict:
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not await _is_partitioned(conn):
+            return {"partitioned": False}
+        if not (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_ID})).scalar():
+            return {"partitioned": True, "skipped": "locked"}
+        try:
+            created = await ensure_future()
+            await conn.execute(text(f"SET lock_timeout = '{_lock_timeout_ms()}ms'"))
+            removed = await apply_retention(conn)
+        finally:
+            # конект повертається в пул — сесійні налаштування не мають протікати
+            await conn.execute(text("RESET lock_timeout"))
+            await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_ID})
+    return {"partitioned": True, "created": created, "removed": removed}
+
+
+async def run_maintenance():
+    while True:
+        try:
+            res = await maintain()
+            if res.get("created") or res.get("removed"):
+                log.info("partitions: %s", res)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("partitions: maintenance failed")
+        await asyncio.sleep(settings.MESSAGES_PARTITION_CHECK_S)
@@ -0,0 +1,151 @@
+"""
+Effective rate limits per stream, resolved from an in-memory table.
+
+Precedence: enabled per-stream override (priority_policies) > stream tier >
+channel tier > DEFAULT_* settings. Only streams and channels that differ from
+the defaults are kept, so the table stays small and resolve() is two dict gets.
+
+The table is rebuilt from Postgres when the Redis counter cfg:policy_version
+changes; every admin write that affects limits bumps it (INCR). Each worker
+checks the counter at most once per POLICY_REFRESH_S, so editing a tier is one
+row plus one INCR no matter how many streams use it.
+"""
+import asyncio
+import logging
+import time
+from typing import NamedTuple
+from redis.exceptions import RedisError
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .db import async_session
+from .models import Channel, PolicyTier, PriorityPolicy, Stream
+from .redis_client import get_redis
+from . import keys
+
+log = logging.getLogger(__name__)
+
+VERSION_KEY = keys.config("policy_version")
+
+
+class Limits(NamedTuple):
+    msg_rate_rps: int
+    upload_bps: int
+    download_bps: int
+    burst: int
+    priority: int = 0
+    # квоти (app.usage); 0 — без квоти
+    quota_msgs_day: int = 0
+    quota_bytes_day: int = 0
+    quota_bytes_month: int = 0
+
+
+def default_limits() -> Limits:
+    return Limits(
+        settings.DEFAULT_MSG_RATE_RPS,
+        settings.DEFAULT_UPLOAD_BPS,
+        settings.DEFAULT_DOWNLOAD_BPS,
+        settings.DEFAULT_BURST,
+        quota_msgs_day=settings.DEFAULT_QUOTA_MSGS_DAY,
+        quota_bytes_day=settings.DEFAULT_QUOTA_BYTES_DAY,
+        quota_bytes_month=settings.DEFAULT_QUOTA_BYTES_MONTH,
+    )
+
+
+class PolicyTable:
+    def __init__(self, refresh_s: float):
+        self.refresh_s = refresh_s
+        self.default = default_limits()
+        self.tiers: dict[str, Limits] = {}
+        self.channels: dict[int, Limits] = {}
+        self.streams: dict[int, Limits] = {}
+        self.version: int | None = None
+        self._next_check = 0.0
+        self._lock = asyncio.Lock()
+
+    def resolve(self, channel_id: int, stream_id: int) -> Limits:
+        lim = self.streams.get(stream_id)
+        if lim is None:
+            lim = self.channels.get(channel_id, self.default)
+        return lim
+
+    async def _load(self, db: AsyncSession):
+        tiers = {}
+        for t in (await db.execute(select(
+            PolicyTier.id, PolicyTier.name, PolicyTier.msg_rate_rps, PolicyTier.upload_bps,
+            PolicyTier.download_bps, PolicyTier.burst, PolicyTier.priority,
+            PolicyTier.quota_msgs_day, PolicyTier.quota_bytes_day, PolicyTier.quota_bytes_month,
+        ))).all():
+            tiers[t.id] = (t.name, Limits(t.msg_rate_rps, t.upload_bps, t.download_bps, t.burst, t.priority,
+                                          t.quota_msgs_day, t.quota_bytes_day, t.quota_bytes_month))
+
+        channels = {}
+        for cid, tid in (await db.execute(select(Channel.id, Channel.tier_id).where(Channel.tier_id.isnot(None)))).all():
+            if tid in tiers:
+                channels[cid] = tiers[tid][1]
+
+        streams = {}
+        res = await db.stream(
+            select(
+                Stream.id, Stream.channel_id, Stream.tier_id, PriorityPolicy.id.label("policy_id"),
+                PriorityPolicy.msg_rate_rps, PriorityPolicy.upload_bps, PriorityPolicy.download_bps, PriorityPolicy.burst,
+            )
+            .select_from(Stream)
+            .outerjoin(PriorityPolicy, (PriorityPolicy.stream_id == Stream.id) & PriorityPolicy.enabled.is_(True))
+            .where(or_(Stream.tier_id.isnot(None), PriorityPolicy.id.isnot(None)))
+            .execution_options(yield_per=5000)
+        )
+        async for r in res:
+            base = tiers[r.tier_id][1] if r.tier_id in tiers else channels.get(r.channel_id, self.default)
+            if r.policy_id is not None:
+                # override задає ліміти, пріоритет і квоти лишаються від тиру
+                base = base._replace(msg_rate_rps=r.msg_rate_rps, upload_bps=r.upload_bps,
+                                     download_bps=r.download_bps, burst=r.burst)
+            streams[r.id] = base
+
+        self.default = default_limits()
+        self.tiers = {name: lim for name, lim in tiers.values()}
+        self.channels = channels
+        self.streams = streams
+
+    async def refresh(self, force: bool = False):
+        """Reload if cfg:policy_version moved; cheap no-op between checks."""
+        if not force and self.version is not None and time.monotonic() < self._next_check:
+            return
+        async with self._lock:
+            if not force and self.version is not None and time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.refresh_s
+            try:
+                r = await get_redis()
+                version = int(await r.get(VERSION_KEY) or 0)
+            except (RedisError, OSError) as e:
+                log.warning("policy table: version check failed (%r)", e)
+                if self.version is not None and not force:
+                    return
+                version = -1  # невідомо — перечитаємо, щойно Redis повернеться
+            if version == self.version and not force:
+                return
+            try:
+                async with async_session() as db:
+                    await self._load(db)
+            except Exception:
+                if self.version is None:
+                    raise
+                log.exception("policy table: reload failed, keeping version %s", self.version)
+                return
+            self.version = version
+
+    async def bump(self):
+        """Call after committing a change to tiers, overrides or tier assignments."""
+        self._next_check = 0.0
+        try:
+            r = await get_redis()
+            await r.incr(VERSION_KEY)
+        except (RedisError, OSError) as e:
+            # інші воркери підхоплять зміну з наступним успішним bump
+            log.warning("policy table: version bump failed (%r)", e)
+            self.version = None
+
+
+policies = PolicyTable(settings.POLICY_REFRESH_S)
@@ -0,0 +1,238 @@
+"""
+Presence (online / away) and typing indicators.
+
+Each worker keeps its connected users in one Redis hash pr:{w<worker>}
+(user_id -> online | away) and lists itself in cfg:presence_workers. A user
+is online while one of their sockets showed activity (any action, or a
+`heartbeat` with active=true) in the last PRESENCE_AWAY_S, away while the
+socket is open but idle, offline once no worker lists them. run() ticks
+every PRESENCE_TICK_S: one pipeline writes only the statuses that changed
+and refreshes the hash TTL (PRESENCE_TTL_S), so a worker that dies without
+cleaning up drops out on its own.
+
+The status of many users across all workers is one HMGET per worker hash in
+one pipeline (status_of), whatever the number of users. Changes seen in a
+tick are sent as one `presence` frame per channel with the aggregated
+status, so a user still connected elsewhere does not flicker offline.
+
+`typing` is accepted at most once per PRESENCE_TYPING_THROTTLE_S per user
+and channel and lasts PRESENCE_TYPING_TTL_S. A channel gets a `typing` frame
+(up to PRESENCE_TYPING_MAX user ids plus a count of the rest) only in the
+tick its set of typing users changed, however many keystrokes came in.
+Like every other frame, presence and typing go to this worker's sockets.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Iterable
+from redis.exceptions import RedisError
+from .config import settings
+from .redis_client import get_redis
+from . import keys
+
+log = logging.getLogger(__name__)
+
+WORKERS_KEY = keys.config("presence_workers")
+# порядок «кращості» при зведенні воркерів
+_RANK = {"offline": 0, "away": 1, "online": 2}
+
+
+class Presence:
+    def __init__(self):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._key = keys.presence(self.worker)
+        # user_id -> відкритих сокетів / остання активність (monotonic)
+        self._conns: dict[int, int] = {}
+        self._active: dict[int, float] = {}
+        # user_id -> статус, уже записаний у Redis
+        self._published: dict[int, str] = {}
+        # користувачі, що пішли з воркера, -> їхні канали на момент виходу
+        self._gone: dict[int, frozenset[int]] = {}
+        # channel_id -> {user_id: (expires_at, accepted_at)}
+        self._typing: dict[int, dict[int, tuple[float, float]]] = {}
+        self._typing_dirty: set[int] = set()
+        # кеш списку воркерів для status_of: (expires_at, [worker, ...])
+        self._workers: tuple[float, list[bytes]] | None = None
+
+    # ---------- події сокетів ----------
+    def connect(self, user_id: int):
+        self._conns[user_id] = self._conns.get(user_id, 0) + 1
+        self._active[user_id] = time.monotonic()
+        self._gone.pop(user_id, None)
+
+    def disconnect(self, user_id: int, channels: Iterable[int] = ()):
+        n = self._conns.get(user_id, 0) - 1
+        if n > 0:
+            self._conns[user_id] = n
+            return
+        self._conns.pop(user_id, None)
+        self._active.pop(user_id, None)
+        self._gone[user_id] = frozenset(channels)
+        for cid in channels:
+            self.stop_typing(user_id, cid)
+
+    def touch(self, user_id: int):
+        if user_id in self._conns:
+            self._active[user_id] = time.monotonic()
+
+    def local_status(self, user_id: int, now: float | None = None) -> str:
+        if user_id not in self._conns:
+            return "offline"
+        now = time.monotonic() if now is None else now
+        return "online" if now - self._active.get(user_id, 0.0) < settings.PRESENCE_AWAY_S else "away"
+
+    # ---------- typing ----------
+    def typing(self, user_id: int, channel_id: int) -> bool:
+        """Register a keystroke; False if throttled."""
+        now = time.monotonic()
+        users = self._typing.setdefault(channel_id, {})
+        cur = users.get(user_id)
+        if cur and now - cur[1] < settings.PRESENCE_TYPING_THROTTLE_S:
+            return False
+        if cur is None:
+            self._typing_dirty.add(channel_id)
+        users[user_id] = (now + settings.PRESENCE_TYPING_TTL_S, now)
+        self.touch(user_id)
+        return True
+
+    def stop_typing(self, user_id: int, channel_id: int):
+        users = self._typing.get(channel_id)
+        if users and users.pop(user_id, None) is not None:
+            self._typing_dirty.add(channel_id)
+
+    def typing_frames(self) -> list[tuple[int, dict]]:
+        now = time.monotonic()
+        dirty, self._typing_dirty = self._typing_dirty, set()
+        out = []
+        for cid, users in list(self._typing.items()):
+            expired = [u for u, (exp, _) in users.items() if exp <= now]
+            for u in expired:
+                del users[u]
+            if expired:
+                dirty.add(cid)
+            if not users:
+                del self._typing[cid]
+        for cid in dirty:
+            ids = sorted(self._typing.get(cid, ()))
+            cap = settings.PRESENCE_TYPING_MAX
+            out.append((cid, {
+                "type": "typing", "channel_id": cid,
+                "user_ids": ids[:cap], "more": max(0, len(ids) - cap),
+            }))
+        return out
+
+    # ---------- Redis ----------
+    async def _live_workers(self, r) -> list[bytes]:
+        hit = self._workers
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        workers = sorted(await r.smembers(WORKERS_KEY))
+        self._workers = (time.monotonic() + settings.PRESENCE_WORKERS_CACHE_S, workers)
+        return workers
+
+    async def status_of(self, user_ids: list[int]) -> dict[int, str]:
+        """Aggregated status over all workers: one HMGET per worker hash, one pipeline."""
+        out = {u: "offline" for u in user_ids}
+        if not user_ids:
+            return out
+        r = await get_redis()
+        workers = await self._live_workers(r)
+        pipe = r.pipeline(transaction=False)
+        for w in workers:
+            pipe.hmget(keys.presence(w.decode()), *user_ids)
+            pipe.exists(keys.presence(w.decode()))
+        res = await pipe.execute()
+        dead = []
+        for w, vals, alive in zip(workers, res[::2], res[1::2]):
+            if not alive:
+                dead.append(w)
+                continue
+            for u, v in zip(user_ids, vals):
+                if v is not None and _RANK.get(v.decode(), 0) > _RANK[out[u]]:
+                    out[u] = v.decode()
+        if dead:
+            # хеш протух — воркер помер, не прибравши за собою; живий поверне себе SADD наступного тіку
+            await r.srem(WORKERS_KEY, *dead)
+            self._workers = None
+        return out
+
+    def _changes(self) -> tuple[dict[int, str], list[int]]:
+        now = time.monotonic()
+        changed = {}
+        for uid in self._conns:
+            st = self.local_status(uid, now)
+            if self._published.get(uid) != st:
+                changed[uid] = st
+        return changed, list(self._gone)
+
+    async def publish(self) -> tuple[dict[int, str], dict[int, frozenset[int]]]:
+        """Write this tick's status changes.
+
+        Returns ({user_id: local status} that changed, {user_id: channels} of
+        announced users that left). Only the departures written here leave
+        _gone: whoever disconnects during the pipeline is picked up next tick.
+        """
+        changed, gone = self._changes()
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        if changed:
+            pipe.hset(self._key, mapping={u: s for u, s in changed.items()})
+        if gone:
+            pipe.hdel(self._key, *gone)
+        if self._conns:
+            pipe.expire(self._key, int(settings.PRESENCE_TTL_S))
+            pipe.sadd(WORKERS_KEY, self.worker)
+        if changed or gone or self._conns:
+            await pipe.execute()
+        self._published.update(changed)
+        left = {}
+        for u in gone:
+            channels = self._gone.pop(u, None)
+            # None — встиг перепідключитися; не оголошений раніше — нема кому казати offline
+            if self._published.pop(u, None) is not None and channels is not None:
+                left[u] = channels
+        return changed, left
+
+    async def close(self):
+        """Drop this worker's hash (shutdown): its users go offline at once."""
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(self._key)
+        pipe.srem(WORKERS_KEY, self.worker)
+        await pipe.execute()
+
+    async def _fan_out(self, changed: dict[int, str], left: dict[int, frozenset[int]],
+                       channels_of: Callable[[int], Iterable[int]],
+                       broadcast: Callable[[int, dict], Awaitable[None]]):
+        status = await self.status_of([*changed, *left])
+        by_channel: dict[int, list[dict]] = {}
+        for uid in (*changed, *left):
+            cids = left[uid] if uid in left else channels_of(uid)
+            for cid in cids:
+                by_channel.setdefault(cid, []).append({"user_id": uid, "status": status[uid]})
+        for cid, users in by_channel.items():
+            await broadcast(cid, {"type": "presence", "channel_id": cid, "users": users})
+
+    async def run(self, broadcast: Callable[[int, dict], Awaitable[None]],
+                  channels_of: Callable[[int], Iterable[int]]):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_TICK_S)
+            for cid, frame in self.typing_frames():
+                try:
+                    await broadcast(cid, frame)
+                except Exception:
+                    log.exception("presence: typing for channel %s failed", cid)
+            try:
+                changed, left = await self.publish()
+                if changed or left:
+                    await self._fan_out(changed, left, channels_of, broadcast)
+            except (RedisError, OSError) as e:
+                # не записане лишається в _changes — повториться наступного тіку
+                log.warning("presence: publish failed (%r)", e)
+            except Exception:
+                log.exception("presence: tick failed")
+
+
+presence = Presence()
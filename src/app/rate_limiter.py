@@ -1,20 +1,135 @@
+import abc
+import asyncio
+import logging
+import math
 import time
+from typing import Callable
 import redis.asyncio as redis
+from redis.exceptions import RedisClusterException, RedisError
+from .config import settings
+from . import keys
+from .redis_client import Script
 
-class TokenBucket:
+log = logging.getLogger(__name__)
+
+
+def _ttl(rate: float, capacity: float) -> int:
+    return int(max(30, (capacity / max(0.001, rate)) * 10)) if rate > 0 else 3600
+
+
+def _refill(tokens: float, ts: float, now: float, rate: float, capacity: float) -> float:
+    if ts == 0.0:
+        return capacity
+    elapsed = max(0.0, now - ts)
+    return min(capacity, tokens + rate * elapsed)
+
+
+def _take(tokens: float, want: float, partial: bool) -> float:
+    if partial:
+        # віддаємо лише цілі байти і списуємо рівно стільки ж —
+        # інакше дробова частина губиться на кожному виклику
+        return float(math.floor(min(want, tokens)))
+    return want if tokens >= want else 0.0
+
+
+class LimiterBackend(abc.ABC):
     """
-    Redis-backed token bucket with two APIs:
-      - allow(key, rate, capacity, cost=1.0) -> bool
-      - grant(key, rate, capacity, want) -> int
+    Where bucket state lives. take() refills the bucket at `now`, deducts up
+    to `want` tokens and returns how many were taken: all-or-nothing unless
+    `partial`, in which case whole tokens only.
+
+    take_all() does the same for several buckets at once; without `partial`
+    it is all-or-nothing across every bucket.
+    """
+
+    async def take(self, key: str, rate: float, capacity: float, want: float, now: float, partial: bool) -> float:
+        return (await self.take_all([(key, rate, capacity, want)], now, partial))[0]
+
+    @abc.abstractmethod
+    async def take_all(self, buckets: list[tuple[str, float, float, float]], now: float, partial: bool) -> list[float]:
+        ...
+
+
+# KEYS: бакети (один hash tag!); ARGV: now, partial, далі по 4 на ключ: rate, capacity, want, ttl
+_TAKE_LUA = """
+local now = tonumber(ARGV[1])
+local partial = ARGV[2] == '1'
+local st = {}
+local ok = true
+for i = 1, #KEYS do
+  local b = 2 + (i - 1) * 4
+  local rate, cap, want = tonumber(ARGV[b + 1]), tonumber(ARGV[b + 2]), tonumber(ARGV[b + 3])
+  local v = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local tokens, ts = tonumber(v[1]) or 0, tonumber(v[2]) or 0
+  if ts == 0 then
+    tokens = cap
+  else
+    tokens = math.min(cap, tokens + rate * math.max(0, now - ts))
+  end
+  local got = 0
+  if partial then
+    got = math.floor(math.min(want, tokens))
+  elseif tokens >= want then
+    got = want
+  else
+    ok = false
+  end
+  st[i] = {tokens, got, cap, ARGV[b + 4]}
+end
+local out = {}
+for i = 1, #KEYS do
+  local s = st[i]
+  local got = s[2]
+  if not ok then got = 0 end
+  local left = math.max(0, math.min(s[3], s[1] - got))
+  redis.call('HSET', KEYS[i], 'tokens', string.format('%.6f', left), 'ts', string.format('%.6f', now))
+  redis.call('EXPIRE', KEYS[i], s[4])
+  out[i] = string.format('%.6f', got)
+end
+return out
+"""
+
+
+def _take_py(mem, keys_: list[bytes], args: list[bytes]) -> list[bytes]:
+    # MemoryRedis-двійник _TAKE_LUA
+    now = float(args[0])
+    partial = args[1] == b"1"
+    st = []
+    ok = True
+    for i, k in enumerate(keys_):
+        rate, cap, want, ttl = (float(x) for x in args[2 + i * 4:6 + i * 4])
+        h = mem._hash(k) or {}
+        tokens = _refill(RedisBackend._to_float(h.get(b"tokens")), RedisBackend._to_float(h.get(b"ts")), now, rate, cap)
+        got = _take(tokens, want, partial)
+        if not partial and got == 0.0 and want > 0.0:
+            ok = False
+        st.append((k, tokens, got, cap, int(ttl)))
+    out = []
+    for k, tokens, got, cap, ttl in st:
+        if not ok:
+            got = 0.0
+        h = mem._hash(k, create=True)
+        h[b"tokens"] = b"%.6f" % max(0.0, min(cap, tokens - got))
+        h[b"ts"] = b"%.6f" % now
+        mem.expires[k] = mem.clock() + ttl
+        out.append(b"%.6f" % got)
+    return out
+
+
+_take_script = Script(_TAKE_LUA, python=_take_py)
+
+
+class RedisBackend(LimiterBackend):
+    """
+    Shared state in Redis: works across workers. One EVALSHA per decision;
+    the script is atomic, so concurrent grantors can't over-draw a bucket.
+    Works on a single node, Redis Cluster or ShardedRedis as long as the
+    buckets of one call share a hash tag (see keys.limiter).
     """
 
     def __init__(self, r: redis.Redis):
         self.r = r
 
-    @staticmethod
-    def key(stream_id: int, kind: str) -> str:
-        return f"rl:{stream_id}:{kind}"
-
     @staticmethod
     def _to_float(val) -> float:
         if val is None:
@@ -32,52 +147,142 @@ class TokenBucket:
         except Exception:
             return 0.0
 
-    async def _load(self, key: str):
-        now = time.time()
-        data = await self.r.hgetall(key)
-        tokens = self._to_float(data.get(b"tokens"))
-        ts = self._to_float(data.get(b"ts"))
-        return tokens, ts, now
+    async def take_all(self, buckets, now, partial):
+        args = [repr(float(now)), "1" if partial else "0"]
+        for _key, rate, capacity, want in buckets:
+            args += [repr(float(rate)), repr(float(capacity)), repr(float(want)), _ttl(rate, capacity)]
+        res = await _take_script(self.r, [b[0] for b in buckets], args)
+        return [self._to_float(x) for x in res]
 
-    async def _save(self, key: str, tokens: float, now: float, rate: float, capacity: float):
-        tokens = max(0.0, min(capacity, tokens))
-        await self.r.hset(key, mapping={"tokens": tokens, "ts": now})
-        ttl = int(max(30, (capacity / max(0.001, rate)) * 10)) if rate > 0 else 3600
-        await self.r.expire(key, ttl)
 
-    async def allow(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> bool:
-        tokens, ts, now = await self._load(key)
+class LocalBackend(LimiterBackend):
+    """
+    Process-local state. take() never awaits, so on the event loop each call
+    is atomic without locks. Exact for one worker; with N workers every
+    worker enforces the full limit on its own.
+    """
+
+    SWEEP_EVERY = 10_000
+
+    def __init__(self):
+        # key -> [tokens, ts, expires_at]
+        self.buckets: dict[str, list[float]] = {}
+        self._calls = 0
+
+    def _sweep(self, now: float):
+        dead = [k for k, b in self.buckets.items() if b[2] <= now]
+        for k in dead:
+            del self.buckets[k]
+
+    def _level(self, key: str, rate: float, capacity: float, now: float) -> float:
+        b = self.buckets.get(key)
+        if b is None or b[2] <= now:
+            return capacity
+        return _refill(b[0], b[1], now, rate, capacity)
+
+    async def take(self, key, rate, capacity, want, now, partial):
+        self._calls += 1
+        if self._calls % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+        tokens = self._level(key, rate, capacity, now)
+        got = _take(tokens, want, partial)
+        self.buckets[key] = [max(0.0, min(capacity, tokens - got)), now, now + _ttl(rate, capacity)]
+        return got
+
+    async def take_all(self, buckets, now, partial):
+        levels = [self._level(k, rate, cap, now) for k, rate, cap, _ in buckets]
+        got = [_take(t, b[3], partial) for t, b in zip(levels, buckets)]
+        if not partial and any(g == 0.0 and b[3] > 0.0 for g, b in zip(got, buckets)):
+            got = [0.0] * len(buckets)
+        for (k, rate, cap, _), t, g in zip(buckets, levels, got):
+            self.buckets[k] = [max(0.0, min(cap, t - g)), now, now + _ttl(rate, cap)]
+        return got
+
+
+class Breaker:
+    """Shared 'primary is down until' marker for HybridBackend instances."""
+
+    def __init__(self):
+        self.down_until = 0.0
+
+
+class HybridBackend(LimiterBackend):
+    """
+    Primary (Redis) with a deadline; on timeout or Redis error (including
+    cluster routing errors, which are not RedisError) the decision is
+    made by the local fallback and the primary is skipped for `cooldown`
+    seconds, so a Redis blip degrades limits to per-worker instead of failing.
+    """
 
-        if ts == 0.0:
-            tokens = capacity
-            ts = now
+    def __init__(self, primary: LimiterBackend, fallback: LimiterBackend,
+                 timeout: float, cooldown: float, breaker: Breaker | None = None):
+        self.primary = primary
+        self.fallback = fallback
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.breaker = breaker or Breaker()
 
-        elapsed = max(0.0, now - ts)
-        tokens = min(capacity, tokens + rate * elapsed)
+    async def take_all(self, buckets, now, partial):
+        mono = time.monotonic()
+        if mono >= self.breaker.down_until:
+            try:
+                return await asyncio.wait_for(self.primary.take_all(buckets, now, partial), self.timeout)
+            except (asyncio.TimeoutError, RedisError, RedisClusterException, OSError) as e:
+                log.warning("limiter: primary backend failed (%r), local fallback for %.1fs", e, self.cooldown)
+                self.breaker.down_until = mono + self.cooldown
+        return await self.fallback.take_all(buckets, now, partial)
 
-        allowed = tokens >= cost
-        if allowed:
-            tokens -= cost
 
-        await self._save(key, tokens, now, rate, capacity)
-        return allowed
+class TokenBucket:
+    """
+    Token bucket with two APIs:
+      - allow(key, rate, capacity, cost=1.0) -> bool
+      - grant(key, rate, capacity, want) -> int
+
+    State lives in a LimiterBackend; passing a Redis client wraps it in
+    RedisBackend. `clock` returns seconds (defaults to time.time); inject a
+    virtual clock to test or benchmark refill deterministically.
+    """
+
+    def __init__(self, r: "redis.Redis | LimiterBackend", clock: Callable[[], float] = time.time):
+        self.backend = r if isinstance(r, LimiterBackend) else RedisBackend(r)
+        self.clock = clock
+
+    @staticmethod
+    def key(stream_id: int, kind: str) -> str:
+        return keys.limiter(stream_id, kind)
+
+    async def allow(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> bool:
+        got = await self.backend.take(key, rate, capacity, float(cost), self.clock(), partial=False)
+        return got > 0.0 or cost <= 0.0
+
+    async def allow_all(self, checks: list[tuple[str, float, float, float]]) -> bool:
+        """(key, rate, capacity, cost) for each bucket: all are charged or none is."""
+        got = await self.backend.take_all([(k, r, c, float(cost)) for k, r, c, cost in checks], self.clock(), partial=False)
+        return all(g > 0.0 or c[3] <= 0.0 for g, c in zip(got, checks))
 
     async def grant(self, key: str, rate: float, capacity: float, want: float) -> int:
         want = float(max(0.0, want))
         if want == 0.0:
             return 0
+        got = await self.backend.take(key, rate, capacity, want, self.clock(), partial=True)
+        return int(got)
 
-        tokens, ts, now = await self._load(key)
-
-        if ts == 0.0:
-            tokens = capacity
-            ts = now
 
-        elapsed = max(0.0, now - ts)
-        tokens = min(capacity, tokens + rate * elapsed)
+_local_backend = LocalBackend()
+_redis_breaker = Breaker()
 
-        grant_amt = min(want, tokens)
-        tokens -= grant_amt
 
-        await self._save(key, tokens, now, rate, capacity)
-        return int(grant_amt)
+def make_limiter(r: redis.Redis) -> TokenBucket:
+    """TokenBucket on the backend selected by settings.LIMITER_BACKEND."""
+    mode = settings.LIMITER_BACKEND
+    if mode == "local":
+        return TokenBucket(_local_backend)
+    if mode == "hybrid":
+        return TokenBucket(HybridBackend(
+            RedisBackend(r), _local_backend,
+            timeout=settings.LIMITER_REDIS_TIMEOUT_S,
+            cooldown=settings.LIMITER_FALLBACK_COOLDOWN_S,
+            breaker=_redis_breaker,
+        ))
+    return TokenBucket(RedisBackend(r))
@@ -0,0 +1,257 @@
+"""
+Read cursors and unread counts.
+
+Every channel has a message sequence in Redis (ch:{c}:seq): one INCR per
+committed message, sent to clients as `seq` in message.new. A user's read
+position lives in u:{u}:read (hash channel_id -> seq) and only moves forward.
+Unread is seq - read, so a new message costs one INCR however many members
+the channel has, and at login all badges of a user come from one pipeline.
+The INCR never recreates a lost seq key from 0: if the key is missing
+(flush, failover, eviction) it is first seeded from channels.message_seq.
+
+Postgres keeps a copy written in batches: moved cursors and channel seqs are
+buffered per worker and upserted every READ_FLUSH_S (GREATEST keeps them
+monotonic). They restore the Redis keys when those are missing. Read receipts
+are buffered per channel and fanned out as one read.receipts frame per
+channel every READ_RECEIPTS_S.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+from redis.exceptions import RedisError
+from sqlalchemy import ARRAY, BigInteger, bindparam, func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .db import async_session
+from .models import Channel, ChannelParticipant, ReadCursor
+from .redis_client import Script, get_redis
+from . import keys
+
+log = logging.getLogger(__name__)
+
+# KEYS[1] — hash, ARGV: field, value. Пише лише вперед; повертає підсумкове значення
+_FORWARD_HSET_LUA = """
+local cur = redis.call('HGET', KEYS[1], ARGV[1])
+local new = tonumber(ARGV[2])
+if cur == false or new > tonumber(cur) then
+  redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+  return new
+end
+return tonumber(cur)
+"""
+
+# KEYS[1] — рядок-лічильник, ARGV[1] — нижня межа
+_FORWARD_SET_LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+local new = tonumber(ARGV[1])
+if new > cur then
+  redis.call('SET', KEYS[1], ARGV[1])
+  return new
+end
+return cur
+"""
+
+# KEYS[1] — seq каналу, ARGV[1] — (необов'язково) стартове значення з Postgres.
+# Ключа нема і старту не дали — nil: викликач дочитає message_seq і повторить
+_NEXT_SEQ_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  if ARGV[1] == nil then
+    return false
+  end
+  redis.call('SET', KEYS[1], ARGV[1], 'NX')
+end
+return redis.call('INCR', KEYS[1])
+"""
+
+
+def _forward_hset_py(mem, keys_: list[bytes], args: list[bytes]) -> int:
+    h = mem._hash(keys_[0], create=True)
+    cur, new = h.get(args[0]), int(args[1])
+    if cur is None or new > int(cur):
+        h[args[0]] = b"%d" % new
+        return new
+    return int(cur)
+
+
+def _forward_set_py(mem, keys_: list[bytes], args: list[bytes]) -> int:
+    k = keys_[0]
+    cur = int(mem.data[k]) if mem._alive(k) else 0
+    new = int(args[0])
+    if new > cur:
+        mem.data[k] = b"%d" % new
+        return new
+    return cur
+
+
+def _next_seq_py(mem, keys_: list[bytes], args: list[bytes]) -> int | None:
+    k = keys_[0]
+    if not mem._alive(k):
+        if not args:
+            return None
+        mem.data[k] = args[0]
+    n = int(mem.data[k]) + 1
+    mem.data[k] = b"%d" % n
+    return n
+
+
+_next_seq = Script(_NEXT_SEQ_LUA, python=_next_seq_py)
+_forward_hset = Script(_FORWARD_HSET_LUA, python=_forward_hset_py)
+_forward_set = Script(_FORWARD_SET_LUA, python=_forward_set_py)
+
+
+class ReadState:
+    def __init__(self):
+        # буфери до наступного flush: (user_id, channel_id) -> seq, channel_id -> seq
+        self._cursors: dict[tuple[int, int], int] = {}
+        self._seqs: dict[int, int] = {}
+        # channel_id -> {user_id: seq} до наступної розсилки read.receipts
+        self._receipts: dict[int, dict[int, int]] = {}
+
+    async def next_seq(self, channel_id: int) -> int | None:
+        """Seq of a just-committed message; None if Redis is unavailable."""
+        key = keys.channel(channel_id, "seq")
+        try:
+            r = await get_redis()
+            seq = await _next_seq(r, [key], [])
+            if seq is None:
+                # ключ втрачено — продовжуємо з Postgres (і з ще не скинутого буфера), а не з 1
+                floor = max(await self._db_seq(channel_id), self._seqs.get(channel_id, 0))
+                seq = await _next_seq(r, [key], [floor])
+            seq = int(seq)
+        except (RedisError, OSError, SQLAlchemyError) as e:
+            log.warning("read state: seq for channel %s failed (%r)", channel_id, e)
+            return None
+        if seq > self._seqs.get(channel_id, 0):
+            self._seqs[channel_id] = seq
+        return seq
+
+    @staticmethod
+    async def _db_seq(channel_id: int) -> int:
+        async with async_session() as db:
+            seq = (await db.execute(select(Channel.message_seq).where(Channel.id == channel_id))).scalar()
+        return seq or 0
+
+    async def mark_read(self, user_id: int, channel_id: int, seq: int, receipt: bool = True, clamp: bool = True) -> int:
+        """Move the cursor forward to `seq` (capped at the channel seq); returns the cursor."""
+        r = await get_redis()
+        if clamp:
+            top = await r.get(keys.channel(channel_id, "seq"))
+            seq = min(int(seq), int(top or 0))
+        cur = int(await _forward_hset(r, [keys.user(user_id, "read")], [channel_id, max(0, seq)]))
+        if cur == seq and seq > self._cursors.get((user_id, channel_id), 0):
+            self._cursors[(user_id, channel_id)] = seq
+            if receipt:
+                self._receipts.setdefault(channel_id, {})[user_id] = seq
+        return cur
+
+    async def unread(self, db: AsyncSession, user_id: int) -> list[dict]:
+        """Badges for every channel of the user: one DB query, one Redis pipeline."""
+        q = await db.execute(select(ChannelParticipant.channel_id).where(ChannelParticipant.user_id == user_id))
+        cids = [c for (c,) in q.all()]
+        if not cids:
+            return []
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        for c in cids:
+            pipe.get(keys.channel(c, "seq"))
+        pipe.hgetall(keys.user(user_id, "read"))
+        res = await pipe.execute()
+        seqs = {c: int(v) if v is not None else None for c, v in zip(cids, res[:-1])}
+        reads = {int(k): int(v) for k, v in (res[-1] or {}).items()}
+        missing = [c for c in cids if seqs[c] is None or c not in reads]
+        if missing:
+            await self._restore(db, r, user_id, missing, seqs, reads)
+        out = []
+        for c in cids:
+            seq, read = seqs[c] or 0, reads.get(c, 0)
+            out.append({"channel_id": c, "seq": seq, "read": read, "unread": max(0, seq - read)})
+        return out
+
+    async def _restore(self, db: AsyncSession, r, user_id: int, cids: list[int], seqs: dict, reads: dict):
+        # Redis втратив ключі (або користувач ще нічого не читав) — беремо копію з Postgres
+        q = await db.execute(
+            select(Channel.id, Channel.message_seq, ReadCursor.last_read_seq)
+            .select_from(Channel)
+            .outerjoin(ReadCursor, (ReadCursor.channel_id == Channel.id) & (ReadCursor.user_id == user_id))
+            .where(Channel.id == func.any(bindparam("cids", cids, type_=ARRAY(BigInteger))))
+        )
+        calls = []
+        for cid, db_seq, db_read in q.all():
+            if seqs.get(cid) is None:
+                calls.append((cid, "seq", _forward_set(r, [keys.channel(cid, "seq")], [db_seq or 0])))
+            if cid not in reads:
+                # пишемо і 0: наступний логін не піде в БД за тим самим
+                calls.append((cid, "read", _forward_hset(r, [keys.user(user_id, "read")], [cid, db_read or 0])))
+        for (cid, what, _), val in zip(calls, await asyncio.gather(*(c for _, _, c in calls))):
+            (seqs if what == "seq" else reads)[cid] = int(val)
+
+    def drain_receipts(self) -> dict[int, dict[int, int]]:
+        receipts, self._receipts = self._receipts, {}
+        return receipts
+
+    async def flush(self):
+        cursors, self._cursors = self._cursors, {}
+        seqs, self._seqs = self._seqs, {}
+        if not cursors and not seqs:
+            return
+        try:
+            async with async_session() as db:
+                if cursors:
+                    (users, chans), vals = zip(*cursors), list(cursors.values())
+                    # лише для чинних учасників: вибулий користувач не ламає всю пачку по FK
+                    await db.execute(text(
+                        "INSERT INTO read_cursors (user_id, channel_id, last_read_seq, updated_at) "
+                        "SELECT v.u, v.c, v.s, timezone('utc', now()) FROM unnest(:u, :c, :s) AS v(u, c, s) "
+                        "WHERE EXISTS (SELECT 1 FROM channel_participants p WHERE p.user_id = v.u AND p.channel_id = v.c) "
+                        "ON CONFLICT (user_id, channel_id) DO UPDATE SET "
+                        "last_read_seq = GREATEST(read_cursors.last_read_seq, excluded.last_read_seq), "
+                        "updated_at = excluded.updated_at"
+                    ).bindparams(
+                        bindparam("u", list(users), type_=ARRAY(BigInteger)),
+                        bindparam("c", list(chans), type_=ARRAY(BigInteger)),
+                        bindparam("s", vals, type_=ARRAY(BigInteger)),
+                    ))
+                if seqs:
+                    await db.execute(text(
+                        "UPDATE channels c SET message_seq = GREATEST(c.message_seq, v.s) "
+                        "FROM unnest(:c, :s) AS v(c, s) WHERE c.id = v.c"
+                    ).bindparams(
+                        bindparam("c", list(seqs), type_=ARRAY(BigInteger)),
+                        bindparam("s", list(seqs.values()), type_=ARRAY(BigInteger)),
+                    ))
+                await db.commit()
+        except Exception:
+            # повертаємо в буфер (вперед-only злиття) — спробуємо наступного разу
+            for k, v in cursors.items():
+                if v > self._cursors.get(k, 0):
+                    self._cursors[k] = v
+            for k, v in seqs.items():
+                if v > self._seqs.get(k, 0):
+                    self._seqs[k] = v
+            raise
+
+    async def run(self, broadcast: Callable[[int, dict], Awaitable[None]]):
+        """Receipts fan-out every READ_RECEIPTS_S, Postgres flush every READ_FLUSH_S."""
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.READ_RECEIPTS_S)
+            for cid, users in self.drain_receipts().items():
+                try:
+                    await broadcast(cid, {
+                        "type": "read.receipts",
+                        "channel_id": cid,
+                        "reads": [{"user_id": u, "seq": s} for u, s in users.items()],
+                    })
+                except Exception:
+                    log.exception("read state: receipts for channel %s failed", cid)
+            if time.monotonic() - last_flush >= settings.READ_FLUSH_S:
+                last_flush = time.monotonic()
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("read state: flush failed")
+
+
+reads = ReadState()
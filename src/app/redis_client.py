@@ -0,0 +1,182 @@
+import asyncio
+import bisect
+import hashlib
+import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster
+from redis.exceptions import NoScriptError, RedisClusterException
+from .config import settings
+from .keys import hash_tag
+from . import memory_redis
+
+
+class ShardedRedis:
+    """
+    Client-side sharding over several independent Redis instances.
+
+    Keys are placed on a consistent-hash ring by their hash tag, so keys of
+    one stream/channel/user share a shard and adding a shard moves ~1/N of
+    them. Single-key commands route by their first argument; scripts route by
+    KEYS and must not span shards; pipelines are split per shard and the
+    replies reassembled in call order.
+    """
+
+    VNODES = 160
+
+    def __init__(self, clients: list[redis.Redis], names: list[str] | None = None):
+        if not clients:
+            raise ValueError("ShardedRedis needs at least one client")
+        self.clients = clients
+        names = names or [str(i) for i in range(len(clients))]
+        ring = []
+        for idx, name in enumerate(names):
+            for v in range(self.VNODES):
+                ring.append((self._point(f"{name}#{v}".encode()), idx))
+        ring.sort()
+        self._points = [p for p, _ in ring]
+        self._owners = [i for _, i in ring]
+
+    @staticmethod
+    def _point(data: bytes) -> int:
+        return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+    def shard_of(self, key) -> int:
+        i = bisect.bisect(self._points, self._point(hash_tag(key))) % len(self._points)
+        return self._owners[i]
+
+    def client_for(self, key) -> redis.Redis:
+        return self.clients[self.shard_of(key)]
+
+    def __getattr__(self, name):
+        def call(key, *args, **kwargs):
+            return getattr(self.client_for(key), name)(key, *args, **kwargs)
+        return call
+
+    def _script_client(self, numkeys: int, keys_and_args) -> redis.Redis:
+        keys = keys_and_args[:numkeys]
+        if not keys:
+            return self.clients[0]
+        shards = {self.shard_of(k) for k in keys}
+        if len(shards) > 1:
+            raise RedisClusterException("script keys span several shards; use one hash tag")
+        return self.clients[shards.pop()]
+
+    async def evalsha(self, sha, numkeys, *keys_and_args):
+        return await self._script_client(numkeys, keys_and_args).evalsha(sha, numkeys, *keys_and_args)
+
+    async def eval(self, script, numkeys, *keys_and_args):
+        return await self._script_client(numkeys, keys_and_args).eval(script, numkeys, *keys_and_args)
+
+    async def ping(self):
+        return all(await asyncio.gather(*(c.ping() for c in self.clients)))
+
+    async def script_load(self, script: str):
+        # скрипт потрібен на кожному шарді
+        return (await asyncio.gather(*(c.script_load(script) for c in self.clients)))[0]
+
+    def pipeline(self, transaction: bool = False):
+        return _ShardedPipeline(self)
+
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self.clients))
+
+    aclose = close
+
+
+class _ShardedPipeline:
+    def __init__(self, owner: ShardedRedis):
+        self.owner = owner
+        self.calls: list[tuple[int, str, tuple, dict]] = []
+
+    def __getattr__(self, name):
+        def queue(key, *args, **kwargs):
+            self.calls.append((self.owner.shard_of(key), name, (key,) + args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        by_shard: dict[int, list[int]] = {}
+        for i, (shard, *_rest) in enumerate(self.calls):
+            by_shard.setdefault(shard, []).append(i)
+
+        async def run(shard: int, idxs: list[int]):
+            pipe = self.owner.clients[shard].pipeline(transaction=False)
+            for i in idxs:
+                _, name, args, kwargs = self.calls[i]
+                getattr(pipe, name)(*args, **kwargs)
+            return idxs, await pipe.execute()
+
+        out = [None] * len(self.calls)
+        for idxs, replies in await asyncio.gather(*(run(s, ix) for s, ix in by_shard.items())):
+            for i, rep in zip(idxs, replies):
+                out[i] = rep
+        self.calls = []
+        return out
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.calls = []
+
+
+_client = None
+
+
+def _build():
+    url = settings.REDIS_URL
+    if url.startswith("memory://"):
+        # in-process фейк (бенчмарки, один воркер без Redis)
+        return memory_redis.shared()
+    mode = settings.REDIS_MODE
+    if mode == "cluster":
+        return RedisCluster.from_url(url)
+    if mode == "sharded":
+        urls = [u.strip() for u in settings.REDIS_SHARD_URLS.split(",") if u.strip()] or [url]
+        return ShardedRedis([redis.from_url(u) for u in urls], names=urls)
+    return redis.from_url(url)
+
+
+async def get_redis() -> redis.Redis:
+    """Process-wide client (connection pool shared by all requests) — do not close it."""
+    global _client
+    if _client is None:
+        _client = _build()
+    return _client
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        c, _client = _client, None
+        await c.close()
+
+
+async def run_script(r, script: "Script", keys: list, args: list):
+    try:
+        return await r.evalsha(script.sha, len(keys), *keys, *args)
+    except NoScriptError:
+        # EVAL заодно кешує скрипт на сервері
+        return await r.eval(script.source, len(keys), *keys, *args)
+
+
+class Script:
+    """Lua source + its SHA1; `python` is the MemoryRedis implementation."""
+
+    registry: list["Script"] = []
+
+    def __init__(self, source: str, python=None):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        if python is not None:
+            memory_redis.MemoryRedis.register_script(self.sha, python)
+        Script.registry.append(self)
+
+    async def __call__(self, r, keys: list, args: list):
+        return await run_script(r, self, keys, args)
+
+
+async def load_scripts(r) -> int:
+    """SCRIPT LOAD every Script defined so far, so the first EVALSHA never misses."""
+    for s in Script.registry:
+        await r.script_load(s.source)
+    return len(Script.registry)
@@ -1,26 +1,81 @@
+import asyncio
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, insert
-from ..db import async_session
-from ..models import User, Stream, PriorityPolicy, Channel, ChannelParticipant
-from ..schemas import PriorityPolicyIn, PriorityPolicyOut, ChannelCreate
+from sqlalchemy import delete, func, select, insert, update, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..adaptive import adaptive
+from ..admission import admission
+from ..config import settings
+from ..db import async_session, pool_status
+from ..drain import drain
+from ..limiter_view import limiter_view
+from ..models import Attachment, User, Stream, PriorityPolicy, PolicyTier, Channel, ChannelParticipant, StreamUsage
+from ..policy_table import policies
+from ..presence import presence
+from .. import dal, partitions
+from ..storage_gc import collector
+from ..usage import usage
+from ..schemas import PriorityPolicyIn, PriorityPolicyOut, ChannelCreate, PolicyTierIn, PolicyTierOut, TierAssignIn
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+PAGE_MAX = 1000
+NDJSON_BATCH = 500
+
 async def get_db() -> AsyncSession:
     async with async_session() as s:
         yield s
 
+# ---------- LISTING HELPERS ----------
+# Без limit/format — старий формат (весь список). limit → keyset-сторінка
+# {"items", "next_cursor"}; format=ndjson → потік рядків із server-side курсора.
+# Всюди лише колонки (кортежі), без ORM-об'єктів.
+async def _listing(db: AsyncSession, stmt, key_col, row_fn, limit: int | None, after: int | None, fmt: str | None):
+    if after is not None:
+        stmt = stmt.where(key_col > after)
+    stmt = stmt.order_by(key_col)
+    if fmt == "ndjson":
+        return StreamingResponse(_ndjson(stmt, row_fn), media_type="application/x-ndjson")
+    if fmt not in (None, "json"):
+        raise HTTPException(400, "format must be json or ndjson")
+    if limit is None:
+        return [row_fn(r) for r in (await db.execute(stmt)).all()]
+    limit = max(1, min(limit, PAGE_MAX))
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": [row_fn(r) for r in rows], "next_cursor": rows[-1].id if more else None}
+
+async def _ndjson(stmt, row_fn):
+    # окрема сесія: залежність get_db закривається до початку стрімінгу
+    async with async_session() as s:
+        res = await s.stream(stmt.execution_options(yield_per=NDJSON_BATCH))
+        async for part in res.partitions():
+            yield "".join(json.dumps(row_fn(r)) + "\n" for r in part).encode()
+            # віддаємо петлю чат-трафіку між пачками
+            await asyncio.sleep(0)
+
 # ---------- USERS ----------
+def _user_row(u):
+    return {"id": u.id, "email": u.email, "display_name": u.display_name}
+
 @router.get("/users")
-async def list_users(db: AsyncSession = Depends(get_db)):
-    q = await db.execute(select(User))
-    rows = q.scalars().all()
-    return [
-        {"id": u.id, "email": u.email, "display_name": u.display_name}
-        for u in rows
-    ]
+async def list_users(
+    limit: int | None = None,
+    after: int | None = None,
+    q: str | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    stmt = select(User.id, User.email, User.display_name)
+    if q:
+        like = f"%{q}%"
+        stmt = stmt.where(or_(User.display_name.ilike(like), User.email.ilike(like)))
+    return await _listing(db, stmt, User.id, _user_row, limit, after, fmt)
 
 @router.post("/users")
 async def create_user(
@@ -41,11 +96,24 @@ async def create_user(
     return {"id": u.id, "email": u.email, "display_name": u.display_name}
 
 # ---------- CHANNELS ----------
+def _channel_row(c):
+    return {"id": c.id, "name": c.name, "is_group": c.is_group}
+
 @router.get("/channels")
-async def list_channels(db: AsyncSession = Depends(get_db)):
-    q = await db.execute(select(Channel))
-    rows = q.scalars().all()
-    return [{"id": c.id, "name": c.name, "is_group": c.is_group} for c in rows]
+async def list_channels(
+    limit: int | None = None,
+    after: int | None = None,
+    q: str | None = None,
+    is_group: bool | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    stmt = select(Channel.id, Channel.name, Channel.is_group)
+    if q:
+        stmt = stmt.where(Channel.name.ilike(f"%{q}%"))
+    if is_group is not None:
+        stmt = stmt.where(Channel.is_group.is_(is_group))
+    return await _listing(db, stmt, Channel.id, _channel_row, limit, after, fmt)
 
 @router.post("/channels")
 async def create_channel(body: ChannelCreate, db: AsyncSession = Depends(get_db)):
@@ -67,77 +135,98 @@ async def add_participant(
     db: AsyncSession = Depends(get_db),
 ):
     # перевіряємо канал
-    q = await db.execute(select(Channel).where(Channel.id == channel_id))
-    if not q.scalar_one_or_none():
+    q = await db.execute(select(Channel.id).where(Channel.id == channel_id))
+    if not q.first():
         raise HTTPException(404, "channel not found")
 
     # ГОЛОВНЕ: якщо користувача не існує — створюємо (щоб не падати на FK)
-    uq = await db.execute(select(User).where(User.id == user_id))
-    u = uq.scalar_one_or_none()
-    if not u:
-        await db.execute(
-            insert(User).values(id=user_id, display_name=f"User {user_id}", email=None)
-        )
-
+    await db.execute(
+        pg_insert(User)
+        .values(id=user_id, display_name=f"User {user_id}", email=None)
+        .on_conflict_do_nothing(index_elements=[User.id])
+    )
     # додаємо учасника, якщо ще не доданий
-    q2 = await db.execute(
-        select(ChannelParticipant).where(
-            ChannelParticipant.channel_id == channel_id,
-            ChannelParticipant.user_id == user_id,
-        )
+    await db.execute(
+        pg_insert(ChannelParticipant)
+        .values(channel_id=channel_id, user_id=user_id, role=role)
+        .on_conflict_do_nothing(index_elements=[ChannelParticipant.channel_id, ChannelParticipant.user_id])
     )
-    if not q2.scalar_one_or_none():
-        await db.execute(
-            insert(ChannelParticipant).values(
-                channel_id=channel_id, user_id=user_id, role=role
-            )
-        )
     await db.commit()
     return {"ok": True}
 
+def _participant_row(p):
+    return {"id": p.id, "channel_id": p.channel_id, "user_id": p.user_id, "role": p.role}
+
 @router.get("/channels/{channel_id}/participants")
-async def list_participants(channel_id: int, db: AsyncSession = Depends(get_db)):
-    q = await db.execute(
-        select(ChannelParticipant).where(ChannelParticipant.channel_id == channel_id)
-    )
-    rows = q.scalars().all()
-    return [
-        {"id": p.id, "channel_id": p.channel_id, "user_id": p.user_id, "role": p.role}
-        for p in rows
-    ]
+async def list_participants(
+    channel_id: int,
+    limit: int | None = None,
+    after: int | None = None,
+    role: str | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    stmt = select(
+        ChannelParticipant.id, ChannelParticipant.channel_id, ChannelParticipant.user_id, ChannelParticipant.role
+    ).where(ChannelParticipant.channel_id == channel_id)
+    if role:
+        stmt = stmt.where(ChannelParticipant.role == role)
+    return await _listing(db, stmt, ChannelParticipant.id, _participant_row, limit, after, fmt)
+
+@router.get("/channels/{channel_id}/presence")
+async def channel_presence(channel_id: int, db: AsyncSession = Depends(get_db)):
+    """Live status of every member: one query for the members, one Redis pipeline for the status."""
+    members = await dal.members(db, channel_id)
+    status = await presence.status_of(members)
+    return {"channel_id": channel_id, "users": [{"user_id": u, "status": s} for u, s in status.items()]}
 
 # ---------- STREAMS & POLICIES ----------
+def _stream_row(r):
+    return {
+        "id": r.id,
+        "channel_id": r.channel_id,
+        "owner_user_id": r.owner_user_id,
+        "tier_id": r.tier_id,
+        "policy": None
+        if r.policy_id is None
+        else {
+            "id": r.policy_id,
+            "msg_rate_rps": r.msg_rate_rps,
+            "upload_bps": r.upload_bps,
+            "download_bps": r.download_bps,
+            "burst": r.burst,
+            "enabled": r.enabled,
+            "updated_by": r.updated_by,
+            "updated_at": r.updated_at.isoformat(),
+        },
+    }
+
 @router.get("/streams/{channel_id}")
-async def list_streams(channel_id: int, db: AsyncSession = Depends(get_db)):
-    q = await db.execute(
-        select(Stream, PriorityPolicy)
+async def list_streams(
+    channel_id: int,
+    limit: int | None = None,
+    after: int | None = None,
+    owner_user_id: int | None = None,
+    has_policy: bool | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    stmt = (
+        select(
+            Stream.id, Stream.channel_id, Stream.owner_user_id, Stream.tier_id,
+            PriorityPolicy.id.label("policy_id"), PriorityPolicy.msg_rate_rps, PriorityPolicy.upload_bps,
+            PriorityPolicy.download_bps, PriorityPolicy.burst, PriorityPolicy.enabled,
+            PriorityPolicy.updated_by, PriorityPolicy.updated_at,
+        )
         .select_from(Stream)
         .outerjoin(PriorityPolicy, PriorityPolicy.stream_id == Stream.id)
         .where(Stream.channel_id == channel_id)
     )
-    rows = q.all()
-    out = []
-    for s, p in rows:
-        out.append(
-            {
-                "id": s.id,
-                "channel_id": s.channel_id,
-                "owner_user_id": s.owner_user_id,
-                "policy": None
-                if p is None
-                else {
-                    "id": p.id,
-                    "msg_rate_rps": p.msg_rate_rps,
-                    "upload_bps": p.upload_bps,
-                    "download_bps": p.download_bps,
-                    "burst": p.burst,
-                    "enabled": p.enabled,
-                    "updated_by": p.updated_by,
-                    "updated_at": p.updated_at.isoformat(),
-                },
-            }
-        )
-    return out
+    if owner_user_id is not None:
+        stmt = stmt.where(Stream.owner_user_id == owner_user_id)
+    if has_policy is not None:
+        stmt = stmt.where(PriorityPolicy.id.isnot(None) if has_policy else PriorityPolicy.id.is_(None))
+    return await _listing(db, stmt, Stream.id, _stream_row, limit, after, fmt)
 
 @router.put("/streams/{stream_id}/policy")
 async def upsert_policy(
@@ -145,12 +234,7 @@ async def upsert_policy(
     body: PriorityPolicyIn,
     db: AsyncSession = Depends(get_db),
 ):
-    q = await db.execute(
-        select(PriorityPolicy).where(PriorityPolicy.stream_id == stream_id)
-    )
-    p = q.scalar_one_or_none()
     policy_data = {
-        "stream_id": stream_id,
         "msg_rate_rps": body.msg_rate_rps,
         "upload_bps": body.upload_bps,
         "download_bps": body.download_bps,
@@ -158,84 +242,244 @@ async def upsert_policy(
         "enabled": body.enabled,
         "updated_by": body.updated_by,
     }
-    if p:
-        await db.execute(
-            update(PriorityPolicy).where(PriorityPolicy.id == p.id).values(**policy_data)
-        )
-        await db.commit()
-        q2 = await db.execute(
-            select(PriorityPolicy).where(PriorityPolicy.id == p.id)
-        )
-        row = q2.scalar_one()
-        return PriorityPolicyOut(
-            id=row.id,
-            stream_id=row.stream_id,
-            msg_rate_rps=row.msg_rate_rps,
-            upload_bps=row.upload_bps,
-            download_bps=row.download_bps,
-            burst=row.burst,
-            enabled=row.enabled,
-            updated_at=row.updated_at,
-        )
-    else:
-        res = await db.execute(
-            insert(PriorityPolicy).values(**policy_data).returning(PriorityPolicy.id)
-        )
-        new_id = res.scalar_one()
-        await db.commit()
-        q2 = await db.execute(
-            select(PriorityPolicy).where(PriorityPolicy.id == new_id)
-        )
-        row = q2.scalar_one()
-        return PriorityPolicyOut(
-            id=row.id,
-            stream_id=row.stream_id,
-            msg_rate_rps=row.msg_rate_rps,
-            upload_bps=row.upload_bps,
-            download_bps=row.download_bps,
-            burst=row.burst,
-            enabled=row.enabled,
-            updated_by=row.updated_by,
-            updated_at=row.updated_at,
-        )
+    # один round-trip: insert або update по унікальному stream_id
+    stmt = pg_insert(PriorityPolicy).values(stream_id=stream_id, **policy_data)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PriorityPolicy.stream_id],
+        set_={**policy_data, "updated_at": func.timezone("utc", func.now())},
+    ).returning(
+        PriorityPolicy.id,
+        PriorityPolicy.stream_id,
+        PriorityPolicy.msg_rate_rps,
+        PriorityPolicy.upload_bps,
+        PriorityPolicy.download_bps,
+        PriorityPolicy.burst,
+        PriorityPolicy.enabled,
+        PriorityPolicy.updated_by,
+        PriorityPolicy.updated_at,
+    )
+    row = (await db.execute(stmt)).one()
+    await db.commit()
+    await policies.bump()
+    return PriorityPolicyOut(**row._mapping)
+
+@router.get("/streams/{stream_id}/effective_policy")
+async def effective_policy(stream_id: int, db: AsyncSession = Depends(get_db)):
+    q = await db.execute(select(Stream.channel_id).where(Stream.id == stream_id))
+    row = q.first()
+    if not row:
+        raise HTTPException(404, "stream not found")
+    await policies.refresh()
+    lim = policies.resolve(row.channel_id, stream_id)
+    # adaptive — те, що зараз реально діє на цьому воркері
+    return {
+        "stream_id": stream_id, "version": policies.version, **lim._asdict(),
+        "adaptive": adaptive.apply(lim)._asdict() if adaptive.enabled else None,
+    }
+
+# ---------- TIERS ----------
+# Тир — іменований клас лімітів; стріми й канали посилаються на нього tier_id.
+# Зміна тиру — один рядок + bump версії, без переписування політик стрімів.
+_TIER_COLS = (
+    PolicyTier.id, PolicyTier.name, PolicyTier.msg_rate_rps, PolicyTier.upload_bps,
+    PolicyTier.download_bps, PolicyTier.burst, PolicyTier.priority, PolicyTier.quota_msgs_day,
+    PolicyTier.quota_bytes_day, PolicyTier.quota_bytes_month, PolicyTier.updated_at,
+)
+
+@router.get("/tiers")
+async def list_tiers(db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(select(*_TIER_COLS).order_by(PolicyTier.priority.desc(), PolicyTier.name))).all()
+    return [PolicyTierOut(**r._mapping) for r in rows]
+
+@router.put("/tiers/{name}")
+async def upsert_tier(name: str, body: PolicyTierIn, db: AsyncSession = Depends(get_db)):
+    data = body.model_dump()
+    stmt = pg_insert(PolicyTier).values(name=name, **data)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PolicyTier.name],
+        set_={**data, "updated_at": func.timezone("utc", func.now())},
+    ).returning(*_TIER_COLS)
+    row = (await db.execute(stmt)).one()
+    await db.commit()
+    await policies.bump()
+    return PolicyTierOut(**row._mapping)
+
+@router.delete("/tiers/{name}")
+async def delete_tier(name: str, db: AsyncSession = Depends(get_db)):
+    # стріми й канали цього тиру повертаються до наступного рівня (FK SET NULL)
+    res = await db.execute(delete(PolicyTier).where(PolicyTier.name == name).returning(PolicyTier.id))
+    if res.first() is None:
+        raise HTTPException(404, "tier not found")
+    await db.commit()
+    await policies.bump()
+    return {"ok": True}
+
+async def _tier_id(db: AsyncSession, name: str | None) -> int | None:
+    if name is None:
+        return None
+    q = await db.execute(select(PolicyTier.id).where(PolicyTier.name == name))
+    row = q.first()
+    if not row:
+        raise HTTPException(404, "tier not found")
+    return row.id
+
+@router.put("/streams/{stream_id}/tier")
+async def set_stream_tier(stream_id: int, body: TierAssignIn, db: AsyncSession = Depends(get_db)):
+    tier_id = await _tier_id(db, body.tier)
+    res = await db.execute(update(Stream).where(Stream.id == stream_id).values(tier_id=tier_id).returning(Stream.id))
+    if res.first() is None:
+        raise HTTPException(404, "stream not found")
+    await db.commit()
+    await policies.bump()
+    return {"stream_id": stream_id, "tier": body.tier}
+
+@router.put("/channels/{channel_id}/tier")
+async def set_channel_tier(channel_id: int, body: TierAssignIn, db: AsyncSession = Depends(get_db)):
+    tier_id = await _tier_id(db, body.tier)
+    res = await db.execute(update(Channel).where(Channel.id == channel_id).values(tier_id=tier_id).returning(Channel.id))
+    if res.first() is None:
+        raise HTTPException(404, "channel not found")
+    await db.commit()
+    await policies.bump()
+    return {"channel_id": channel_id, "tier": body.tier}
 
 
 @router.post("/channels/{channel_id}/ensure_streams")
 async def ensure_streams(channel_id: int, db: AsyncSession = Depends(get_db)):
     # перевіряємо, що канал існує
-    q = await db.execute(select(Channel).where(Channel.id == channel_id))
-    ch = q.scalar_one_or_none()
-    if not ch:
+    q = await db.execute(select(Channel.id).where(Channel.id == channel_id))
+    if not q.first():
         raise HTTPException(404, "channel not found")
 
-    # всі учасники каналу
-    qp = await db.execute(
-        select(ChannelParticipant.user_id).where(ChannelParticipant.channel_id == channel_id)
+    # стріми для всіх учасників, яким бракує, — одним INSERT ... SELECT
+    res = await db.execute(
+        pg_insert(Stream)
+        .from_select(
+            ["channel_id", "owner_user_id", "created_at"],
+            select(ChannelParticipant.channel_id, ChannelParticipant.user_id, func.timezone("utc", func.now()))
+            .where(ChannelParticipant.channel_id == channel_id),
+        )
+        .on_conflict_do_nothing(index_elements=[Stream.channel_id, Stream.owner_user_id])
+        .returning(Stream.id)
     )
-    user_ids = {row[0] for row in qp.all()}
-
-    if not user_ids:
-        return {"created": [], "already": []}
+    created_ids = sorted(r[0] for r in res.all())
+    if created_ids:
+        await db.commit()
 
-    # існуючі стріми для каналу
     qs = await db.execute(
-        select(Stream.owner_user_id).where(Stream.channel_id == channel_id)
+        select(Stream.owner_user_id)
+        .where(Stream.channel_id == channel_id, Stream.id.notin_(created_ids))
+        .order_by(Stream.owner_user_id)
     )
-    have = {row[0] for row in qs.all()}
+    return {"created": created_ids, "already": [r[0] for r in qs.all()]}
 
-    # кого бракує
-    missing = sorted(user_ids - have)
-    created_ids: list[int] = []
+# ---------- DB POOL ----------
+@router.get("/db/pool")
+async def db_pool():
+    return pool_status()
 
-    for uid in missing:
-        res = await db.execute(
-            insert(Stream)
-            .values(channel_id=channel_id, owner_user_id=uid)
-            .returning(Stream.id)
-        )
-        created_ids.append(res.scalar_one())
+# ---------- ADMISSION ----------
+@router.get("/admission")
+async def admission_status():
+    return admission.snapshot()
 
-    if created_ids:
-        await db.commit()
+@router.post("/drain")
+async def drain_worker():
+    """Drain this worker before it stops (preStop hook); returns when done."""
+    return await drain.run()
+
+@router.get("/adaptive")
+async def adaptive_status():
+    return adaptive.snapshot()
+
+# ---------- USAGE ----------
+_GRAINS = ("minute", "hour", "day")
+
+@router.get("/usage/streams/{stream_id}")
+async def stream_usage(
+    stream_id: int,
+    grain: str = "hour",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(500, ge=1, le=10_000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Rolled-up series (newest first) plus live totals against the stream's quotas."""
+    if grain not in _GRAINS:
+        raise HTTPException(400, f"grain must be one of {', '.join(_GRAINS)}")
+    row = (await db.execute(select(Stream.channel_id).where(Stream.id == stream_id))).first()
+    if not row:
+        raise HTTPException(404, "stream not found")
+    stmt = (
+        select(StreamUsage.ts, StreamUsage.msgs, StreamUsage.bytes_up, StreamUsage.bytes_down)
+        .where(StreamUsage.stream_id == stream_id, StreamUsage.grain == grain)
+        .order_by(StreamUsage.ts.desc()).limit(limit)
+    )
+    if since is not None:
+        stmt = stmt.where(StreamUsage.ts >= since)
+    if until is not None:
+        stmt = stmt.where(StreamUsage.ts < until)
+    points = [
+        {"ts": r.ts.isoformat(), "msgs": r.msgs, "bytes_up": r.bytes_up, "bytes_down": r.bytes_down}
+        for r in (await db.execute(stmt)).all()
+    ]
+    await policies.refresh()
+    lim = policies.resolve(row.channel_id, stream_id)
+    return {
+        "stream_id": stream_id,
+        "grain": grain,
+        "points": points,
+        "current": await usage.current(stream_id),
+        "quota": {
+            "msgs_day": lim.quota_msgs_day,
+            "bytes_day": lim.quota_bytes_day,
+            "bytes_month": lim.quota_bytes_month,
+        },
+    }
+
+@router.post("/usage/rollup")
+async def usage_rollup():
+    # спершу свій буфер, щоб зведення включило щойно пораховане
+    await usage.flush()
+    return await usage.rollup()
+
+# ---------- LIVE LIMITER ----------
+@router.get("/limiter/channels/{channel_id}")
+async def limiter_state(channel_id: int):
+    return await limiter_view.snapshot(channel_id)
+
+@router.websocket("/limiter/feed")
+async def limiter_feed(ws: WebSocket, channel_id: int):
+    # push раз на LIMITER_VIEW_PUSH_S; знімок спільний для всіх, хто дивиться канал
+    await ws.accept()
+    try:
+        while True:
+            await ws.send_text(json.dumps({"type": "limiter.state", **await limiter_view.snapshot(channel_id)}))
+            await asyncio.sleep(settings.LIMITER_VIEW_PUSH_S)
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # RuntimeError — send після закриття сокета
+
+# ---------- MESSAGE PARTITIONS ----------
+@router.get("/db/partitions")
+async def list_message_partitions(db: AsyncSession = Depends(get_db)):
+    conn = await db.connection()
+    return [
+        {"name": name, "until": upper.isoformat() if upper else None, "detach_pending": pending}
+        for name, upper, pending in await partitions.partitions(conn)
+    ]
+
+@router.post("/db/partitions/maintain")
+async def maintain_message_partitions():
+    return await partitions.maintain()
+
+# ---------- STORAGE GC ----------
+@router.get("/storage/gc")
+async def storage_gc_status(db: AsyncSession = Depends(get_db)):
+    q = await db.execute(
+        select(Attachment.status, func.count()).where(Attachment.status != "complete").group_by(Attachment.status)
+    )
+    return {"open_uploads": dict(q.all()), "last_pass": collector.last}
 
-    return {"created": created_ids, "already": sorted(have)}
+@router.post("/storage/gc")
+async def storage_gc_run():
+    return await collector.collect()
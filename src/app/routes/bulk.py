@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import ARRAY, BigInteger, Boolean, Integer, Text, bindparam, cast, func, insert, literal, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db import async_session
+from ..policy_table import policies
+from ..models import User, Channel, ChannelParticipant, Stream, PriorityPolicy
+from ..schemas import UserBulkIn, ParticipantBulkIn, StreamBulkIn, PolicyBulkIn
+
+# Масові операції для онбордингу: тіло — JSON-масив, NDJSON (application/x-ndjson)
+# або CSV (text/csv) з заголовком. Кожна операція — кілька set-based запитів
+# (unnest + INSERT ... ON CONFLICT) в одній транзакції, незалежно від кількості рядків.
+# Відповідь: {"results": [...]} у порядку рядків тіла, status: created | updated | exists | error.
+router = APIRouter(prefix="/admin/bulk", tags=["admin"])
+
+_users = User.__table__
+_cp = ChannelParticipant.__table__
+_st = Stream.__table__
+_pp = PriorityPolicy.__table__
+
+_INSERTED = literal_column("(xmax = 0)").label("inserted")
+
+async def get_db() -> AsyncSession:
+    async with async_session() as s:
+        yield s
+
+async def read_rows(request: Request) -> list[dict]:
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    raw = (await request.body()).decode("utf-8-sig")
+    if not raw.strip():
+        return []
+    try:
+        if ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            return [json.loads(line) for line in raw.splitlines() if line.strip()]
+        if ctype == "text/csv":
+            return [{k: (v if v != "" else None) for k, v in r.items()} for r in csv.DictReader(io.StringIO(raw))]
+        data = json.loads(raw)
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(400, f"bad body: {e}")
+    if not isinstance(data, list):
+        raise HTTPException(400, "expected a JSON array")
+    return data
+
+def _validate(rows: list[dict], model: type[BaseModel], results: list) -> list[tuple[int, BaseModel]]:
+    ok = []
+    for i, row in enumerate(rows):
+        try:
+            ok.append((i, model.model_validate(row)))
+        except ValidationError as e:
+            results[i] = {"status": "error", "error": "invalid", "detail": e.errors(include_url=False)}
+    return ok
+
+def _dedupe(valid: list[tuple[int, BaseModel]], key, results: list) -> dict:
+    # ON CONFLICT DO UPDATE не може зачепити той самий рядок двічі — останній виграє
+    out = {}
+    for i, m in valid:
+        k = key(m)
+        if k in out:
+            results[out[k][0]] = {"status": "error", "error": "duplicate", "superseded_by": i}
+        out[k] = (i, m)
+    return out
+
+def _arr(name: str, values: list, type_):
+    return bindparam(name, values, type_=ARRAY(type_))
+
+def _utcnow():
+    return func.timezone("utc", func.now())
+
+async def _bump_sequence(db: AsyncSession, table: str):
+    # явні id не рухають sequence — підтягуємо, щоб автоінкремент не зіткнувся
+    await db.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"GREATEST(max(id), nextval(pg_get_serial_sequence('{table}', 'id')) - 1)) FROM {table}"
+    ))
+
+async def _existing(db: AsyncSession, col, ids) -> set[int]:
+    if not ids:
+        return set()
+    q = await db.execute(select(col).where(col == func.any(_arr("ids", sorted(ids), BigInteger))))
+    return {r[0] for r in q.all()}
+
+async def _ensure_users(db: AsyncSession, user_ids: list[int]):
+    u = func.unnest(_arr("uids", user_ids, BigInteger)).table_valued("id")
+    await db.execute(
+        pg_insert(_users)
+        .from_select(
+            ["id", "display_name", "created_at"],
+            select(u.c.id, literal("User ") + cast(u.c.id, Text), _utcnow()),
+        )
+        .on_conflict_do_nothing(index_elements=["id"])
+    )
+    await _bump_sequence(db, "users")
+
+# ---------- USERS ----------
+@router.post("/users")
+async def bulk_users(request: Request, db: AsyncSession = Depends(get_db)):
+    rows = await read_rows(request)
+    results: list = [None] * len(rows)
+    valid = _validate(rows, UserBulkIn, results)
+    with_id = _dedupe([(i, m) for i, m in valid if m.id is not None], lambda m: m.id, results)
+    no_id = [(i, m) for i, m in valid if m.id is None]
+
+    if with_id:
+        items = list(with_id.values())
+        u = func.unnest(
+            _arr("ids", [m.id for _, m in items], BigInteger),
+            _arr("emails", [m.email for _, m in items], Text),
+            _arr("names", [m.display_name for _, m in items], Text),
+        ).table_valued("id", "email", "display_name")
+        stmt = pg_insert(_users).from_select(
+            ["id", "email", "display_name", "created_at"],
+            select(u.c.id, u.c.email, u.c.display_name, _utcnow()),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "email": func.coalesce(stmt.excluded.email, _users.c.email),
+                "display_name": func.coalesce(stmt.excluded.display_name, _users.c.display_name),
+            },
+        ).returning(_users.c.id, _INSERTED)
+        for uid, inserted in (await db.execute(stmt)).all():
+            idx = with_id[uid][0]
+            results[idx] = {"status": "created" if inserted else "updated", "id": uid}
+        await _bump_sequence(db, "users")
+
+    if no_id:
+        conn = await db.connection()
+        res = await conn.execute(
+            insert(_users).returning(_users.c.id, sort_by_parameter_order=True),
+            [{"email": m.email, "display_name": m.display_name} for _, m in no_id],
+        )
+        for (i, _), (uid,) in zip(no_id, res.all()):
+            results[i] = {"status": "created", "id": uid}
+
+    await db.commit()
+    return {"results": results}
+
+# ---------- PARTICIPANTS ----------
+@router.post("/channels/{channel_id}/participants")
+async def bulk_participants(
+    channel_id: int,
+    request: Request,
+    update_roles: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    if not (await db.execute(select(Channel.id).where(Channel.id == channel_id))).first():
+        raise HTTPException(404, "channel not found")
+    rows = await read_rows(request)
+    results: list = [None] * len(rows)
+    by_user = _dedupe(_validate(rows, ParticipantBulkIn, results), lambda m: m.user_id, results)
+    if by_user:
+        items = list(by_user.values())
+        user_ids = [m.user_id for _, m in items]
+        # як і add_participant: неіснуючих користувачів створюємо
+        await _ensure_users(db, user_ids)
+        u = func.unnest(
+            _arr("uids", user_ids, BigInteger),
+            _arr("roles", [m.role for _, m in items], Text),
+        ).table_valued("user_id", "role")
+        stmt = pg_insert(_cp).from_select(
+            ["channel_id", "user_id", "role", "joined_at"],
+            select(literal(channel_id, BigInteger), u.c.user_id, u.c.role, _utcnow()),
+        )
+        # no-op update, щоб RETURNING віддав і вже наявні рядки
+        role = stmt.excluded.role if update_roles else _cp.c.role
+        stmt = stmt.on_conflict_do_update(index_elements=["channel_id", "user_id"], set_={"role": role})
+        stmt = stmt.returning(_cp.c.id, _cp.c.user_id, _INSERTED)
+        for pid, uid, inserted in (await db.execute(stmt)).all():
+            status = "created" if inserted else ("updated" if update_roles else "exists")
+            results[by_user[uid][0]] = {"status": status, "id": pid, "user_id": uid}
+    await db.commit()
+    return {"results": results}
+
+# ---------- STREAMS ----------
+@router.post("/channels/{channel_id}/streams")
+async def bulk_streams(channel_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """Body: owners to create streams for; an empty body means every participant."""
+    if not (await db.execute(select(Channel.id).where(Channel.id == channel_id))).first():
+        raise HTTPException(404, "channel not found")
+    rows = await read_rows(request)
+    results: list = [None] * len(rows)
+    if rows:
+        by_owner = _dedupe(_validate(rows, StreamBulkIn, results), lambda m: m.owner_user_id, results)
+        known = await _existing(db, User.id, set(by_owner))
+        for uid, (i, _) in list(by_owner.items()):
+            if uid not in known:
+                results[i] = {"status": "error", "error": "user_not_found", "owner_user_id": uid}
+                del by_owner[uid]
+        src = func.unnest(_arr("owners", sorted(by_owner), BigInteger)).table_valued("owner_user_id")
+        src_sel = select(literal(channel_id, BigInteger), src.c.owner_user_id, _utcnow())
+    else:
+        by_owner = None
+        src_sel = select(literal(channel_id, BigInteger), _cp.c.user_id, _utcnow()).where(_cp.c.channel_id == channel_id)
+
+    out = []
+    if by_owner is None or by_owner:
+        stmt = pg_insert(_st).from_select(["channel_id", "owner_user_id", "created_at"], src_sel)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["channel_id", "owner_user_id"], set_={"channel_id": stmt.excluded.channel_id}
+        ).returning(_st.c.id, _st.c.owner_user_id, _INSERTED)
+        for sid, uid, inserted in (await db.execute(stmt)).all():
+            r = {"status": "created" if inserted else "exists", "id": sid, "owner_user_id": uid}
+            if by_owner is None:
+                out.append(r)
+            else:
+                results[by_owner[uid][0]] = r
+    await db.commit()
+    return {"results": results if by_owner is not None else sorted(out, key=lambda r: r["owner_user_id"])}
+
+# ---------- POLICIES ----------
+@router.post("/policies")
+async def bulk_policies(request: Request, db: AsyncSession = Depends(get_db)):
+    rows = await read_rows(request)
+    results: list = [None] * len(rows)
+    by_stream = _dedupe(_validate(rows, PolicyBulkIn, results), lambda m: m.stream_id, results)
+
+    streams = await _existing(db, Stream.id, set(by_stream))
+    editors = await _existing(db, User.id, {m.updated_by for _, m in by_stream.values() if m.updated_by is not None})
+    for sid, (i, m) in list(by_stream.items()):
+        if sid not in streams:
+            results[i] = {"status": "error", "error": "stream_not_found", "stream_id": sid}
+        elif m.updated_by is not None and m.updated_by not in editors:
+            results[i] = {"status": "error", "error": "updated_by_not_found", "stream_id": sid}
+        else:
+            continue
+        del by_stream[sid]
+
+    if by_stream:
+        items = list(by_stream.values())
+        col = lambda name: [getattr(m, name) for _, m in items]  # noqa: E731
+        u = func.unnest(
+            _arr("sids", col("stream_id"), BigInteger),
+            _arr("rps", col("msg_rate_rps"), Integer),
+            _arr("up", col("upload_bps"), BigInteger),
+            _arr("down", col("download_bps"), BigInteger),
+            _arr("burst", col("burst"), Integer),
+            _arr("enabled", col("enabled"), Boolean),
+            _arr("by", col("updated_by"), BigInteger),
+        ).table_valued("stream_id", "msg_rate_rps", "upload_bps", "download_bps", "burst", "enabled", "updated_by")
+        fields = ["stream_id", "msg_rate_rps", "upload_bps", "download_bps", "burst", "enabled", "updated_by"]
+        stmt = pg_insert(_pp).from_select(
+            fields + ["updated_at"],
+            select(*(u.c[f] for f in fields), _utcnow()),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["stream_id"],
+            set_={f: stmt.excluded[f] for f in fields[1:] + ["updated_at"]},
+        ).returning(_pp.c.id, _pp.c.stream_id, _INSERTED)
+        for pid, sid, inserted in (await db.execute(stmt)).all():
+            results[by_stream[sid][0]] = {"status": "created" if inserted else "updated", "id": pid, "stream_id": sid}
+    await db.commit()
+    if by_stream:
+        await policies.bump()
+    return {"results": results}
@@ -1,18 +1,26 @@
 import os
 import asyncio
-import time
+import logging
 from starlette.requests import Request
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import insert, select, update
+from ..adaptive import adaptive
+from ..admission import Rejected, admission
+from ..compression import GunzipReader, GzipSampler, accepts_gzip
 from ..db import async_session
-from ..models import Attachment, Message, Stream, ChannelParticipant, PriorityPolicy
+from ..models import Attachment, Message
 from ..config import settings
-from ..rate_limiter import TokenBucket
-import redis.asyncio as redis
+from ..rate_limiter import TokenBucket, make_limiter
+from ..redis_client import get_redis
+from ..transfers import transfers
+from ..usage import usage
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import aiofiles
-from ..ws import manager, get_or_create_stream
+from ..ws import manager, get_or_create_stream, ensure_member, load_policy, message_seq
+
+log = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/files", tags=["files"])
 
@@ -20,12 +28,67 @@ async def get_db() -> AsyncSession:
     async with async_session() as s:
         yield s
 
-async def get_redis() -> redis.Redis:
-    return redis.from_url(settings.REDIS_URL)
+# ---------- UPLOAD STATE ----------
+# Плейсхолдер і pending-вкладення — одна транзакція до першого байта;
+# недописане прибирає або _abort_upload, або app.storage_gc.
+async def _begin_upload(db: AsyncSession, channel_id: int, stream_id: int, user_id: int,
+                        filename: str, content_type: str, meta: dict) -> tuple[int, int, str]:
+    message_id = (await db.execute(
+        insert(Message).values(
+            channel_id=channel_id,
+            stream_id=stream_id,
+            sender_id=user_id,
+            content=None,
+            meta=meta,
+        ).returning(Message.id)
+    )).scalar_one()
+    save_dir = settings.UPLOAD_DIR
+    os.makedirs(save_dir, exist_ok=True)
+    dest_path = os.path.join(save_dir, f"{message_id}_{filename}")
+    att_id = (await db.execute(
+        insert(Attachment).values(
+            message_id=message_id,
+            file_name=filename,
+            content_type=content_type,
+            size=0,
+            storage_path=dest_path,
+            status="pending",
+        ).returning(Attachment.id)
+    )).scalar_one()
+    await db.commit()
+    return message_id, att_id, dest_path
 
-async def ensure_member(db: AsyncSession, channel_id: int, user_id: int) -> bool:
-    q = await db.execute(select(ChannelParticipant).where(ChannelParticipant.channel_id == channel_id, ChannelParticipant.user_id == user_id))
-    return q.scalar_one_or_none() is not None
+async def _complete_upload(db: AsyncSession, message_id: int, att_id: int, filename: str, total: int, out: GzipSampler):
+    await db.execute(update(Attachment).where(Attachment.id == att_id).values(
+        status="complete", size=total, encoding=out.encoding, stored_size=out.stored,
+    ))
+    await db.execute(
+        update(Message).where(Message.id == message_id).values(
+            meta={"kind": "file", "attachment_id": att_id, "file_name": filename, "size": total}
+        )
+    )
+    await db.commit()
+
+async def _abort_upload(att_id: int, dest_path: str):
+    # клієнт відвалився посеред файлу: частковий файл — одразу, решту добере storage_gc
+    try:
+        try:
+            await asyncio.to_thread(os.remove, dest_path)
+        except FileNotFoundError:
+            pass
+        async with async_session() as s:
+            await s.execute(
+                update(Attachment).where(Attachment.id == att_id, Attachment.status == "pending").values(status="aborted")
+            )
+            await s.commit()
+    except Exception:
+        log.exception("upload %s: abort cleanup failed, left to storage gc", att_id)
+
+def _check_quota(stream_id: int, pol):
+    # квота — з пам'яті воркера (app.usage), без походу в Redis; почату передачу не обриваємо
+    quota = usage.exhausted(stream_id, pol, "bytes")
+    if quota:
+        raise HTTPException(429, detail={"error": "quota", "quota": quota})
 
 @router.put("/upload_raw")
 async def upload_raw(
@@ -43,133 +106,88 @@ async def upload_raw(
     stream_id = await get_or_create_stream(db, channel_id, user_id)
 
     # політика аплоаду
-    q = await db.execute(
-        select(PriorityPolicy).where(
-            PriorityPolicy.stream_id == stream_id,
-            PriorityPolicy.enabled == True
-        )
-    )
-    p = q.scalar_one_or_none()
-    upload_bps = int(p.upload_bps) if p else int(settings.DEFAULT_UPLOAD_BPS)
+    pol = await load_policy(channel_id, stream_id)
+    upload_bps = int(pol.upload_bps)
     burst_cap  = max(1, int(upload_bps * 2))  # місткість бакета
+    _check_quota(stream_id, pol)
 
-    # placeholder повідомлення
-    res_msg = await db.execute(
-        insert(Message).values(
-            channel_id=channel_id,
-            stream_id=stream_id,
-            sender_id=user_id,
-            content=None,
-            meta={"kind": "file", "file_name": filename}
-        ).returning(Message.id)
-    )
-    message_id = res_msg.scalar_one()
-    await db.commit()
+    # місце серед одночасних трансферів воркера — до плейсхолдера, щоб відмова нічого не лишала
+    try:
+        slot = admission.admit_transfer(user_id, pol.priority)
+    except Rejected as e:
+        raise e.http()
+    try:
+        # placeholder повідомлення + pending-вкладення
+        message_id, att_id, dest_path = await _begin_upload(
+            db, channel_id, stream_id, user_id, filename, content_type, {"kind": "file", "file_name": filename}
+        )
 
-    r = await get_redis()
-    limiter = TokenBucket(r)
+        r = await get_redis()
+        limiter = make_limiter(r)
 
-    save_dir = settings.UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-    dest_path = os.path.join(save_dir, f"{message_id}_{filename}")
+        total = 0
+        # прогрес шле app.transfers раз на інтервал; цикл лише рахує байти
+        tr = transfers.start(user_id, "upload", total=size, message_id=message_id)
 
-    total = 0
-    window = 0
-    t0 = time.monotonic()
-    last_emit = t0
-
-    # дрібні рівні «тіки» ~50/сек
-    tick_hz = 50.0
-    tick_bytes = max(1024, int(upload_bps / tick_hz))
-    tick_bytes = min(tick_bytes, 64 * 1024, burst_cap)
-
-    async with aiofiles.open(dest_path, "wb") as out:
-        async for chunk in request.stream():
-            if not chunk:
-                continue
-            mv = memoryview(chunk)
-            off = 0
-            while off < len(mv):
-                want = min(len(mv) - off, tick_bytes)
-                granted = await limiter.grant(
-                    TokenBucket.key(stream_id, "up"),
-                    rate=float(upload_bps),
-                    capacity=float(burst_cap),
-                    want=float(want),
-                )
-                if granted > 0:
-                    await out.write(mv[off:off + granted])
-                    off += granted
-                    total += granted
-                    window += granted
-
-                    now = time.monotonic()
-                    if now - last_emit >= 0.5:
-                        bps = window / max(1e-6, (now - last_emit))
-                        elapsed = now - t0
-                        await manager.send_user(user_id, {
-                            "type": "file.upload.progress",
-                            "message_id": message_id,
-                            "bytes": total,
-                            "total": size,
-                            "bps": int(bps),
-                            "elapsed_ms": int(elapsed * 1000),
-                        })
-                        last_emit = now
-                        window = 0
-                else:
-                    # віддати керування петлі, без видимих фризів
-                    await asyncio.sleep(0.005)
+        # дрібні рівні «тіки» ~50/сек
+        tick_hz = 50.0
+        tick_bytes = max(1024, int(upload_bps / tick_hz))
+        tick_bytes = min(tick_bytes, 64 * 1024, burst_cap)
 
-    # фінальний прогрес 100%
-    now = time.monotonic()
-    elapsed = now - t0
-    try:
-        await manager.send_user(user_id, {
-            "type": "file.upload.progress",
-            "message_id": message_id,
-            "bytes": total,
-            "total": size,
-            "bps": int(total / max(1e-6, elapsed)),
-            "elapsed_ms": int(elapsed * 1000),
+        try:
+            async with aiofiles.open(dest_path, "wb") as f:
+                # на диск — як є або gzip, якщо перші байти добре стискаються
+                out = GzipSampler(f, content_type)
+                async for chunk in request.stream():
+                    if not chunk:
+                        continue
+                    mv = memoryview(chunk)
+                    off = 0
+                    while off < len(mv):
+                        want = min(len(mv) - off, tick_bytes)
+                        granted = await limiter.grant(
+                            TokenBucket.key(stream_id, "up"),
+                            rate=float(upload_bps),
+                            capacity=float(burst_cap),
+                            want=float(want),
+                        )
+                        if granted > 0:
+                            await out.write(mv[off:off + granted])
+                            off += granted
+                            total += granted
+                            tr.bytes = total
+                            usage.add(stream_id, "up", granted)
+                        else:
+                            # віддати керування петлі, без видимих фризів
+                            usage.throttled(stream_id, "up")
+                            await asyncio.sleep(0.005)
+                await out.close()
+        except BaseException:
+            transfers.finish(tr, ok=False)
+            await _abort_upload(att_id, dest_path)
+            raise
+        transfers.finish(tr)
+
+        # вкладення готове, meta + сигнал у канал
+        await _complete_upload(db, message_id, att_id, filename, total, out)
+
+        seq = await message_seq(channel_id, user_id)
+        await manager.broadcast_channel(channel_id, {
+            "type": "message.new",
+            "message": {
+                "id": message_id,
+                "seq": seq,
+                "channel_id": channel_id,
+                "stream_id": stream_id,
+                "sender_id": user_id,
+                "content": None,
+                "meta": {"kind":"file","attachment_id": att_id,"file_name": filename,"size": total}
+            }
         })
-    except Exception:
-        pass
 
-    # створюємо attachment
-    res_att = await db.execute(
-        insert(Attachment).values(
-            message_id=message_id,
-            file_name=filename,
-            content_type=content_type,
-            size=total,
-            storage_path=dest_path
-        ).returning(Attachment.id)
-    )
-    att_id = res_att.scalar_one()
-
-    # оновити meta + сигнал у канал
-    await db.execute(
-        update(Message).where(Message.id == message_id).values(
-            meta={"kind": "file", "attachment_id": att_id, "file_name": filename, "size": total}
-        )
-    )
-    await db.commit()
-
-    await manager.broadcast_channel(channel_id, {
-        "type": "message.new",
-        "message": {
-            "id": message_id,
-            "channel_id": channel_id,
-            "stream_id": stream_id,
-            "sender_id": user_id,
-            "content": None,
-            "meta": {"kind":"file","attachment_id": att_id,"file_name": filename,"size": total}
-        }
-    })
-
-    await r.close()
-    return {"attachment_id": att_id, "message_id": message_id, "size": total}
+        return {"attachment_id": att_id, "message_id": message_id, "size": total}
+    finally:
+        slot.release()
 
 
 
@@ -178,146 +196,112 @@ async def upload_raw(
 async def upload_file(channel_id: int, user_id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     if not await ensure_member(db, channel_id, user_id):
         raise HTTPException(403, "not a channel member")
-    res_stream = await db.execute(select(Stream).where(Stream.channel_id == channel_id, Stream.owner_user_id == user_id))
-    st = res_stream.scalar_one_or_none()
-    if not st:
-        res_new = await db.execute(insert(Stream).values(channel_id=channel_id, owner_user_id=user_id).returning(Stream.id))
-        stream_id = res_new.scalar_one()
-    else:
-        stream_id = st.id
-    res_msg = await db.execute(insert(Message).values(channel_id=channel_id, stream_id=stream_id, sender_id=user_id, content=None, meta={"kind": "file"}).returning(Message.id))
-    message_id = res_msg.scalar_one()
-    await db.commit()
+    stream_id = await get_or_create_stream(db, channel_id, user_id)
+    pol = await load_policy(channel_id, stream_id)
+    upload_bps = pol.upload_bps
+    _check_quota(stream_id, pol)
+    try:
+        slot = admission.admit_transfer(user_id, pol.priority)
+    except Rejected as e:
+        raise e.http()
+    try:
+        message_id, att_id, dest_path = await _begin_upload(
+            db, channel_id, stream_id, user_id, file.filename,
+            file.content_type or "application/octet-stream", {"kind": "file"}
+        )
 
-    r = await get_redis()
-    limiter = TokenBucket(r)
-    save_dir = settings.UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-    dest_path = os.path.join(save_dir, f"{message_id}_{file.filename}")
-
-    q = await db.execute(select(PriorityPolicy).where(PriorityPolicy.stream_id == stream_id, PriorityPolicy.enabled == True))
-    p = q.scalar_one_or_none()
-    upload_bps = p.upload_bps if p else settings.DEFAULT_UPLOAD_BPS
-
-    total = 0
-    chunk = 64 * 1024
-    # before the loop
-    t0 = time.monotonic()
-    last_emit = t0
-    window_bytes = 0
-
-    async with aiofiles.open(dest_path, "wb") as out:
-        while True:
-            data = await file.read(chunk)
-            if not data:
-                break
-
-            cost = len(data)
-            allowed = await limiter.allow(
-                TokenBucket.key(stream_id, "up"),
-                rate=float(upload_bps),
-                capacity=float(upload_bps * 2),
-                cost=float(cost)
-            )
-            if not allowed:
-                await asyncio.sleep(max(0.01, chunk / max(1.0, upload_bps)))
-                # (опціонально повторна перевірка, якщо хочеш)
-
-            await out.write(data)
-            total += cost
-            window_bytes += cost
-
-            now = time.monotonic()
-            # надсилаємо прогрес ~2 рази/сек
-            if now - last_emit >= 0.5:
-                # середня швидкість за вікно
-                bps = window_bytes / max(1e-6, (now - last_emit))
-                elapsed = now - t0
-                await manager.send_user(user_id, {
-                    "type": "file.upload.progress",
-                    "message_id": message_id,
-                    "bytes": total,
-                    "bps": int(bps),
-                    "elapsed_ms": int(elapsed * 1000),
-                })
-                last_emit = now
-                window_bytes = 0
-
-    res_att = await db.execute(insert(Attachment).values(
-        message_id=message_id,
-        file_name=file.filename,
-        content_type=file.content_type or "application/octet-stream",
-        size=total,
-        storage_path=dest_path
-    ).returning(Attachment.id))
-    att_id = res_att.scalar_one()
-
-    # 2) оновили meta повідомлення
-    await db.execute(update(Message).where(Message.id == message_id).values(
-        meta={"kind": "file", "attachment_id": att_id, "file_name": file.filename, "size": total}
-    ))
-    await db.commit()
+        r = await get_redis()
+        limiter = make_limiter(r)
 
-    # 3) розіслали в канал chat-подію
-    await manager.broadcast_channel(channel_id, {
-        "type": "message.new",
-        "message": {
-            "id": message_id,
-            "channel_id": channel_id,
-            "stream_id": stream_id,
-            "sender_id": user_id,
-            "content": None,
-            "meta": {"kind": "file", "attachment_id": att_id, "file_name": file.filename, "size": total}
-        }
-    })
-    # 4) повернули відповідачу
-    return {"attachment_id": att_id, "message_id": message_id, "size": total}
+        total = 0
+        chunk = 64 * 1024
+        tr = transfers.start(user_id, "upload", total=file.size, message_id=message_id)
+
+        try:
+            async with aiofiles.open(dest_path, "wb") as f:
+                out = GzipSampler(f, file.content_type)
+                while True:
+                    data = await file.read(chunk)
+                    if not data:
+                        break
+
+                    cost = len(data)
+                    allowed = await limiter.allow(
+                        TokenBucket.key(stream_id, "up"),
+                        rate=float(upload_bps),
+                        capacity=float(upload_bps * 2),
+                        cost=float(cost)
+                    )
+                    if not allowed:
+                        usage.throttled(stream_id, "up")
+                        await asyncio.sleep(max(0.01, chunk / max(1.0, upload_bps)))
+                        # (опціонально повторна перевірка, якщо хочеш)
+
+                    await out.write(data)
+                    total += cost
+                    tr.bytes = total
+                    usage.add(stream_id, "up", cost)
+                await out.close()
+        except BaseException:
+            transfers.finish(tr, ok=False)
+            await _abort_upload(att_id, dest_path)
+            raise
+        transfers.finish(tr)
+
+        # 2) вкладення готове, оновили meta повідомлення
+        await _complete_upload(db, message_id, att_id, file.filename, total, out)
+
+        # 3) розіслали в канал chat-подію
+        seq = await message_seq(channel_id, user_id)
+        await manager.broadcast_channel(channel_id, {
+            "type": "message.new",
+            "message": {
+                "id": message_id,
+                "seq": seq,
+                "channel_id": channel_id,
+                "stream_id": stream_id,
+                "sender_id": user_id,
+                "content": None,
+                "meta": {"kind": "file", "attachment_id": att_id, "file_name": file.filename, "size": total}
+            }
+        })
+        # 4) повернули відповідачу
+        return {"attachment_id": att_id, "message_id": message_id, "size": total}
+    finally:
+        slot.release()
 
 @router.get("/{attachment_id}/download")
-async def download_file(attachment_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
-    # 1) знайти вкладення і перевірити доступ
+async def download_file(attachment_id: int, user_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    # 1) знайти вкладення і перевірити доступ (лише потрібні колонки, без ORM-об'єктів)
     q = await db.execute(
-        select(Attachment, Message)
+        select(Attachment.storage_path, Attachment.content_type, Attachment.size,
+               Attachment.file_name, Attachment.encoding, Attachment.stored_size, Message.channel_id)
         .join(Message, Message.id == Attachment.message_id)
-        .where(Attachment.id == attachment_id)
+        .where(Attachment.id == attachment_id, Attachment.status == "complete")
     )
-    row = q.first()
-    if not row:
+    att = q.first()
+    if not att:
         raise HTTPException(404, "not found")
-    att, msg = row
-    if not await ensure_member(db, msg.channel_id, user_id):
+    if not await ensure_member(db, att.channel_id, user_id):
         raise HTTPException(403, "forbidden")
 
     # 2) створити/знайти stream ДЛЯ ПОТОЧНОГО КОРИСТУВАЧА (ХТО КАЧАЄ)
-    res_stream = await db.execute(
-        select(Stream).where(
-            Stream.channel_id == msg.channel_id,
-            Stream.owner_user_id == user_id
-        )
-    )
-    dst = res_stream.scalar_one_or_none()
-    if not dst:
-        dst_id = (await db.execute(
-            insert(Stream)
-            .values(channel_id=msg.channel_id, owner_user_id=user_id)
-            .returning(Stream.id)
-        )).scalar_one()
-    else:
-        dst_id = dst.id
+    dst_id = await get_or_create_stream(db, att.channel_id, user_id)
 
     # 3) витягнути ПОЛІТИКУ ДЛЯ ОТРИМУВАЧА (саме його ліміт застосовується)
-    q_dst = await db.execute(
-        select(PriorityPolicy).where(
-            PriorityPolicy.stream_id == dst_id,
-            PriorityPolicy.enabled == True
-        )
-    )
-    p_dst = q_dst.scalar_one_or_none()
-    dst_bps = int(p_dst.download_bps) if p_dst else int(settings.DEFAULT_DOWNLOAD_BPS)
+    dst_pol = await load_policy(att.channel_id, dst_id)
+    dst_bps = int(dst_pol.download_bps)
+    _check_quota(dst_id, dst_pol)
 
     # 4) токен-бакет лише для отримувача
     r = await get_redis()
-    limiter_dst = TokenBucket(r)
+    limiter_dst = make_limiter(r)
+
+    # місце серед трансферів воркера; звільняє стрімер (або фонова задача відповіді)
+    try:
+        slot = admission.admit_transfer(user_id, dst_pol.priority)
+    except Rejected as e:
+        raise e.http()
 
     # параметри плавної подачі
     tick_hz = 50.0                      # ~50 тiків/сек
@@ -327,27 +311,71 @@ async def download_file(attachment_id: int, user_id: int, db: AsyncSession = Dep
     tick_bytes = min(tick_bytes, file_chunk, burst_cap)
     prime_bytes = 16 * 1024             # миттєвий старт у браузері
 
+    # gzip на диску: клієнт, що приймає gzip, отримує файл як є — ліміт рахує
+    # стиснені байти; решті розпаковуємо на льоту
+    gz = att.encoding == "gzip"
+    passthrough = gz and accepts_gzip(request.headers.get("accept-encoding"))
+
+    wire_size = att.stored_size if passthrough else att.size
+
     async def streamer():
+        tr = transfers.start(user_id, "download", total=wire_size, attachment_id=attachment_id)
+        ok = False
         try:
-            async with aiofiles.open(att.storage_path, "rb") as f:
-                # миттєво віддаємо трохи даних (з урахуванням токенів отримувача)
-                first = await f.read(prime_bytes)
-                if first:
-                    g = await limiter_dst.grant(
-                        TokenBucket.key(dst_id, "down"),
-                        rate=float(dst_bps),
-                        capacity=float(burst_cap),
-                        want=float(len(first)),
-                    )
-                    if g > 0:
-                        yield bytes(first[:g])
-                        await asyncio.sleep(0)  # віддати керування петлі
-                    remain = first[g:]
+            async for part in paced():
+                tr.bytes += len(part)
+                adaptive.egress_bytes += len(part)
+                usage.add(dst_id, "down", len(part))
+                yield part
+            ok = True
+        finally:
+            transfers.finish(tr, ok=ok)
+            slot.release()
+
+    async def paced():
+        async with aiofiles.open(att.storage_path, "rb") as raw:
+            f = GunzipReader(raw) if gz and not passthrough else raw
+            # миттєво віддаємо трохи даних (з урахуванням токенів отримувача)
+            first = await f.read(prime_bytes)
+            if first:
+                g = await limiter_dst.grant(
+                    TokenBucket.key(dst_id, "down"),
+                    rate=float(dst_bps),
+                    capacity=float(burst_cap),
+                    want=float(len(first)),
+                )
+                if g > 0:
+                    yield bytes(first[:g])
+                    await asyncio.sleep(0)  # віддати керування петлі
+                remain = first[g:]
+            else:
+                remain = b""
+
+            # дозлив залишок "first"
+            mv = memoryview(remain)
+            off = 0
+            while off < len(mv):
+                want = min(len(mv) - off, tick_bytes)
+                g = await limiter_dst.grant(
+                    TokenBucket.key(dst_id, "down"),
+                    rate=float(dst_bps),
+                    capacity=float(burst_cap),
+                    want=float(want),
+                )
+                if g > 0:
+                    yield mv[off:off + g]
+                    off += g
+                    await asyncio.sleep(0)
                 else:
-                    remain = b""
+                    usage.throttled(dst_id, "down")
+                    await asyncio.sleep(0.005)
 
-                # дозлив залишок "first"
-                mv = memoryview(remain)
+            # основний цикл
+            while True:
+                data = await f.read(file_chunk)
+                if not data:
+                    break
+                mv = memoryview(data)
                 off = 0
                 while off < len(mv):
                     want = min(len(mv) - off, tick_bytes)
@@ -362,37 +390,23 @@ async def download_file(attachment_id: int, user_id: int, db: AsyncSession = Dep
                         off += g
                         await asyncio.sleep(0)
                     else:
+                        usage.throttled(dst_id, "down")
                         await asyncio.sleep(0.005)
 
-                # основний цикл
-                while True:
-                    data = await f.read(file_chunk)
-                    if not data:
-                        break
-                    mv = memoryview(data)
-                    off = 0
-                    while off < len(mv):
-                        want = min(len(mv) - off, tick_bytes)
-                        g = await limiter_dst.grant(
-                            TokenBucket.key(dst_id, "down"),
-                            rate=float(dst_bps),
-                            capacity=float(burst_cap),
-                            want=float(want),
-                        )
-                        if g > 0:
-                            yield mv[off:off + g]
-                            off += g
-                            await asyncio.sleep(0)
-                        else:
-                            await asyncio.sleep(0.005)
-        finally:
-            await r.close()
-
     headers = {
         "Content-Type": att.content_type or "application/octet-stream",
-        "Content-Length": str(att.size),
+        "Content-Length": str(wire_size),
         "Content-Disposition": f'attachment; filename="{att.file_name}"',
         "Cache-Control": "no-store, no-transform",
         "X-Accel-Buffering": "no",  # якщо стоїть Nginx — вимкнути буферизацію
     }
-    return StreamingResponse(streamer(), headers=headers)
+    if gz:
+        headers["Vary"] = "Accept-Encoding"
+    if passthrough:
+        headers["Content-Encoding"] = "gzip"
+    # і після відповіді: якщо тіло так і не почали читати, finally стрімера не виконається.
+    # async — щоб Starlette не відправив release у threadpool: лічильники Gate живуть лише в петлі
+    async def release():
+        slot.release()
+
+    return StreamingResponse(streamer(), headers=headers, background=BackgroundTask(release))
@@ -0,0 +1,184 @@
+import asyncio
+import csv
+from datetime import datetime
+import asyncpg
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from ..config import settings
+from ..db import engine
+
+# Імпорт/експорт історії (messages, attachments) через COPY в обидва боки.
+# Рядки не проходять через ORM і не збираються в пам'яті: експорт — потік
+# чанків COPY TO STDOUT прямо у відповідь, імпорт — тіло запиту прямо в
+# COPY FROM STDIN. COPY бере на таблицю ROW EXCLUSIVE — той самий лок, що
+# й звичайний INSERT, тож send_message не чекає. Один запит — одна
+# транзакція; велику міграцію краще ділити на кілька файлів.
+# Формати: csv (з заголовком) і ndjson (рядок — JSON-об'єкт).
+router = APIRouter(prefix="/admin/history", tags=["admin"])
+
+# чанків COPY у черзі між Postgres і клієнтом: повільний клієнт гальмує COPY, а не роздуває пам'ять
+COPY_QUEUE_CHUNKS = 16
+HEADER_MAX = 4096
+
+# таблиця -> (колонки експорту, обов'язкові при імпорті, значення за замовчуванням для ndjson)
+_TABLES = {
+    "messages": (
+        ("id", "channel_id", "stream_id", "sender_id", "parent_message_id", "reply_count", "last_reply_at",
+         "content", "meta", "created_at"),
+        {"channel_id", "stream_id", "sender_id", "meta", "created_at"},
+        {"id": "nextval(pg_get_serial_sequence('messages', 'id'))", "reply_count": "0", "meta": "'{}'::jsonb",
+         "created_at": "timezone('utc', now())"},
+    ),
+    "attachments": (
+        ("id", "message_id", "file_name", "content_type", "size", "storage_path", "status", "encoding",
+         "stored_size", "created_at"),
+        {"message_id", "file_name", "size", "storage_path", "created_at"},
+        {"id": "nextval(pg_get_serial_sequence('attachments', 'id'))", "status": "'complete'",
+         "created_at": "timezone('utc', now())"},
+    ),
+}
+_MEDIA = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# JSON-рядок як одна CSV-колонка: символи \x01/\x02 у JSON-тексті не трапляються
+# (керівні символи там екрановані), тож COPY не лапкує й не екранує нічого
+_NDJSON_OPTS = {"format": "csv", "quote": "\x01", "delimiter": "\x02"}
+
+
+def _table(name: str):
+    if name not in _TABLES:
+        raise HTTPException(404, "unknown table")
+    return _TABLES[name]
+
+
+def _fmt(fmt: str) -> str:
+    if fmt not in _MEDIA:
+        raise HTTPException(400, "format must be csv or ndjson")
+    return fmt
+
+
+def _export_query(table: str, channel_id: int | None, since: datetime | None, until: datetime | None):
+    cols = ", ".join(_TABLES[table][0])
+    where, args = [], []
+    for cond, val in (("channel_id = ${}", channel_id), ("created_at >= ${}", since), ("created_at < ${}", until)):
+        if val is not None:
+            args.append(val)
+            where.append(cond.format(len(args)))
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+    if table == "messages":
+        # з каналом — по ix_msg_channel_created уже в порядку часу; без нього — seq scan без сортування
+        order = " ORDER BY created_at, id" if channel_id is not None else ""
+        return f"SELECT {cols} FROM messages{clause}{order}", args
+    # вкладення фільтруються через свої повідомлення (межі часу відсікають партиції)
+    sub = f" WHERE message_id IN (SELECT id FROM messages{clause})" if where else ""
+    return f"SELECT {cols} FROM attachments{sub}", args
+
+
+async def _copy_out(query: str, args: list, fmt: str):
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=COPY_QUEUE_CHUNKS)
+
+    async def produce():
+        try:
+            async with engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                if fmt == "csv":
+                    await raw.copy_from_query(query, *args, output=chunks.put, format="csv", header=True)
+                else:
+                    await raw.copy_from_query(f"SELECT row_to_json(t)::text FROM ({query}) t", *args,
+                                              output=chunks.put, **_NDJSON_OPTS)
+        except Exception as e:
+            await chunks.put(e)
+            return
+        await chunks.put(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (chunk := await chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk  # помилка посеред COPY обриває відповідь, а не мовчки її вкорочує
+            yield chunk
+    finally:
+        # клієнт відвалився — зупиняємо COPY
+        task.cancel()
+
+
+async def _split_header(body):
+    """First line of the CSV body, and the rest of the stream."""
+    it = body.__aiter__()
+    buf = b""
+    async for chunk in it:
+        buf += chunk
+        if b"\n" in buf:
+            break
+        if len(buf) > HEADER_MAX:
+            raise HTTPException(400, "header line too long")
+    head, _, rest = buf.partition(b"\n")
+
+    async def tail():
+        if rest:
+            yield rest
+        async for chunk in it:
+            yield chunk
+
+    return head.decode("utf-8-sig").strip("\r"), tail()
+
+
+async def _import(raw, table: str, fmt: str, body) -> int:
+    cols, required, defaults = _TABLES[table]
+    if fmt == "csv":
+        head, rest = await _split_header(body)
+        names = next(csv.reader([head]), [])
+        bad = [n for n in names if n not in cols]
+        if bad or len(set(names)) != len(names):
+            raise HTTPException(400, f"bad columns: {bad or names}")
+        if missing := required - set(names):
+            raise HTTPException(400, f"missing columns: {sorted(missing)}")
+        status = await raw.copy_to_table(table, source=rest, columns=names, format="csv")
+        return int(status.split()[-1])
+    # ndjson: рядки в тимчасову таблицю, далі один INSERT ... SELECT з розбором і дефолтами
+    await raw.execute("CREATE TEMP TABLE history_in (doc jsonb) ON COMMIT DROP")
+    await raw.copy_to_table("history_in", source=body, columns=["doc"], **_NDJSON_OPTS)
+    select_list = ", ".join(f"coalesce(r.{c}, {defaults[c]})" if c in defaults else f"r.{c}" for c in cols)
+    status = await raw.execute(
+        f"INSERT INTO {table} ({', '.join(cols)}) SELECT {select_list} "
+        f"FROM history_in, jsonb_populate_record(NULL::{table}, doc) r WHERE doc IS NOT NULL"
+    )
+    return int(status.split()[-1])
+
+
+# ---------- EXPORT ----------
+@router.get("/{table}")
+async def export_history(
+    table: str,
+    channel_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    fmt: str = Query("csv", alias="format"),
+):
+    _table(table)
+    fmt = _fmt(fmt)
+    query, args = _export_query(table, channel_id, since, until)
+    return StreamingResponse(_copy_out(query, args, fmt), media_type=_MEDIA[fmt])
+
+
+# ---------- IMPORT ----------
+@router.post("/{table}")
+async def import_history(table: str, request: Request, fmt: str = Query("csv", alias="format")):
+    _table(table)
+    fmt = _fmt(fmt)
+    async with engine.connect() as conn:
+        raw = (await conn.get_raw_connection()).driver_connection
+        try:
+            async with raw.transaction():
+                # не стаємо в чергу за DDL (attach/detach партицій), тримаючи за собою інсерти
+                ms = int(settings.MESSAGES_PARTITION_LOCK_TIMEOUT_S * 1000)
+                await raw.execute(f"SET LOCAL lock_timeout = '{ms}ms'")
+                rows = await _import(raw, table, fmt, request.stream())
+                # явні id не рухають sequence — підтягуємо, щоб автоінкремент не зіткнувся;
+                # лише вперед і лише для непорожньої таблиці, не витрачаючи значень sequence
+                seq = f"pg_get_serial_sequence('{table}', 'id')::regclass"
+                await raw.execute(
+                    f"SELECT setval({seq}, m) FROM (SELECT max(id) AS m FROM {table}) t "
+                    f"WHERE m > COALESCE(pg_sequence_last_value({seq}), 0)"
+                )
+        except asyncpg.PostgresError as e:
+            raise HTTPException(400, f"{type(e).__name__}: {e}")
+    return {"table": table, "rows": rows}
@@ -0,0 +1,211 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, literal, literal_column, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from ..db import async_session
+from ..models import ChannelParticipant, Message
+from ..ws import ensure_member
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+SEARCH_PAGE_MAX = 100
+HISTORY_PAGE_MAX = 200
+THREAD_MAX_DEPTH = 32
+THREAD_MAX_SIZE = 2000
+SUBSTRING_MIN_LEN = 3   # коротші шаблони trigram-індекс не прискорює
+# та сама конфігурація, що й у generated-колонці messages.content_tsv
+_TS_CONFIG = literal_column("'simple'::regconfig")
+_HEADLINE_OPTS = "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<b>, StopSel=</b>"
+
+async def get_db() -> AsyncSession:
+    async with async_session() as s:
+        yield s
+
+def _escape_like(s: str) -> str:
+    return s.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+def _parse_cursor(cursor: str, fts: bool):
+    try:
+        if fts:
+            rank, mid = cursor.split(":", 1)
+            return float(rank), int(mid)
+        return int(cursor)
+    except ValueError:
+        raise HTTPException(400, "bad cursor")
+
+def _row(r, fts: bool) -> dict:
+    out = {
+        "id": r.id,
+        "channel_id": r.channel_id,
+        "sender_id": r.sender_id,
+        "parent_message_id": r.parent_message_id,
+        "created_at": r.created_at.isoformat(),
+    }
+    if fts:
+        out["rank"] = r.rank
+        out["snippet"] = r.snippet
+    else:
+        out["content"] = r.content
+    return out
+
+# ---------- SEARCH ----------
+# mode=fts (за замовчуванням): websearch-синтаксис, GIN по content_tsv, сортування
+# за релевантністю, курсор "rank:id". mode=substring: ILIKE по trigram-індексу,
+# найновіші першими, курсор — id. Межі since/until відсікають зайві партиції.
+@router.get("/search")
+async def search_messages(
+    user_id: int,
+    q: str,
+    channel_id: int | None = None,
+    mode: str = "fts",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = 20,
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    q = q.strip()
+    if mode not in ("fts", "substring"):
+        raise HTTPException(400, "mode must be fts or substring")
+    fts = mode == "fts"
+    if not q or (not fts and len(q) < SUBSTRING_MIN_LEN):
+        raise HTTPException(400, "query too short")
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+
+    if channel_id is not None:
+        if not await ensure_member(db, channel_id, user_id):
+            raise HTTPException(403, "not a channel member")
+        scope = Message.channel_id == channel_id
+    else:
+        scope = Message.channel_id.in_(
+            select(ChannelParticipant.channel_id).where(ChannelParticipant.user_id == user_id)
+        )
+    where = [scope]
+    if since is not None:
+        where.append(Message.created_at >= since)
+    if until is not None:
+        where.append(Message.created_at < until)
+
+    cols = (Message.id, Message.channel_id, Message.sender_id, Message.parent_message_id, Message.created_at, Message.content)
+    if fts:
+        tsq = func.websearch_to_tsquery(_TS_CONFIG, q)
+        rank = func.ts_rank_cd(Message.content_tsv, tsq)
+        where.append(Message.content_tsv.op("@@")(tsq))
+        if cursor:
+            where.append(tuple_(rank, Message.id) < tuple_(*_parse_cursor(cursor, fts)))
+        page = (
+            select(*cols, rank.label("rank"))
+            .where(*where)
+            .order_by(rank.desc(), Message.id.desc())
+            .limit(limit + 1)
+            .subquery()
+        )
+        # підсвітка — лише для рядків сторінки, не для всіх збігів
+        stmt = select(
+            page.c.id, page.c.channel_id, page.c.sender_id, page.c.parent_message_id, page.c.created_at, page.c.rank,
+            func.ts_headline(_TS_CONFIG, page.c.content, tsq, _HEADLINE_OPTS).label("snippet"),
+        ).order_by(page.c.rank.desc(), page.c.id.desc())
+    else:
+        where.append(Message.content.ilike(f"%{_escape_like(q)}%", escape="!"))
+        if cursor:
+            where.append(Message.id < _parse_cursor(cursor, fts))
+        stmt = select(*cols).where(*where).order_by(Message.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(stmt)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if more:
+        last = rows[-1]
+        next_cursor = f"{last.rank!r}:{last.id}" if fts else str(last.id)
+    return {"items": [_row(r, fts) for r in rows], "next_cursor": next_cursor}
+
+# ---------- CHANNEL HISTORY ----------
+def _msg_cols(m):
+    return (m.id, m.channel_id, m.stream_id, m.sender_id, m.parent_message_id, m.content, m.meta,
+            m.created_at, m.reply_count, m.last_reply_at)
+
+def _msg_row(r) -> dict:
+    return {
+        "id": r.id,
+        "channel_id": r.channel_id,
+        "stream_id": r.stream_id,
+        "sender_id": r.sender_id,
+        "parent_message_id": r.parent_message_id,
+        "content": r.content,
+        "meta": r.meta,
+        "created_at": r.created_at.isoformat(),
+        "reply_count": r.reply_count,
+        "last_reply_at": r.last_reply_at.isoformat() if r.last_reply_at else None,
+    }
+
+# Найновіші першими по ix_msg_channel_created; курсор "created_at|id".
+# reply_count/last_reply_at — колонки рядка, тож лічильники тредів безкоштовні.
+@router.get("/channel/{channel_id}")
+async def channel_history(
+    channel_id: int,
+    user_id: int,
+    limit: int = 50,
+    before: str | None = None,
+    top_level: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    if not await ensure_member(db, channel_id, user_id):
+        raise HTTPException(403, "not a channel member")
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    stmt = select(*_msg_cols(Message)).where(Message.channel_id == channel_id)
+    if top_level:
+        stmt = stmt.where(Message.parent_message_id.is_(None))
+    if before:
+        try:
+            ts, mid = before.split("|", 1)
+            cur = (datetime.fromisoformat(ts), int(mid))
+        except ValueError:
+            raise HTTPException(400, "bad cursor")
+        stmt = stmt.where(tuple_(Message.created_at, Message.id) < tuple_(*cur))
+    stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [_msg_row(r) for r in rows],
+        "next_cursor": f"{rows[-1].created_at.isoformat()}|{rows[-1].id}" if more else None,
+    }
+
+# ---------- THREADS ----------
+# Усе дерево відповідей одним рекурсивним CTE по ix_msg_parent. Рекурсія йде
+# рівнями, і LIMIT без ORDER BY зупиняє її, щойно набрано max_size рядків.
+@router.get("/{message_id}/thread")
+async def get_thread(
+    message_id: int,
+    user_id: int,
+    max_depth: int = 8,
+    max_size: int = 500,
+    db: AsyncSession = Depends(get_db),
+):
+    max_depth = max(1, min(max_depth, THREAD_MAX_DEPTH))
+    max_size = max(1, min(max_size, THREAD_MAX_SIZE))
+    member_channels = select(ChannelParticipant.channel_id).where(ChannelParticipant.user_id == user_id)
+    tree = (
+        select(*_msg_cols(Message), literal(0).label("depth"))
+        .where(Message.id == message_id, Message.channel_id.in_(member_channels))
+        .cte("thread", recursive=True)
+    )
+    child = aliased(Message)
+    tree = tree.union_all(
+        select(*_msg_cols(child), (tree.c.depth + 1).label("depth"))
+        .join(tree, child.parent_message_id == tree.c.id)
+        .where(child.channel_id == tree.c.channel_id, tree.c.depth < max_depth)
+    )
+    rows = (await db.execute(select(tree).limit(max_size + 1))).all()
+    if not rows:
+        raise HTTPException(404, "not found")
+    truncated = len(rows) > max_size
+    rows = sorted(rows[:max_size], key=lambda r: (r.depth, r.created_at, r.id))
+    root, replies = rows[0], rows[1:]
+    return {
+        "root": _msg_row(root),
+        "replies": [{**_msg_row(r), "depth": r.depth} for r in replies],
+        "truncated": truncated,
+    }
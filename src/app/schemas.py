@@ -32,4 +32,37 @@ class PriorityPolicyOut(PriorityPolicyIn):
 
 class ChannelCreate(BaseModel):
     name: str
-    is_group: bool = True
\ No newline at end of file
+    is_group: bool = True
+
+class UserBulkIn(BaseModel):
+    id: Optional[int] = None
+    email: Optional[str] = None
+    display_name: Optional[str] = None
+
+class ParticipantBulkIn(BaseModel):
+    user_id: int
+    role: str = "member"
+
+class StreamBulkIn(BaseModel):
+    owner_user_id: int
+
+class PolicyBulkIn(PriorityPolicyIn):
+    stream_id: int
+
+class PolicyTierIn(BaseModel):
+    msg_rate_rps: int
+    upload_bps: int
+    download_bps: int
+    burst: int = 10
+    priority: int = 0
+    quota_msgs_day: int = 0
+    quota_bytes_day: int = 0
+    quota_bytes_month: int = 0
+
+class PolicyTierOut(PolicyTierIn):
+    id: int
+    name: str
+    updated_at: datetime
+
+class TierAssignIn(BaseModel):
+    tier: Optional[str] = None   # None — зняти тир
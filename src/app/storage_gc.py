@@ -0,0 +1,218 @@
+"""
+Reclaiming what failed uploads leave behind.
+
+An upload inserts its placeholder message and a `pending` attachment row in
+one transaction before the first byte is written and flips the row to
+`complete` at the end; a failed upload marks it `aborted` and unlinks its
+partial file (routes/files.py). The collector handles the rest, in batches
+of STORAGE_GC_BATCH with STORAGE_GC_PAUSE_S between them:
+
+    stale      `pending` rows whose file hasn't been written to for
+               UPLOAD_STALE_S (the worker died mid-upload) -> aborted
+    aborted    file, placeholder message and attachment row are deleted
+    dangling   file placeholders with no attachment row at all (uploads
+               from before status tracking), found via ix_msg_file_placeholder
+    orphans    files in UPLOAD_DIR no attachment row points to (the row was
+               deleted, e.g. by partition retention)
+
+The upload directory is walked with one os.scandir iterator, a batch at a
+time, never listed whole. Everything runs on a single connection holding
+an advisory lock, so one worker collects at a time. Every step is
+idempotent.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timezone
+from sqlalchemy import ARRAY, BigInteger, bindparam, delete, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .config import settings
+from .db import engine
+from .models import Attachment, Message
+
+log = logging.getLogger(__name__)
+
+_LOCK_ID = 0x73746763  # 'stgc'
+_att = Attachment.__table__
+_msg = Message.__table__
+# той самий предикат, що й у ix_msg_file_placeholder
+_PLACEHOLDER = text("messages.meta->>'kind' = 'file' AND messages.meta->>'attachment_id' IS NULL")
+
+
+def _ids(name: str, values: list[int]):
+    return bindparam(name, values, type_=ARRAY(BigInteger))
+
+
+def _epoch(dt) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _stat_mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _unlink(paths: list[str]) -> int:
+    freed = 0
+    for p in paths:
+        try:
+            size = os.stat(p).st_size
+            os.remove(p)
+            freed += size
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+class StorageCollector:
+    def __init__(self):
+        self.last: dict = {}
+
+    async def _pause(self):
+        await asyncio.sleep(settings.STORAGE_GC_PAUSE_S)
+
+    async def _stale(self, conn: AsyncConnection, stats: dict):
+        cutoff = time.time() - settings.UPLOAD_STALE_S
+        after = 0
+        while True:
+            rows = (await conn.execute(
+                select(_att.c.id, _att.c.storage_path, _att.c.created_at)
+                .where(_att.c.status == "pending", _att.c.id > after)
+                .order_by(_att.c.id).limit(settings.STORAGE_GC_BATCH)
+            )).all()
+            await conn.commit()  # stat і пауза — поза транзакцією
+            if not rows:
+                return
+            after = rows[-1].id
+            mtimes = await asyncio.to_thread(lambda: [_stat_mtime(r.storage_path) for r in rows])
+            # файл, що не ріс UPLOAD_STALE_S (або так і не з'явився), — upload мертвий
+            stale = [r.id for r, m in zip(rows, mtimes) if (m if m is not None else _epoch(r.created_at)) < cutoff]
+            if stale:
+                await conn.execute(
+                    update(_att).where(_att.c.id == func.any(_ids("ids", stale)), _att.c.status == "pending")
+                    .values(status="aborted")
+                )
+                await conn.commit()
+                stats["stale"] += len(stale)
+            await self._pause()
+
+    async def _aborted(self, conn: AsyncConnection, stats: dict):
+        while True:
+            rows = (await conn.execute(
+                select(_att.c.id, _att.c.message_id, _att.c.storage_path)
+                .where(_att.c.status == "aborted")
+                .order_by(_att.c.id).limit(settings.STORAGE_GC_BATCH)
+            )).all()
+            if not rows:
+                return
+            stats["bytes"] += await asyncio.to_thread(_unlink, [r.storage_path for r in rows])
+            # лише плейсхолдер: повідомлення з attachment_id у meta — вже чиєсь готове
+            await conn.execute(
+                delete(_msg).where(_msg.c.id == func.any(_ids("mids", [r.message_id for r in rows])), _PLACEHOLDER)
+            )
+            await conn.execute(delete(_att).where(_att.c.id == func.any(_ids("ids", [r.id for r in rows]))))
+            await conn.commit()
+            stats["aborted"] += len(rows)
+            if len(rows) < settings.STORAGE_GC_BATCH:
+                return
+            await self._pause()
+
+    async def _dangling(self, conn: AsyncConnection, stats: dict):
+        cutoff = func.timezone("utc", func.now()) - func.make_interval(0, 0, 0, 0, 0, 0, settings.UPLOAD_STALE_S)
+        stmt = (
+            select(_msg.c.id)
+            .where(_PLACEHOLDER, _msg.c.created_at < cutoff)
+            .where(~select(_att.c.id).where(_att.c.message_id == _msg.c.id).exists())
+            .limit(settings.STORAGE_GC_BATCH)
+        )
+        while True:
+            ids = (await conn.execute(stmt)).scalars().all()
+            if not ids:
+                return
+            await conn.execute(delete(_msg).where(_msg.c.id == func.any(_ids("ids", list(ids))), _PLACEHOLDER))
+            await conn.commit()
+            stats["dangling"] += len(ids)
+            if len(ids) < settings.STORAGE_GC_BATCH:
+                return
+            await self._pause()
+
+    @staticmethod
+    def _scan(it, n: int) -> tuple[list[tuple[str, str, float]], bool]:
+        # у потоці: наступні n файлів каталогу (ім'я, шлях, mtime) і чи каталог закінчився
+        out = []
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                out.append((entry.name, entry.path, entry.stat().st_mtime))
+                if len(out) >= n:
+                    return out, False
+        return out, True
+
+    async def _orphans(self, conn: AsyncConnection, stats: dict):
+        if not os.path.isdir(settings.UPLOAD_DIR):
+            return
+        cutoff = time.time() - settings.UPLOAD_STALE_S
+        it = await asyncio.to_thread(os.scandir, settings.UPLOAD_DIR)
+        try:
+            done = False
+            while not done:
+                files, done = await asyncio.to_thread(self._scan, it, settings.STORAGE_GC_BATCH)
+                # наші файли — "<message_id>_<ім'я>"; свіжі не чіпаємо
+                cand = {}
+                for name, path, mtime in files:
+                    mid, sep, _ = name.partition("_")
+                    if sep and mid.isdigit() and mtime < cutoff:
+                        cand[path] = (int(mid), name)
+                if cand:
+                    rows = await conn.execute(
+                        select(_att.c.storage_path)
+                        .where(_att.c.message_id == func.any(_ids("mids", sorted({m for m, _ in cand.values()}))))
+                    )
+                    known = {os.path.basename(p) for (p,) in rows.all()}
+                    await conn.commit()
+                    dead = [path for path, (_, name) in cand.items() if name not in known]
+                    if dead:
+                        stats["bytes"] += await asyncio.to_thread(_unlink, dead)
+                        stats["orphans"] += len(dead)
+                stats["scanned"] += len(files)
+                await self._pause()
+        finally:
+            it.close()
+
+    async def collect(self) -> dict:
+        """One full pass; skipped if another worker holds the lock."""
+        stats = {"stale": 0, "aborted": 0, "dangling": 0, "orphans": 0, "scanned": 0, "bytes": 0}
+        t0 = time.monotonic()
+        async with engine.connect() as conn:
+            if not (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_ID})).scalar():
+                return {"skipped": "locked"}
+            await conn.commit()
+            try:
+                await self._stale(conn, stats)
+                await self._aborted(conn, stats)
+                await self._dangling(conn, stats)
+                await self._orphans(conn, stats)
+            finally:
+                await conn.rollback()
+                await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_ID})
+                await conn.commit()
+        stats["elapsed_s"] = round(time.monotonic() - t0, 3)
+        self.last = stats
+        return stats
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.STORAGE_GC_INTERVAL_S)
+            try:
+                res = await self.collect()
+                if any(res.get(k) for k in ("stale", "aborted", "dangling", "orphans")):
+                    log.info("storage gc: %s", res)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("storage gc: pass failed")
+
+
+collector = StorageCollector()
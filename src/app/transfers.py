@@ -0,0 +1,97 @@
+"""
+Progress of active uploads and downloads.
+
+Pacing loops only bump an int on their Transfer; they never touch a
+socket. run() wakes every TRANSFER_PROGRESS_S and sends each user with
+active transfers one `transfer.progress` frame listing all of them (bytes,
+total, bps over the last interval). Finished transfers are reported once
+more with their final state and then forgotten. Each send is bounded by
+TRANSFER_PROGRESS_S, so a stalled socket skips its frame instead of
+holding up the tick for everyone else.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable
+from .config import settings
+
+log = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+
+
+class Transfer:
+    __slots__ = ("id", "user_id", "kind", "ref", "total", "bytes", "state", "started", "_last_bytes", "_last_t")
+
+    def __init__(self, user_id: int, kind: str, ref: dict, total: int | None):
+        self.id = next(_ids)
+        self.user_id = user_id
+        self.kind = kind          # upload | download
+        self.ref = ref            # {"message_id": ...} / {"attachment_id": ...}
+        self.total = total
+        self.bytes = 0
+        self.state = "active"     # active | done | aborted
+        self.started = self._last_t = time.monotonic()
+        self._last_bytes = 0
+
+    def snapshot(self, now: float) -> dict:
+        dt = max(1e-6, now - self._last_t)
+        bps = (self.bytes - self._last_bytes) / dt
+        self._last_bytes, self._last_t = self.bytes, now
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            **self.ref,
+            "bytes": self.bytes,
+            "total": self.total,
+            "bps": int(bps),
+            "elapsed_ms": int((now - self.started) * 1000),
+            "state": self.state,
+        }
+
+
+class TransferRegistry:
+    def __init__(self):
+        # user_id -> {transfer_id: Transfer}
+        self.by_user: dict[int, dict[int, Transfer]] = {}
+
+    def start(self, user_id: int, kind: str, total: int | None = None, **ref) -> Transfer:
+        t = Transfer(user_id, kind, ref, total)
+        self.by_user.setdefault(user_id, {})[t.id] = t
+        return t
+
+    def finish(self, t: Transfer, ok: bool = True):
+        # лишається в реєстрі до наступного тіку — клієнт побачить фінальний стан
+        t.state = "done" if ok else "aborted"
+
+    def active(self) -> int:
+        return sum(1 for ts in self.by_user.values() for t in ts.values() if t.state == "active")
+
+    def frames(self) -> list[tuple[int, dict]]:
+        now = time.monotonic()
+        out = []
+        for uid, ts in list(self.by_user.items()):
+            out.append((uid, {"type": "transfer.progress", "transfers": [t.snapshot(now) for t in ts.values()]}))
+            for tid in [tid for tid, t in ts.items() if t.state != "active"]:
+                del ts[tid]
+            if not ts:
+                del self.by_user[uid]
+        return out
+
+    async def run(self, send: Callable[[int, dict], Awaitable[None]]):
+        while True:
+            await asyncio.sleep(settings.TRANSFER_PROGRESS_S)
+            frames = self.frames()
+            if not frames:
+                continue
+            # усі користувачі паралельно, кожен не довше за тік: завислий сокет не затримує решту
+            sends = (asyncio.wait_for(send(u, f), settings.TRANSFER_PROGRESS_S) for u, f in frames)
+            for (uid, _), res in zip(frames, await asyncio.gather(*sends, return_exceptions=True)):
+                if isinstance(res, asyncio.TimeoutError):
+                    log.debug("transfers: progress for user %s timed out", uid)
+                elif isinstance(res, Exception):
+                    log.warning("transfers: progress for user %s failed (%r)", uid, res)
+
+
+transfers = TransferRegistry()
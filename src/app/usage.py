@@ -0,0 +1,306 @@
+"""
+Per-stream usage accounting and quotas.
+
+Every message, upload chunk and download chunk that passes the limiter is
+counted in a per-worker buffer (a dict increment, no I/O). Every
+USAGE_FLUSH_S the buffer goes to Redis in one pipeline:
+
+    us:{s<id>}:m<minute>     hash msgs/up/down (+ thr_* throttle waits) for one minute
+    us:{s<id>}:d<YYYYMMDD>   hash msgs/bytes for the UTC day
+    us:{s<id>}:mo<YYYYMM>    hash bytes for the UTC month
+    cfg:usage_dirty          set of "<stream_id>:<minute>" not yet rolled up
+
+The HINCRBYs on the day/month hashes return the totals across all workers,
+so each flush also refreshes this worker's view of the quotas. exhausted()
+compares that view plus what the worker counted since against the stream's
+quota_* limits without awaiting: the check costs no round trip, and
+a stream may overshoot by what other workers counted within one flush
+interval. A transfer that starts under quota is allowed to finish.
+
+rollup() pops dirty minutes (SPOP, a batch at a time), upserts their
+totals into stream_usage as `minute` rows and recomputes the affected
+`hour` rows from minutes and `day` rows from hours. Rows are overwritten,
+never added to, so a minute rolled up twice (a late flush re-marks it
+dirty) stays correct. One worker rolls up at a time (advisory lock).
+Minute and hour rows are pruned after USAGE_*_RETENTION_DAYS.
+"""
+import asyncio
+import logging
+import time
+from redis.exceptions import RedisError
+from sqlalchemy import ARRAY, BigInteger, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from .config import settings
+from .db import engine
+from .policy_table import Limits
+from .redis_client import get_redis
+from . import keys
+
+log = logging.getLogger(__name__)
+
+DIRTY_KEY = keys.config("usage_dirty")
+KINDS = ("msgs", "up", "down")
+# поля хвилинного хешу: використання + скільки разів лімітер відмовив / змусив чекати
+FIELDS = KINDS + tuple(f"thr_{k}" for k in KINDS)
+_LOCK_ID = 0x75736167  # 'usag'
+_DAY_TTL_S = 2 * 86_400
+_MONTH_TTL_S = 32 * 86_400
+
+
+def _periods(now: float) -> tuple[str, str]:
+    t = time.gmtime(now)
+    return time.strftime("%Y%m%d", t), time.strftime("%Y%m", t)
+
+
+def _ids(name: str, values: list[int]):
+    return bindparam(name, values, type_=ARRAY(BigInteger))
+
+
+class UsageMeter:
+    def __init__(self):
+        # (stream_id, minute) -> значення FIELDS до наступного flush
+        self._buf: dict[tuple[int, int], list[int]] = {}
+        # stream_id -> [msgs, bytes], пораховане воркером і ще не підтверджене flush'ем
+        self._unflushed: dict[int, list[int]] = {}
+        # stream_id -> (day, month, msgs_day, bytes_day, bytes_month) — підсумки всіх воркерів з останнього flush
+        self._known: dict[int, tuple[str, str, int, int, int]] = {}
+        self._period_min = -1
+        self._period = ("", "")
+
+    def _current(self, now: float) -> tuple[str, str]:
+        minute = int(now // 60)
+        if minute != self._period_min:
+            self._period_min, self._period = minute, _periods(now)
+        return self._period
+
+    # ---------- гаряча частина: без I/O ----------
+    def _row(self, stream_id: int) -> list[int]:
+        key = (stream_id, int(time.time() // 60))
+        row = self._buf.get(key)
+        if row is None:
+            row = self._buf[key] = [0] * len(FIELDS)
+        return row
+
+    def add(self, stream_id: int, kind: str, n: int = 1):
+        if n <= 0:
+            return
+        self._row(stream_id)[KINDS.index(kind)] += n
+        u = self._unflushed.get(stream_id)
+        if u is None:
+            u = self._unflushed[stream_id] = [0, 0]
+        u[0 if kind == "msgs" else 1] += n
+
+    def throttled(self, stream_id: int, kind: str):
+        """The limiter refused (msgs) or stalled (up/down) this stream once."""
+        self._row(stream_id)[len(KINDS) + KINDS.index(kind)] += 1
+
+    def used(self, stream_id: int) -> tuple[int, int, int]:
+        """(msgs today, bytes today, bytes this month) as this worker sees them."""
+        day, month = self._current(time.time())
+        k = self._known.get(stream_id)
+        msgs_d = bytes_d = bytes_m = 0
+        if k is not None:
+            if k[0] == day:
+                msgs_d, bytes_d = k[2], k[3]
+            if k[1] == month:
+                bytes_m = k[4]
+        u = self._unflushed.get(stream_id)
+        if u is not None:
+            msgs_d, bytes_d, bytes_m = msgs_d + u[0], bytes_d + u[1], bytes_m + u[1]
+        return msgs_d, bytes_d, bytes_m
+
+    def exhausted(self, stream_id: int, lim: Limits, what: str) -> str | None:
+        """Name of the quota `what` (msgs | bytes) has run into, or None; never awaits."""
+        if what == "msgs":
+            if not lim.quota_msgs_day:
+                return None
+        elif not (lim.quota_bytes_day or lim.quota_bytes_month):
+            return None
+        msgs_d, bytes_d, bytes_m = self.used(stream_id)
+        if what == "msgs":
+            return "msgs_day" if msgs_d >= lim.quota_msgs_day else None
+        if lim.quota_bytes_day and bytes_d >= lim.quota_bytes_day:
+            return "bytes_day"
+        if lim.quota_bytes_month and bytes_m >= lim.quota_bytes_month:
+            return "bytes_month"
+        return None
+
+    # ---------- буфер -> Redis ----------
+    def _restore(self, buf: dict[tuple[int, int], list[int]]):
+        for key, vals in buf.items():
+            row = self._buf.setdefault(key, [0] * len(FIELDS))
+            for i, v in enumerate(vals):
+                row[i] += v
+
+    async def flush(self):
+        buf, self._buf = self._buf, {}
+        if not buf:
+            return
+        day, month = self._current(time.time())
+        flushed: dict[int, list[int]] = {}
+        for (sid, _), vals in buf.items():
+            f = flushed.setdefault(sid, [0, 0])
+            f[0] += vals[0]
+            f[1] += vals[1] + vals[2]
+        try:
+            r = await get_redis()
+            pipe = r.pipeline(transaction=False)
+            for (sid, minute), vals in buf.items():
+                mk = keys.usage(sid, f"m{minute}")
+                for field, v in zip(FIELDS, vals):
+                    if v:
+                        pipe.hincrby(mk, field, v)
+                pipe.expire(mk, settings.USAGE_MINUTE_TTL_S)
+                pipe.sadd(DIRTY_KEY, f"{sid}:{minute}")
+            tail = []
+            for sid, (m, b) in flushed.items():
+                # HINCRBY з 0 теж повертає підсумок — так воркер дізнається чуже використання
+                dk, mok = keys.usage(sid, f"d{day}"), keys.usage(sid, f"mo{month}")
+                pipe.hincrby(dk, "msgs", m)
+                pipe.hincrby(dk, "bytes", b)
+                pipe.expire(dk, _DAY_TTL_S)
+                pipe.hincrby(mok, "bytes", b)
+                pipe.expire(mok, _MONTH_TTL_S)
+                tail.append(sid)
+            res = await pipe.execute()
+        except (RedisError, OSError):
+            self._restore(buf)
+            raise
+        res = res[len(res) - 5 * len(tail):]
+        for i, sid in enumerate(tail):
+            msgs_d, bytes_d, _, bytes_m, _ = res[i * 5:i * 5 + 5]
+            self._known[sid] = (day, month, int(msgs_d), int(bytes_d), int(bytes_m))
+            u, f = self._unflushed.get(sid), flushed[sid]
+            if u is not None:
+                u[0] -= f[0]
+                u[1] -= f[1]
+                if u[0] <= 0 and u[1] <= 0:
+                    del self._unflushed[sid]
+        # стріми, що давно мовчать, не тримаємо в пам'яті
+        for sid in [s for s, k in self._known.items() if k[1] != month]:
+            del self._known[sid]
+
+    async def current(self, stream_id: int) -> dict:
+        """Totals for today and this month straight from Redis (flushed usage only)."""
+        day, month = _periods(time.time())
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(keys.usage(stream_id, f"d{day}"))
+        pipe.hgetall(keys.usage(stream_id, f"mo{month}"))
+        d, mo = await pipe.execute()
+        d, mo = d or {}, mo or {}
+        return {
+            "day": day,
+            "msgs_day": int(d.get(b"msgs", 0)),
+            "bytes_day": int(d.get(b"bytes", 0)),
+            "month": month,
+            "bytes_month": int(mo.get(b"bytes", 0)),
+        }
+
+    # ---------- Redis -> Postgres ----------
+    async def _write(self, conn: AsyncConnection, rows: list[tuple[int, int, int, int, int]]):
+        sids, minutes, msgs, ups, downs = (list(c) for c in zip(*rows))
+        # лише чинні стріми: видалений стрім не ламає всю пачку по FK
+        await conn.execute(text(
+            "INSERT INTO stream_usage (stream_id, grain, ts, msgs, bytes_up, bytes_down) "
+            "SELECT v.s, 'minute', to_timestamp(v.m * 60) AT TIME ZONE 'utc', v.a, v.u, v.d "
+            "FROM unnest(:s, :m, :a, :u, :d) AS v(s, m, a, u, d) "
+            "WHERE EXISTS (SELECT 1 FROM streams st WHERE st.id = v.s) "
+            "ON CONFLICT (stream_id, grain, ts) DO UPDATE SET "
+            "msgs = excluded.msgs, bytes_up = excluded.bytes_up, bytes_down = excluded.bytes_down"
+        ).bindparams(_ids("s", sids), _ids("m", minutes), _ids("a", msgs), _ids("u", ups), _ids("d", downs)))
+        # години — з хвилин, дні — з годин; лише ті, яких торкнулася пачка
+        for grain, src, unit in (("hour", "minute", "hour"), ("day", "hour", "day")):
+            await conn.execute(text(
+                "INSERT INTO stream_usage (stream_id, grain, ts, msgs, bytes_up, bytes_down) "
+                f"SELECT k.s, '{grain}', k.t, sum(u.msgs), sum(u.bytes_up), sum(u.bytes_down) "
+                "FROM (SELECT DISTINCT v.s, "
+                f"date_trunc('{unit}', to_timestamp(v.m * 60) AT TIME ZONE 'utc') AS t "
+                "FROM unnest(:s, :m) AS v(s, m)) k "
+                f"JOIN stream_usage u ON u.stream_id = k.s AND u.grain = '{src}' "
+                f"AND u.ts >= k.t AND u.ts < k.t + interval '1 {unit}' "
+                "GROUP BY k.s, k.t "
+                "ON CONFLICT (stream_id, grain, ts) DO UPDATE SET "
+                "msgs = excluded.msgs, bytes_up = excluded.bytes_up, bytes_down = excluded.bytes_down"
+            ).bindparams(_ids("s", sids), _ids("m", minutes)))
+
+    async def _rollup(self, conn: AsyncConnection, r) -> int:
+        done = 0
+        while True:
+            members = await r.spop(DIRTY_KEY, settings.USAGE_ROLLUP_BATCH)
+            if not members:
+                return done
+            try:
+                pairs = sorted({tuple(int(x) for x in m.split(b":")) for m in members})
+                pipe = r.pipeline(transaction=False)
+                for sid, minute in pairs:
+                    pipe.hgetall(keys.usage(sid, f"m{minute}"))
+                rows = []
+                for (sid, minute), h in zip(pairs, await pipe.execute()):
+                    if h:  # хеш міг уже протухнути — тоді рядок у Postgres остаточний
+                        rows.append((sid, minute, *(int(h.get(k.encode(), 0)) for k in KINDS)))
+                if rows:
+                    await self._write(conn, rows)
+                    await conn.commit()
+            except BaseException:
+                # повертаємо позначки: наступний прохід підбере ці хвилини
+                await conn.rollback()
+                await r.sadd(DIRTY_KEY, *members)
+                raise
+            done += len(rows)
+            if len(members) < settings.USAGE_ROLLUP_BATCH:
+                return done
+
+    async def _prune(self, conn: AsyncConnection) -> int:
+        n = 0
+        for grain, days in (("minute", settings.USAGE_MINUTE_RETENTION_DAYS), ("hour", settings.USAGE_HOUR_RETENTION_DAYS)):
+            res = await conn.execute(text(
+                "DELETE FROM stream_usage WHERE grain = :g "
+                "AND ts < timezone('utc', now()) - make_interval(days => :d)"
+            ), {"g": grain, "d": days})
+            n += res.rowcount or 0
+        await conn.commit()
+        return n
+
+    async def rollup(self, prune: bool = False) -> dict:
+        """Roll dirty minutes into stream_usage; skipped if another worker holds the lock."""
+        t0 = time.monotonic()
+        r = await get_redis()
+        async with engine.connect() as conn:
+            if not (await conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_ID})).scalar():
+                return {"skipped": "locked"}
+            await conn.commit()
+            try:
+                out = {"minutes": await self._rollup(conn, r)}
+                if prune:
+                    out["pruned"] = await self._prune(conn)
+            finally:
+                await conn.rollback()
+                await conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_ID})
+                await conn.commit()
+        out["elapsed_s"] = round(time.monotonic() - t0, 3)
+        return out
+
+    async def run(self):
+        """Flush every USAGE_FLUSH_S, roll up every USAGE_ROLLUP_S, prune hourly."""
+        last_rollup = last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.USAGE_FLUSH_S)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.warning("usage: flush failed, kept in buffer (%r)", e)
+            if time.monotonic() - last_rollup >= settings.USAGE_ROLLUP_S:
+                last_rollup = time.monotonic()
+                prune = last_rollup - last_prune >= 3600
+                try:
+                    await self.rollup(prune=prune)
+                    if prune:
+                        last_prune = last_rollup
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("usage: rollup failed")
+
+
+usage = UsageMeter()
@@ -0,0 +1,125 @@
+"""
+Warm-up before the first request and the readiness probe.
+
+on_startup awaits warm_up() (bounded by WARMUP_TIMEOUT_S) before the server
+starts accepting connections:
+
+    db        DB_POOL_SIZE connections opened and held together, each
+              preparing the hot read statements (dal.warm)
+    redis     WARMUP_REDIS_CONNS concurrent PINGs fill the client pool, then
+              every limiter/read-state script is SCRIPT LOADed
+    policies  the policy table is loaded
+
+If a dependency is down, startup goes on and retry() keeps trying in the
+background; until a warm-up succeeds /ready answers 503.
+
+/health stays a liveness check (the process is up). /ready also needs
+Postgres and Redis to answer within READY_TIMEOUT_S and the worker not to
+be draining; its result is cached for READY_CACHE_S so a probe storm costs
+one round trip per dependency.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from sqlalchemy import text
+from .admission import admission
+from .config import settings
+from .db import engine
+from .policy_table import policies
+from .redis_client import get_redis, load_scripts
+from . import dal
+
+log = logging.getLogger(__name__)
+
+
+class Readiness:
+    def __init__(self):
+        self.warm = False
+        self.report: dict = {}
+        self._cached: tuple[float, dict] | None = None
+
+    async def _warm_db(self) -> int:
+        n = settings.DB_POOL_SIZE
+        async with contextlib.AsyncExitStack() as stack:
+            # тримаємо всі разом — інакше пул віддасть той самий конект n разів
+            conns = [await stack.enter_async_context(engine.connect()) for _ in range(n)]
+            await asyncio.gather(*(dal.warm(c) for c in conns))
+        return n
+
+    async def _warm_redis(self) -> int:
+        r = await get_redis()
+        await asyncio.gather(*(r.ping() for _ in range(settings.WARMUP_REDIS_CONNS)))
+        return await load_scripts(r)
+
+    async def warm_up(self) -> bool:
+        """Run every step; True once all of them succeeded."""
+        if not settings.WARMUP_ENABLED:
+            self.warm = True
+            return True
+        t0 = time.monotonic()
+        report = {}
+        steps = (
+            ("db_connections", self._warm_db),
+            ("redis_scripts", self._warm_redis),
+            ("policies", lambda: policies.refresh(force=True)),
+        )
+        ok = True
+        for name, step in steps:
+            s0 = time.monotonic()
+            try:
+                res = await asyncio.wait_for(step(), settings.WARMUP_TIMEOUT_S)
+                report[name] = {"ok": True, "result": res, "ms": round((time.monotonic() - s0) * 1000, 1)}
+            except Exception as e:
+                ok = False
+                report[name] = {"ok": False, "error": repr(e)}
+        report["elapsed_ms"] = round((time.monotonic() - t0) * 1000, 1)
+        self.report = report
+        self.warm = ok
+        if ok:
+            log.info("warm-up done: %s", report)
+        else:
+            log.warning("warm-up incomplete, not ready yet: %s", report)
+        return ok
+
+    async def retry(self):
+        while not await self.warm_up():
+            await asyncio.sleep(settings.WARMUP_RETRY_S)
+
+    async def _probe(self, coro) -> dict:
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(coro, settings.READY_TIMEOUT_S)
+        except Exception as e:
+            return {"ok": False, "error": repr(e)}
+        return {"ok": True, "ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+    @staticmethod
+    async def _ping_db():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    @staticmethod
+    async def _ping_redis():
+        r = await get_redis()
+        await r.ping()
+
+    async def check(self) -> dict:
+        now = time.monotonic()
+        if admission.closed:
+            # drain: балансувальник має зняти воркер негайно, без кешу і без походу в БД
+            return {"ready": False, "warm": self.warm, "draining": True}
+        if self._cached and self._cached[0] > now:
+            return self._cached[1]
+        db, redis_ = await asyncio.gather(self._probe(self._ping_db()), self._probe(self._ping_redis()))
+        res = {
+            "ready": self.warm and db["ok"] and redis_["ok"],
+            "warm": self.warm,
+            "postgres": db,
+            "redis": redis_,
+        }
+        self._cached = (now + settings.READY_CACHE_S, res)
+        return res
+
+
+readiness = Readiness()
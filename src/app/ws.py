@@ -2,14 +2,20 @@ import json
 from typing import Dict, Set
 
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from .admission import WS_TRY_AGAIN_LATER, Rejected, admission
 from .db import async_session
-from .models import ChannelParticipant, Stream, Message, PriorityPolicy
+from . import dal
 from .schemas import MessageIn
-from .config import settings
-from .rate_limiter import TokenBucket
-import redis.asyncio as redis
+from .offline_queue import offline
+from .presence import presence
+from .adaptive import adaptive
+from .policy_table import Limits, policies
+from .read_state import reads
+from .rate_limiter import TokenBucket, make_limiter
+from .redis_client import get_redis
+from .usage import usage
+from redis.exceptions import RedisError
 
 class ConnectionManager:
     def __init__(self):
@@ -75,111 +81,223 @@ class ConnectionManager:
     async def broadcast_channel(self, channel_id: int, payload: dict):
         users = self.channel_subs.get(channel_id, set())
         data = json.dumps(payload)
+        delivered = set()
         for uid in list(users):
             for ws in list(self.user_sockets.get(uid, ())):
                 try:
                     await ws.send_text(data)
+                    delivered.add(uid)
                 except Exception:
                     self.disconnect(ws)
+        # решті учасників — у журнал, отримають при наступному підключенні
+        offline.record(channel_id, payload, delivered, data)
 
 manager = ConnectionManager()
 
-async def get_redis() -> redis.Redis:
-    return redis.from_url(settings.REDIS_URL)
-
 async def get_or_create_stream(session: AsyncSession, channel_id: int, owner_user_id: int) -> int:
-    q = await session.execute(select(Stream).where(Stream.channel_id == channel_id, Stream.owner_user_id == owner_user_id))
-    st = q.scalar_one_or_none()
-    if st:
-        return st.id
-    res = await session.execute(insert(Stream).values(channel_id=channel_id, owner_user_id=owner_user_id).returning(Stream.id))
-    st_id = res.scalar_one()
-    await session.commit()
+    st_id, created = await dal.stream_id(session, channel_id, owner_user_id)
+    if created:
+        await session.commit()
     return st_id
 
 async def ensure_member(session: AsyncSession, channel_id: int, user_id: int) -> bool:
-    q = await session.execute(select(ChannelParticipant).where(ChannelParticipant.channel_id == channel_id, ChannelParticipant.user_id == user_id))
-    return q.scalar_one_or_none() is not None
-
-async def load_policy(session: AsyncSession, stream_id: int):
-    q = await session.execute(select(PriorityPolicy).where(PriorityPolicy.stream_id == stream_id, PriorityPolicy.enabled == True))
-    p = q.scalar_one_or_none()
-    if p:
-        return p.msg_rate_rps, p.upload_bps, p.download_bps, p.burst
-    return (
-        settings.DEFAULT_MSG_RATE_RPS,
-        settings.DEFAULT_UPLOAD_BPS,
-        settings.DEFAULT_DOWNLOAD_BPS,
-        settings.DEFAULT_BURST,
-    )
+    return await dal.is_member(session, channel_id, user_id)
+
+async def load_policy(channel_id: int, stream_id: int) -> Limits:
+    await policies.refresh()
+    return adaptive.apply(policies.resolve(channel_id, stream_id))
+
+async def message_seq(channel_id: int, sender_id: int) -> int | None:
+    """Seq for a just-committed message; the sender has read it."""
+    seq = await reads.next_seq(channel_id)
+    if seq is not None:
+        try:
+            await reads.mark_read(sender_id, channel_id, seq, receipt=False, clamp=False)
+        except (RedisError, OSError):
+            pass
+    return seq
 
 async def websocket_endpoint(websocket: WebSocket):
     user_id = int(websocket.query_params.get("user_id"))
-    await manager.connect(user_id, websocket)  # <— нове
-    r = await get_redis()
-    limiter = TokenBucket(r)
-    async with async_session() as db:
+    try:
+        slot = await admission.admit_socket(user_id)
+    except Rejected as e:
+        # accept + close: клієнт отримує код і підказку, а не голу відмову handshake
+        await websocket.accept()
+        await websocket.close(code=WS_TRY_AGAIN_LATER, reason=e.ws_reason())
+        return
+    # сесія (і конект з пулу) — лише на час однієї дії, не на все життя сокета:
+    # тисячі idle-сокетів не тримають ні конектів, ні відкритих транзакцій
+    present = False
+    try:
+        await manager.connect(user_id, websocket)  # <— нове
+        presence.connect(user_id)
+        present = True
+        r = await get_redis()
+        limiter = make_limiter(r)
         try:
-            while True:
-                msg = await websocket.receive_text()
-                data = json.loads(msg)
-                action = data.get("action")
+            async with async_session() as db:
+                badges = await reads.unread(db, user_id)
+            await websocket.send_text(json.dumps({"type": "unread", "channels": badges}))
+        except (RedisError, OSError):
+            pass  # без бейджів, але з робочим сокетом
+        if offline.enabled:
+            try:
+                async for batch in offline.replay(user_id, websocket.query_params.get("since")):
+                    await websocket.send_text(json.dumps({
+                        "type": "replay",
+                        "events": [{"id": eid, "event": ev} for eid, ev in batch],
+                        "last_id": batch[-1][0],
+                    }))
+            except (RedisError, OSError):
+                pass
+        while True:
+            msg = await websocket.receive_text()
+            data = json.loads(msg)
+            action = data.get("action")
+            if action not in ("heartbeat", "ack"):
+                # ack шле сам клієнт при replay — це не активність людини
+                presence.touch(user_id)
+
+            if action == "join_channel":
+                channel_id = int(data["channel_id"])
+                async with async_session() as db:
+                    is_member = await ensure_member(db, channel_id, user_id)
+                if not is_member:
+                    await websocket.send_text(json.dumps({"type": "error", "error": "not_member"}))
+                    continue
+                manager.join_channel(user_id, channel_id)  # <— нове
+                await websocket.send_text(json.dumps({"type": "joined", "channel_id": channel_id}))
+
+            elif action == "leave_channel":
+                channel_id = int(data["channel_id"])
+                manager.leave_channel(user_id, channel_id)  # <— нове
+                await websocket.send_text(json.dumps({"type": "left", "channel_id": channel_id}))
 
-                if action == "join_channel":
-                    channel_id = int(data["channel_id"])
+            elif action == "mark_read":
+                channel_id = int(data["channel_id"])
+                if channel_id not in manager.user_channels.get(user_id, ()):
+                    async with async_session() as db:
+                        if not await ensure_member(db, channel_id, user_id):
+                            await websocket.send_text(json.dumps({"type": "error", "error": "not_member"}))
+                            continue
+                try:
+                    cur = await reads.mark_read(user_id, channel_id, int(data["seq"]))
+                except (RedisError, OSError):
+                    await websocket.send_text(json.dumps({"type": "error", "error": "unavailable"}))
+                    continue
+                await websocket.send_text(json.dumps({"type": "read", "channel_id": channel_id, "seq": cur}))
+
+            elif action == "heartbeat":
+                # вкладка у фоні шле active=false: сокет живий, але користувач — away
+                if data.get("active", True):
+                    presence.touch(user_id)
+
+            elif action == "typing":
+                channel_id = int(data["channel_id"])
+                # лише в приєднаний канал; зайві натискання просто відкидаються
+                if channel_id in manager.user_channels.get(user_id, ()):
+                    presence.typing(user_id, channel_id)
+
+            elif action == "presence":
+                channel_id = int(data["channel_id"])
+                async with async_session() as db:
                     if not await ensure_member(db, channel_id, user_id):
                         await websocket.send_text(json.dumps({"type": "error", "error": "not_member"}))
                         continue
-                    manager.join_channel(user_id, channel_id)  # <— нове
-                    await websocket.send_text(json.dumps({"type": "joined", "channel_id": channel_id}))
+                    members = await dal.members(db, channel_id)
+                try:
+                    status = await presence.status_of(members)
+                except (RedisError, OSError):
+                    await websocket.send_text(json.dumps({"type": "error", "error": "unavailable"}))
+                    continue
+                await websocket.send_text(json.dumps({
+                    "type": "presence.members",
+                    "channel_id": channel_id,
+                    "users": [{"user_id": u, "status": s} for u, s in status.items()],
+                }))
 
-                elif action == "leave_channel":
-                    channel_id = int(data["channel_id"])
-                    manager.leave_channel(user_id, channel_id)  # <— нове
-                    await websocket.send_text(json.dumps({"type": "left", "channel_id": channel_id}))
+            elif action == "ack":
+                try:
+                    ok = await offline.ack(user_id, str(data.get("id", "")))
+                except (RedisError, OSError):
+                    continue  # записи доживуть до наступного ack або TTL
+                if not ok:
+                    await websocket.send_text(json.dumps({"type": "error", "error": "bad_id"}))
 
-                elif action == "send_message":
-                    payload = MessageIn(**data["payload"])
+            elif action == "send_message":
+                payload = MessageIn(**data["payload"])
+                async with async_session() as db:
                     if not await ensure_member(db, payload.channel_id, user_id):
                         await websocket.send_text(json.dumps({"type": "error", "error": "not_member"}))
                         continue
                     stream_id = await get_or_create_stream(db, payload.channel_id, user_id)
-                    msg_rate, up_bps, down_bps, burst = await load_policy(db, stream_id)
-                    allowed = await limiter.allow(TokenBucket.key(stream_id, "msgs"),
-                                                  rate=float(msg_rate), capacity=float(burst), cost=1.0)
-                    if not allowed:
-                        await websocket.send_text(json.dumps({"type": "throttled", "reason": "msg_rate"}))
-                        continue
+                # ліміт перевіряємо без захопленого конекту
+                pol = await load_policy(payload.channel_id, stream_id)
+                quota = usage.exhausted(stream_id, pol, "msgs")
+                if quota:
+                    usage.throttled(stream_id, "msgs")
+                    await websocket.send_text(json.dumps({"type": "throttled", "reason": "quota", "quota": quota}))
+                    continue
+                allowed = await limiter.allow(TokenBucket.key(stream_id, "msgs"),
+                                              rate=float(pol.msg_rate_rps), capacity=float(pol.burst), cost=1.0)
+                if not allowed:
+                    usage.throttled(stream_id, "msgs")
+                    await websocket.send_text(json.dumps({"type": "throttled", "reason": "msg_rate"}))
+                    continue
+                usage.add(stream_id, "msgs")
 
-                    res = await db.execute(
-                        insert(Message).values(
-                            channel_id=payload.channel_id,
-                            stream_id=stream_id,
-                            sender_id=user_id,
-                            parent_message_id=payload.parent_message_id,
-                            content=payload.content,
-                            meta=payload.meta,
-                        ).returning(Message.id)
+                thread = None
+                async with async_session() as db:
+                    if payload.parent_message_id is not None:
+                        # лічильник батька — в тій самій транзакції, що й вставка
+                        thread = await dal.bump_parent(db, payload.channel_id, payload.parent_message_id)
+                        if thread is None:
+                            await websocket.send_text(json.dumps({"type": "error", "error": "bad_parent"}))
+                            continue
+                    new_id = await dal.insert_message(
+                        db,
+                        channel_id=payload.channel_id,
+                        stream_id=stream_id,
+                        sender_id=user_id,
+                        parent_message_id=payload.parent_message_id,
+                        content=payload.content,
+                        meta=payload.meta,
                     )
-                    new_id = res.scalar_one()
                     await db.commit()
 
-                    out = {
-                        "type": "message.new",
-                        "message": {
-                            "id": new_id,
-                            "channel_id": payload.channel_id,
-                            "stream_id": stream_id,
-                            "sender_id": user_id,
-                            "content": payload.content,
-                            "meta": payload.meta,
-                        }
+                presence.stop_typing(user_id, payload.channel_id)
+                seq = await message_seq(payload.channel_id, user_id)
+                out = {
+                    "type": "message.new",
+                    "message": {
+                        "id": new_id,
+                        "seq": seq,
+                        "channel_id": payload.channel_id,
+                        "stream_id": stream_id,
+                        "sender_id": user_id,
+                        "parent_message_id": payload.parent_message_id,
+                        "content": payload.content,
+                        "meta": payload.meta,
                     }
-                    await manager.broadcast_channel(payload.channel_id, out)
-                else:
-                    await websocket.send_text(json.dumps({"type": "error", "error": "unknown_action"}))
-        except WebSocketDisconnect:
-            pass
-        finally:
-            manager.disconnect(websocket)   # <— важливо: повне прибирання
-            await r.close()
\ No newline at end of file
+                }
+                await manager.broadcast_channel(payload.channel_id, out)
+                if thread is not None:
+                    reply_count, last_reply_at = thread
+                    await manager.broadcast_channel(payload.channel_id, {
+                        "type": "thread.updated",
+                        "channel_id": payload.channel_id,
+                        "message_id": payload.parent_message_id,
+                        "reply_count": reply_count,
+                        "last_reply_at": last_reply_at.isoformat(),
+                    })
+            else:
+                await websocket.send_text(json.dumps({"type": "error", "error": "unknown_action"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # не за ws_to_user: невдалий send у broadcast уже міг прибрати сокет з менеджера
+        if present:
+            presence.disconnect(user_id, manager.user_channels.get(user_id, ()))
+        manager.disconnect(websocket)   # <— важливо: повне прибирання
+        slot.release()
@@ -0,0 +1,165 @@
+"""
+In-process ASGI client for the load harness.
+
+Drives the FastAPI app directly (no sockets, no extra deps), so timings
+measure the app itself and CPU per message isn't polluted by a network stack.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import urlencode
+
+
+class WSClient:
+    """Fake WebSocket peer: feeds websocket.receive, collects websocket.send."""
+
+    def __init__(self, app, path: str, params: dict | None = None):
+        self.app = app
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params or {}).encode(),
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self._in: asyncio.Queue = asyncio.Queue()
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.close_code: int | None = None
+        self._task: asyncio.Task | None = None
+
+    async def _receive(self):
+        return await self._in.get()
+
+    async def _send(self, message):
+        t = message["type"]
+        if t == "websocket.accept":
+            self.accepted.set()
+        elif t == "websocket.send":
+            text = message.get("text")
+            if text is not None:
+                self.events.put_nowait((time.perf_counter(), json.loads(text)))
+        elif t == "websocket.close":
+            self.close_code = message.get("code", 1000)
+            self.closed.set()
+            self.accepted.set()
+
+    async def connect(self, timeout: float = 10.0):
+        self._in.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(self.scope, self._receive, self._send))
+        await asyncio.wait_for(self.accepted.wait(), timeout)
+
+    def send(self, payload: dict):
+        self._in.put_nowait({"type": "websocket.receive", "text": json.dumps(payload)})
+
+    async def recv(self, timeout: float = 10.0) -> tuple[float, dict]:
+        return await asyncio.wait_for(self.events.get(), timeout)
+
+    async def recv_type(self, type_: str, timeout: float = 10.0) -> tuple[float, dict]:
+        deadline = time.perf_counter() + timeout
+        while True:
+            ts, ev = await self.recv(max(0.001, deadline - time.perf_counter()))
+            if ev.get("type") == type_:
+                return ts, ev
+
+    async def close(self):
+        self._in.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, 5.0)
+            except Exception:
+                self._task.cancel()
+
+
+class HTTPResult:
+    def __init__(self):
+        self.status = 0
+        self.headers: dict[str, str] = {}
+        self.body_bytes = 0
+        self.body = bytearray()
+        self.first_byte_at: float | None = None
+        self.finished_at: float | None = None
+        self.started_at = time.perf_counter()
+
+    def json(self):
+        return json.loads(bytes(self.body))
+
+
+async def request(app, method: str, path: str, params: dict | None = None, body=None,
+                  headers: dict | None = None, keep_body: bool = True) -> HTTPResult:
+    """
+    One ASGI HTTP request. `body` may be bytes, a JSON-able object,
+    or an async iterator of bytes (streamed as separate http.request chunks).
+    """
+    hdrs = dict(headers or {})
+    if body is not None and not isinstance(body, (bytes, bytearray)) and not hasattr(body, "__aiter__"):
+        body = json.dumps(body).encode()
+        hdrs.setdefault("content-type", "application/json")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(params or {}).encode(),
+        "headers": [(k.lower().encode(), str(v).encode()) for k, v in hdrs.items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    res = HTTPResult()
+    done = asyncio.Event()
+
+    async def chunks():
+        if body is None:
+            return
+        if hasattr(body, "__aiter__"):
+            async for c in body:
+                yield bytes(c)
+        else:
+            yield bytes(body)
+
+    it = chunks().__aiter__()
+    body_done = False
+
+    async def receive():
+        nonlocal body_done
+        if not body_done:
+            try:
+                c = await it.__anext__()
+                return {"type": "http.request", "body": c, "more_body": True}
+            except StopAsyncIteration:
+                body_done = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+        # як справжній сервер: disconnect лише після завершення відповіді
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        t = message["type"]
+        if t == "http.response.start":
+            res.status = message["status"]
+            res.headers = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif t == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk and res.first_byte_at is None:
+                res.first_byte_at = time.perf_counter()
+            res.body_bytes += len(chunk)
+            if keep_body:
+                res.body += chunk
+            if not message.get("more_body", False):
+                res.finished_at = time.perf_counter()
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return res
@@ -0,0 +1,133 @@
+"""
+Hot-query benchmark: ad-hoc ORM constructs (the old code path) vs app.dal.
+
+Offline (default) measures the Python-side cost that doesn't need a server:
+statement construction + cache key. With --live it also runs the queries
+against DATABASE_URL and reports CPU and wall time per call, which adds ORM
+hydration vs tuple rows and asyncpg prepared statement reuse.
+
+    python -m bench.dal --out runs/dal.json
+    python -m bench.dal --live --channel-id 1 --user-id 1 --out runs/dal_live.json
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from sqlalchemy import bindparam, select
+
+from app import dal
+from app.models import ChannelParticipant, Stream, PriorityPolicy
+from .report import write_result
+
+
+def _args(argv):
+    p = argparse.ArgumentParser(prog="python -m bench.dal")
+    p.add_argument("--iterations", type=int, default=20_000)
+    p.add_argument("--live", action="store_true")
+    p.add_argument("--channel-id", type=int, default=1)
+    p.add_argument("--user-id", type=int, default=1)
+    p.add_argument("--out", default=None)
+    return p.parse_args(argv)
+
+
+def _orm_member(c, u):
+    return select(ChannelParticipant).where(ChannelParticipant.channel_id == c, ChannelParticipant.user_id == u)
+
+
+def _orm_stream(c, u):
+    return select(Stream).where(Stream.channel_id == c, Stream.owner_user_id == u)
+
+
+def _orm_policy(sid):
+    return select(PriorityPolicy).where(PriorityPolicy.stream_id == sid, PriorityPolicy.enabled == True)  # noqa: E712
+
+
+# політики в застосунку читаються з app.policy_table; тут — лише для порівняння з ORM
+POLICY = (
+    select(PriorityPolicy.msg_rate_rps, PriorityPolicy.upload_bps, PriorityPolicy.download_bps, PriorityPolicy.burst)
+    .where(PriorityPolicy.stream_id == bindparam("stream_id"), PriorityPolicy.enabled.is_(True))
+    .limit(1)
+)
+
+
+async def _dal_policy(db, stream_id: int):
+    conn = await db.connection()
+    row = (await conn.execute(POLICY, {"stream_id": stream_id})).first()
+    return tuple(row) if row else None
+
+
+def offline(n: int) -> dict:
+    def run(fn) -> float:
+        t0 = time.process_time()
+        for i in range(n):
+            fn(i)
+        return (time.process_time() - t0) / n * 1e6
+
+    return {
+        "orm_build_and_key_us": {
+            "member": run(lambda i: _orm_member(1, i)._generate_cache_key()),
+            "stream": run(lambda i: _orm_stream(1, i)._generate_cache_key()),
+            "policy": run(lambda i: _orm_policy(i)._generate_cache_key()),
+        },
+        "dal_key_us": {
+            "member": run(lambda i: dal.IS_MEMBER._generate_cache_key()),
+            "stream": run(lambda i: dal.STREAM_ID._generate_cache_key()),
+            "policy": run(lambda i: POLICY._generate_cache_key()),
+        },
+    }
+
+
+async def live(n: int, channel_id: int, user_id: int) -> dict:
+    from app.db import async_session, engine
+
+    async def timed(fn) -> dict:
+        async with async_session() as db:
+            await fn(db)  # прогрів: конект, prepared statement
+            cpu0, t0 = time.process_time(), time.perf_counter()
+            for _ in range(n):
+                await fn(db)
+            return {
+                "cpu_us_per_call": (time.process_time() - cpu0) / n * 1e6,
+                "wall_us_per_call": (time.perf_counter() - t0) / n * 1e6,
+            }
+
+    async with async_session() as db:
+        sid, _ = await dal.stream_id(db, channel_id, user_id)
+        await db.commit()
+
+    async def orm_member(db):
+        (await db.execute(_orm_member(channel_id, user_id))).scalar_one_or_none()
+
+    async def orm_stream(db):
+        (await db.execute(_orm_stream(channel_id, user_id))).scalar_one_or_none()
+
+    async def orm_policy(db):
+        (await db.execute(_orm_policy(sid))).scalar_one_or_none()
+
+    out = {
+        "orm": {
+            "member": await timed(orm_member),
+            "stream": await timed(orm_stream),
+            "policy": await timed(orm_policy),
+        },
+        "dal": {
+            "member": await timed(lambda db: dal.is_member(db, channel_id, user_id)),
+            "stream": await timed(lambda db: dal.stream_id(db, channel_id, user_id)),
+            "policy": await timed(lambda db: _dal_policy(db, sid)),
+        },
+    }
+    await engine.dispose()
+    return out
+
+
+def main(argv=None):
+    a = _args(argv if argv is not None else sys.argv[1:])
+    metrics = {"offline": offline(a.iterations)}
+    if a.live:
+        metrics["live"] = asyncio.run(live(max(1, a.iterations // 10), a.channel_id, a.user_id))
+    write_result("dal", {k: v for k, v in vars(a).items() if k != "out"}, metrics, a.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+TokenBucket microbenchmark and accuracy suite (no Redis server needed).
+
+  * throughput: allow()/grant() calls/sec and Redis commands per call
+    against MemoryRedis;
+  * accuracy: long-run granted bytes vs rate * T + capacity for each policy,
+    driven by a virtual clock so wall-clock noise doesn't leak in;
+  * burst: K concurrent grantors draining one bucket at a frozen clock —
+    anything above `capacity` is over-grant.
+
+Run from src/:
+
+    python -m bench.limiter --out runs/limiter.json
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.memory_redis import MemoryRedis
+from app.rate_limiter import TokenBucket, RedisBackend, LocalBackend, HybridBackend
+from .report import write_result
+
+
+class VirtualClock:
+    def __init__(self, start: float = 1_000_000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, dt: float):
+        self.now += dt
+
+
+def _args(argv):
+    p = argparse.ArgumentParser(prog="python -m bench.limiter")
+    p.add_argument("--calls", type=int, default=20_000, help="calls per throughput run")
+    p.add_argument("--bps", default="65536,262144,1048576,10485760", help="policies for the accuracy run")
+    p.add_argument("--seconds", type=float, default=600.0, help="virtual seconds per accuracy run")
+    p.add_argument("--tick-hz", type=float, default=50.0, help="tick size = bps / tick_hz (as in files.py)")
+    p.add_argument("--rtt", type=float, default=0.0005, help="virtual seconds per limiter call")
+    p.add_argument("--grantors", default="1,4,16,64", help="concurrent grantors for the burst run")
+    p.add_argument("--backends", default="redis,local,hybrid", help="redis = RedisBackend on MemoryRedis")
+    p.add_argument("--out", default=None)
+    return p.parse_args(argv)
+
+
+def make_bucket(clock=time.time, latency: float = 0.0, backend: str = "redis") -> tuple[TokenBucket, MemoryRedis]:
+    r = MemoryRedis(clock=clock, latency=latency)
+    if backend == "local":
+        return TokenBucket(LocalBackend(), clock=clock), r
+    if backend == "hybrid":
+        return TokenBucket(HybridBackend(RedisBackend(r), LocalBackend(), timeout=1.0, cooldown=5.0), clock=clock), r
+    return TokenBucket(r, clock=clock), r
+
+
+async def throughput(calls: int, backend: str) -> dict:
+    out = {}
+    for api in ("allow", "grant"):
+        tb, r = make_bucket(backend=backend)
+        key = TokenBucket.key(1, "bench")
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        for _ in range(calls):
+            if api == "allow":
+                await tb.allow(key, rate=1e9, capacity=1e9, cost=1.0)
+            else:
+                await tb.grant(key, rate=1e9, capacity=1e9, want=1024.0)
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+        out[api] = {
+            "calls_per_sec": calls / wall,
+            "cpu_us_per_call": cpu / calls * 1e6,
+            "redis_cmds_per_call": sum(r.calls.values()) / calls,
+            "redis_cmds": dict(r.calls),
+        }
+    return out
+
+
+async def accuracy(bps: int, seconds: float, tick_hz: float, rtt: float, backend: str) -> dict:
+    # той самий режим, що в upload_raw / download_file: capacity = 2 * bps,
+    # споживач одразу просить наступні tick_bytes і спить 5 мс, якщо отримав 0
+    clock = VirtualClock()
+    tb, r = make_bucket(clock, backend=backend)
+    key = TokenBucket.key(1, "up")
+    capacity = max(1, bps * 2)
+    tick_bytes = min(max(1024, int(bps / tick_hz)), 64 * 1024, capacity)
+
+    granted = 0
+    zero_grants = 0
+    calls = 0
+    end = clock.now + seconds
+    while clock.now < end:
+        g = await tb.grant(key, rate=float(bps), capacity=float(capacity), want=float(tick_bytes))
+        calls += 1
+        granted += g
+        clock.advance(rtt)
+        if g == 0:
+            zero_grants += 1
+            clock.advance(0.005)
+
+    expected = bps * seconds + capacity
+    return {
+        "bps": bps,
+        "virtual_seconds": seconds,
+        "granted": granted,
+        "expected_max": expected,
+        "deviation_pct": (granted - expected) / expected * 100.0,
+        "steady_bps": (granted - capacity) / seconds,
+        "calls": calls,
+        "zero_grants": zero_grants,
+        "mean_grant_bytes": granted / calls,
+        "redis_cmds_per_grant": sum(r.calls.values()) / calls,
+    }
+
+
+async def burst(grantors: int, backend: str, capacity: float = 100_000.0, want: float = 1024.0) -> dict:
+    # годинник заморожено: більше ніж capacity видавати не можна взагалі
+    clock = VirtualClock()
+    tb, r = make_bucket(clock, backend=backend)
+    key = TokenBucket.key(1, "down")
+    total = 0
+
+    async def worker():
+        nonlocal total
+        misses = 0
+        while misses < 3:
+            g = await tb.grant(key, rate=1.0, capacity=capacity, want=want)
+            if g:
+                total += g
+                misses = 0
+            else:
+                misses += 1
+
+    await asyncio.gather(*(worker() for _ in range(grantors)))
+    return {
+        "grantors": grantors,
+        "capacity": capacity,
+        "granted": total,
+        "over_grant_ratio": total / capacity,
+    }
+
+
+async def main_async(a) -> dict:
+    out = {}
+    for be in [b.strip() for b in a.backends.split(",") if b.strip()]:
+        out[be] = {
+            "throughput": await throughput(a.calls, be),
+            "accuracy": [await accuracy(int(b), a.seconds, a.tick_hz, a.rtt, be) for b in a.bps.split(",") if b.strip()],
+            "burst": [await burst(int(k), be) for k in a.grantors.split(",") if k.strip()],
+        }
+    return out
+
+
+def main(argv=None):
+    a = _args(argv if argv is not None else sys.argv[1:])
+    metrics = asyncio.run(main_async(a))
+    write_result("limiter", {k: v for k, v in vars(a).items() if k != "out"}, metrics, a.out)
+
+
+if __name__ == "__main__":
+    main()
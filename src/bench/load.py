@@ -0,0 +1,264 @@
+"""
+End-to-end load harness.
+
+Boots the app in-process against DATABASE_URL / REDIS_URL (point them at a
+local Postgres/Redis), provisions a fresh channel with N members through the
+admin API, then runs:
+
+  * messages: N WebSocket clients join the channel and send_message;
+    reports accepted msgs/sec, delivered frames/sec, fan-out latency
+    (send -> message.new at every subscriber) and CPU per message;
+  * transfers: concurrent upload_raw / download_file for each bps policy;
+    reports achieved bps vs configured (raw and burst-adjusted error).
+
+Run from src/:
+
+    python -m bench.load --clients 50 --messages 20 --bps 65536,262144 --out runs/before.json
+    python -m bench.report runs/before.json runs/after.json
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from .asgi import WSClient, request
+from .report import summarize, write_result
+
+
+def _args(argv):
+    p = argparse.ArgumentParser(prog="python -m bench.load")
+    p.add_argument("--clients", type=int, default=20)
+    p.add_argument("--messages", type=int, default=20, help="messages per client")
+    p.add_argument("--send-rps", type=float, default=0.0, help="per-client send rate, 0 = as fast as possible")
+    p.add_argument("--msg-policy-rps", type=int, default=10_000, help="msg_rate_rps set on every bench stream")
+    p.add_argument("--bps", default="65536,262144,1048576", help="comma separated upload/download policies")
+    p.add_argument("--transfers", type=int, default=4, help="concurrent transfers per policy")
+    p.add_argument("--file-size", type=int, default=512 * 1024)
+    p.add_argument("--user-base", type=int, default=900_000)
+    p.add_argument("--skip-messages", action="store_true")
+    p.add_argument("--skip-transfers", action="store_true")
+    p.add_argument("--create-schema", action="store_true", help="Base.metadata.create_all before the run")
+    p.add_argument("--out", default=None, help="write JSON result here")
+    return p.parse_args(argv)
+
+
+async def _ok(res, what: str):
+    if res.status >= 400:
+        raise RuntimeError(f"{what}: HTTP {res.status} {bytes(res.body)[:200]!r}")
+    return res.json()
+
+
+async def provision(app, n_users: int, user_base: int, msg_rps: int) -> tuple[int, dict[int, int]]:
+    ch = await _ok(await request(app, "POST", "/admin/channels",
+                                 body={"name": f"bench-{int(time.time())}", "is_group": True}), "create channel")
+    cid = ch["id"]
+    for i in range(n_users):
+        await _ok(await request(app, "POST", f"/admin/channels/{cid}/participants",
+                                params={"user_id": user_base + i}), "add participant")
+    await _ok(await request(app, "POST", f"/admin/channels/{cid}/ensure_streams"), "ensure streams")
+    streams = await _ok(await request(app, "GET", f"/admin/streams/{cid}"), "list streams")
+    by_owner = {s["owner_user_id"]: s["id"] for s in streams}
+    for sid in by_owner.values():
+        await set_policy(app, sid, msg_rps=msg_rps)
+    return cid, by_owner
+
+
+async def set_policy(app, stream_id: int, msg_rps: int = 10_000, up_bps: int = 262_144,
+                     down_bps: int = 524_288, burst: int = 10_000):
+    await _ok(await request(app, "PUT", f"/admin/streams/{stream_id}/policy", body={
+        "msg_rate_rps": msg_rps, "upload_bps": up_bps, "download_bps": down_bps,
+        "burst": burst, "enabled": True,
+    }), "upsert policy")
+
+
+async def run_messages(app, cid: int, users: list[int], per_client: int, send_rps: float) -> dict:
+    clients = [WSClient(app, "/ws", {"user_id": uid}) for uid in users]
+    for c in clients:
+        await c.connect()
+    for c in clients:
+        c.send({"action": "join_channel", "channel_id": cid})
+    for c in clients:
+        await c.recv_type("joined")
+
+    sent_at: dict[str, float] = {}
+    latencies: list[float] = []
+    counts = {"delivered": 0, "throttled": 0, "errors": 0}
+    expected = {"n": 0}
+    all_done = asyncio.Event()
+
+    async def drain(c: WSClient):
+        while True:
+            try:
+                ts, ev = await c.recv(timeout=3600)
+            except asyncio.TimeoutError:
+                return
+            t = ev.get("type")
+            if t == "message.new":
+                t0 = sent_at.get(ev["message"].get("content") or "")
+                if t0 is not None:
+                    latencies.append(ts - t0)
+                counts["delivered"] += 1
+            elif t == "throttled":
+                counts["throttled"] += 1
+            elif t == "error":
+                counts["errors"] += 1
+            else:
+                continue
+            # відхилене повідомлення не дійде до жодного з N підписників
+            lost = (counts["throttled"] + counts["errors"]) * len(clients)
+            if expected["n"] and counts["delivered"] + lost >= expected["n"]:
+                all_done.set()
+
+    drains = [asyncio.create_task(drain(c)) for c in clients]
+
+    async def sender(idx: int, c: WSClient):
+        gap = 1.0 / send_rps if send_rps > 0 else 0.0
+        for n in range(per_client):
+            tag = f"bench:{idx}:{n}"
+            sent_at[tag] = time.perf_counter()
+            c.send({"action": "send_message", "payload": {"channel_id": cid, "content": tag}})
+            await asyncio.sleep(gap)
+
+    total_msgs = len(clients) * per_client
+    expected["n"] = total_msgs * len(clients)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(sender(i, c) for i, c in enumerate(clients)))
+    try:
+        await asyncio.wait_for(all_done.wait(), timeout=max(30.0, total_msgs / 50.0))
+    except asyncio.TimeoutError:
+        pass
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+
+    for d in drains:
+        d.cancel()
+    for c in clients:
+        await c.close()
+
+    accepted = total_msgs - counts["throttled"] - counts["errors"]
+    return {
+        "clients": len(clients),
+        "sent": total_msgs,
+        "accepted": accepted,
+        "throttled": counts["throttled"],
+        "errors": counts["errors"],
+        "delivered": counts["delivered"],
+        "wall_s": wall,
+        "msgs_per_sec": accepted / wall if wall else None,
+        "deliveries_per_sec": counts["delivered"] / wall if wall else None,
+        "fanout_latency_ms": summarize(latencies, scale=1000.0),
+        # увага: in-process — сюди входить і CPU фейкових клієнтів
+        "cpu_us_per_msg": cpu / accepted * 1e6 if accepted else None,
+        "cpu_us_per_delivery": cpu / counts["delivered"] * 1e6 if counts["delivered"] else None,
+    }
+
+
+async def _payload(size: int, chunk: int = 64 * 1024):
+    block = os.urandom(chunk)
+    left = size
+    while left > 0:
+        n = min(chunk, left)
+        yield block[:n]
+        left -= n
+        await asyncio.sleep(0)
+
+
+def _pacing(size: int, elapsed: float, bps: int) -> dict:
+    # бакет стартує повним (capacity = 2 * bps), тож перші байти йдуть без пауз
+    capacity = 2 * bps
+    expected = max(0.0, size - capacity) / bps
+    achieved = size / elapsed if elapsed > 0 else None
+    return {
+        "elapsed_s": elapsed,
+        "expected_s": expected,
+        "achieved_bps": achieved,
+        "error_pct": (elapsed - expected) / expected * 100.0 if expected > 0 else None,
+    }
+
+
+async def run_transfers(app, cid: int, users: list[int], streams: dict[int, int],
+                        policies: list[int], concurrency: int, size: int) -> list[dict]:
+    out = []
+    for bps in policies:
+        uploaders = users[:concurrency]
+        downloaders = users[concurrency:2 * concurrency] or uploaders
+        for uid in set(uploaders) | set(downloaders):
+            await set_policy(app, streams[uid], up_bps=bps, down_bps=bps)
+
+        async def up(uid: int):
+            t0 = time.perf_counter()
+            res = await request(app, "PUT", "/files/upload_raw", params={
+                "channel_id": cid, "user_id": uid, "filename": f"bench_{uid}_{bps}.bin", "size": size,
+            }, body=_payload(size))
+            body = await _ok(res, "upload_raw")
+            return body["attachment_id"], time.perf_counter() - t0
+
+        cpu0 = time.process_time()
+        ups = await asyncio.gather(*(up(u) for u in uploaders))
+        up_cpu = time.process_time() - cpu0
+
+        async def down(uid: int, att_id: int):
+            t0 = time.perf_counter()
+            res = await request(app, "GET", f"/files/{att_id}/download", params={"user_id": uid}, keep_body=False)
+            if res.status >= 400 or res.body_bytes != size:
+                raise RuntimeError(f"download {att_id}: HTTP {res.status}, {res.body_bytes} bytes")
+            return time.perf_counter() - t0, (res.first_byte_at or t0) - t0
+
+        cpu0 = time.process_time()
+        downs = await asyncio.gather(*(down(d, a) for d, (a, _) in zip(downloaders, ups)))
+        down_cpu = time.process_time() - cpu0
+
+        out.append({
+            "bps": bps,
+            "size": size,
+            "concurrency": concurrency,
+            "upload": [_pacing(size, e, bps) for _, e in ups],
+            "download": [dict(_pacing(size, e, bps), ttfb_ms=ttfb * 1000.0) for e, ttfb in downs],
+            "upload_error_pct": summarize([_pacing(size, e, bps)["error_pct"] or 0.0 for _, e in ups]),
+            "download_error_pct": summarize([_pacing(size, e, bps)["error_pct"] or 0.0 for e, _ in downs]),
+            "cpu_us_per_mb_up": up_cpu / (size * len(ups) / 1e6) * 1e6,
+            "cpu_us_per_mb_down": down_cpu / (size * len(downs) / 1e6) * 1e6,
+        })
+    return out
+
+
+async def main_async(a) -> dict:
+    from app.main import app
+    from app.db import engine, Base
+    from app import partitions
+
+    policies = [int(x) for x in a.bps.split(",") if x.strip()]
+    n_users = max(a.clients, 2 * a.transfers)
+    metrics: dict = {}
+    async with app.router.lifespan_context(app):
+        if a.create_schema:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            # messages щойно створена як партиціонована без жодної партиції, а цикл
+            # обслуговування вже відпрацював до неї й спить — партиції потрібні зараз
+            await partitions.maintain()
+        cid, streams = await provision(app, n_users, a.user_base, a.msg_policy_rps)
+        users = sorted(streams)
+        if not a.skip_messages:
+            metrics["messages"] = await run_messages(app, cid, users[:a.clients], a.messages, a.send_rps)
+        if not a.skip_transfers:
+            metrics["transfers"] = await run_transfers(app, cid, users, streams, policies, a.transfers, a.file_size)
+    await engine.dispose()
+    return metrics
+
+
+def main(argv=None):
+    a = _args(argv if argv is not None else sys.argv[1:])
+    os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="bench_uploads_"))
+    os.environ.setdefault("DEV_MODE", "false")
+    metrics = asyncio.run(main_async(a))
+    params = {k: v for k, v in vars(a).items() if k != "out"}
+    params["database_url"] = os.environ.get("DATABASE_URL", "<default>").rsplit("@", 1)[-1]
+    params["redis_url"] = os.environ.get("REDIS_URL", "<default>")
+    write_result("load", params, metrics, a.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Result helpers shared by bench scripts: percentiles, JSON output, run comparison.
+
+    python -m bench.report before.json after.json
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    xs = sorted(values)
+    k = (len(xs) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def summarize(values: list[float], scale: float = 1.0) -> dict:
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) * scale,
+        "p50": percentile(values, 50) * scale,
+        "p90": percentile(values, 90) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale,
+    }
+
+
+def _git_rev() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def write_result(name: str, params: dict, metrics: dict, out: str | None = None) -> dict:
+    doc = {
+        "bench": name,
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git": _git_rev(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "metrics": metrics,
+    }
+    text = json.dumps(doc, indent=2, sort_keys=True, default=str)
+    if out:
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return doc
+
+
+def _flatten(prefix: str, obj, out: dict):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            _flatten(f"{prefix}.{k}" if prefix else str(k), v, out)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            _flatten(f"{prefix}[{i}]", v, out)
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = float(obj)
+
+
+def compare(before: dict, after: dict) -> list[tuple[str, float, float, float | None]]:
+    a, b = {}, {}
+    _flatten("", before.get("metrics", {}), a)
+    _flatten("", after.get("metrics", {}), b)
+    rows = []
+    for k in sorted(set(a) & set(b)):
+        delta = (b[k] - a[k]) / a[k] * 100.0 if a[k] else None
+        rows.append((k, a[k], b[k], delta))
+    return rows
+
+
+def main(argv: list[str]):
+    if len(argv) != 2:
+        print("usage: python -m bench.report BEFORE.json AFTER.json", file=sys.stderr)
+        sys.exit(2)
+    with open(argv[0]) as f:
+        before = json.load(f)
+    with open(argv[1]) as f:
+        after = json.load(f)
+    if before.get("params") != after.get("params"):
+        print("warning: params differ between runs", file=sys.stderr)
+    width = max((len(k) for k, *_ in compare(before, after)), default=10)
+    for k, x, y, d in compare(before, after):
+        ds = "" if d is None else f"{d:+8.1f}%"
+        print(f"{k:<{width}}  {x:>14.4f}  {y:>14.4f}  {ds}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])